@@ -57,7 +57,12 @@ export function Queues({ info }) {
           itemLayout="vertical"
           dataSource={info}
           renderItem={([name, queue]) => (
-            <List.Item extra={<span className="badge">{queue.size}</span>}>{name}</List.Item>
+            <List.Item extra={<span className="badge">{queue.size}</span>}>
+              {name}
+              {queue.oldest_job_age > 0 && (
+                <span className="text-muted"> (oldest job waiting {Math.round(queue.oldest_job_age)}s)</span>
+              )}
+            </List.Item>
           )}
         />
       )}
@@ -92,6 +97,22 @@ export function Manager({ info }) {
       ]
     : [];
 
+  if (info && info.backpressureDeferredCount !== undefined) {
+    items.push(
+      <List.Item extra={<span className="badge">{info.backpressureDeferredCount}</span>}>
+        Queries Deferred by Queue Backpressure
+      </List.Item>
+    );
+  }
+
+  if (info && info.savedWorkerHours !== undefined) {
+    items.push(
+      <List.Item extra={<span className="badge">{info.savedWorkerHours}</span>}>
+        Worker Hours Saved by Demand-Driven Scheduling
+      </List.Item>
+    );
+  }
+
   return (
     <Card title="Manager" size="small">
       {!info && <div className="text-muted text-center">No data</div>}
@@ -49,6 +49,8 @@ class SystemStatus extends React.Component {
             startedAt: data.manager.started_at * 1000,
             lastRefreshAt: data.manager.last_refresh_at * 1000,
             outdatedQueriesCount: data.manager.outdated_queries_count,
+            backpressureDeferredCount: data.manager.backpressure_deferred_count,
+            savedWorkerHours: data.manager.saved_worker_hours,
           },
           databaseMetrics: data.database_metrics.metrics || [],
           status: omit(data, ["workers", "manager", "database_metrics"]),
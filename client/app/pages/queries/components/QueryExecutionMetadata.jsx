@@ -12,6 +12,21 @@ import { durationHumanize, pluralize, prettySize } from "@/lib/utils";
 
 import "./QueryExecutionMetadata.less";
 
+function timingsTooltip(timings) {
+  if (!timings) {
+    return null;
+  }
+  return (
+    <React.Fragment>
+      {Object.entries(timings).map(([phase, seconds]) => (
+        <div key={phase}>
+          {phase.replace(/_/g, " ")}: {durationHumanize(seconds)}
+        </div>
+      ))}
+    </React.Fragment>
+  );
+}
+
 export default function QueryExecutionMetadata({
   query,
   queryResult,
@@ -61,10 +76,12 @@ export default function QueryExecutionMetadata({
         </span>
         <span className="m-l-5">
           {!isQueryExecuting && (
-            <React.Fragment>
-              <strong>{durationHumanize(queryResultData.runtime)}</strong>
-              <span className="hidden-xs"> runtime</span>
-            </React.Fragment>
+            <Tooltip title={timingsTooltip(queryResultData.metadata.timings)}>
+              <span>
+                <strong>{durationHumanize(queryResultData.runtime)}</strong>
+                <span className="hidden-xs"> runtime</span>
+              </span>
+            </Tooltip>
           )}
           {isQueryExecuting && <span>Running&hellip;</span>}
         </span>
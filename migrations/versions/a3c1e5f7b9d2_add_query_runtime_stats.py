@@ -0,0 +1,49 @@
+"""add query_runtime_stats table
+
+Revision ID: a3c1e5f7b9d2
+Revises: 7205816877ec
+Create Date: 2026-10-19 10:12:41.318275
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "a3c1e5f7b9d2"
+down_revision = "7205816877ec"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "query_runtime_stats",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("org_id", sa.Integer(), nullable=False),
+        sa.Column("data_source_id", sa.Integer(), nullable=False),
+        sa.Column("query_hash", sa.String(length=32), nullable=False),
+        sa.Column("run_count", sa.Integer(), nullable=False),
+        sa.Column("failure_count", sa.Integer(), nullable=False),
+        sa.Column("total_runtime", postgresql.DOUBLE_PRECISION(), nullable=False),
+        sa.Column("p50_runtime", postgresql.DOUBLE_PRECISION(), nullable=True),
+        sa.Column("p95_runtime", postgresql.DOUBLE_PRECISION(), nullable=True),
+        sa.Column("last_runtime", postgresql.DOUBLE_PRECISION(), nullable=True),
+        sa.Column("last_row_count", sa.Integer(), nullable=True),
+        sa.Column("last_result_bytes", sa.BigInteger(), nullable=True),
+        sa.Column("recent_runs", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column("last_run_at", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["org_id"], ["organizations.id"]),
+        sa.ForeignKeyConstraint(["data_source_id"], ["data_sources.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("data_source_id", "query_hash", name="unique_query_runtime_stats"),
+    )
+    op.create_index(
+        "ix_query_runtime_stats_total_runtime", "query_runtime_stats", ["org_id", "total_runtime"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("ix_query_runtime_stats_total_runtime", table_name="query_runtime_stats")
+    op.drop_table("query_runtime_stats")
@@ -0,0 +1,28 @@
+"""add queries.next_run_at
+
+Revision ID: b5d2f8a1c4e6
+Revises: a3c1e5f7b9d2
+Create Date: 2026-10-19 14:05:12.481903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b5d2f8a1c4e6"
+down_revision = "a3c1e5f7b9d2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("queries", sa.Column("next_run_at", sa.DateTime(timezone=True), nullable=True))
+    op.create_index(op.f("ix_queries_next_run_at"), "queries", ["next_run_at"], unique=False)
+    # Make every scheduled query due for evaluation, the scheduler computes the actual next run on its first pass.
+    op.execute("UPDATE queries SET next_run_at = now() WHERE schedule IS NOT NULL AND jsonb_typeof(schedule) != 'null'")
+
+
+def downgrade():
+    op.drop_index(op.f("ix_queries_next_run_at"), table_name="queries")
+    op.drop_column("queries", "next_run_at")
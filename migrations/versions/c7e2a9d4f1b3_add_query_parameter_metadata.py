@@ -0,0 +1,26 @@
+"""add queries.parameter_metadata
+
+Revision ID: c7e2a9d4f1b3
+Revises: b5d2f8a1c4e6
+Create Date: 2026-10-19 16:42:08.215733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "c7e2a9d4f1b3"
+down_revision = "b5d2f8a1c4e6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in as queries are saved, or at once with `manage queries backfill_parameter_metadata`.
+    op.add_column("queries", sa.Column("parameter_metadata", postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade():
+    op.drop_column("queries", "parameter_metadata")
@@ -0,0 +1,40 @@
+"""add trigram indexes to queries.name and queries.description
+
+Revision ID: d3f6b8a2e5c1
+Revises: c7e2a9d4f1b3
+Create Date: 2026-10-19 18:05:37.602941
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "d3f6b8a2e5c1"
+down_revision = "c7e2a9d4f1b3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        "ix_queries_name_trgm",
+        "queries",
+        ["name"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"},
+    )
+    op.create_index(
+        "ix_queries_description_trgm",
+        "queries",
+        ["description"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"description": "gin_trgm_ops"},
+    )
+
+
+def downgrade():
+    op.drop_index("ix_queries_description_trgm", table_name="queries")
+    op.drop_index("ix_queries_name_trgm", table_name="queries")
@@ -0,0 +1,91 @@
+"""partition events by month and add events_daily_counts
+
+The existing events aren't copied: the events table becomes the default partition of the new one, and the monthly
+partitions start next month. The events table is still locked while the migration reads it through a few times (to
+fill in and check created_at, and to index the new primary key), so expect recording events to be down for about as
+long as indexing the table takes. This month's events keep going to the default partition until the month is over,
+and the old ones are deleted from it in batches as they pass `REDASH_EVENTS_RETENTION_DAYS`, until the whole partition
+is past it and gets dropped.
+
+Revision ID: e8a4c2f7b9d3
+Revises: d3f6b8a2e5c1
+Create Date: 2026-10-19 19:31:12.418530
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+from pytz import utc
+
+from redash import settings
+
+
+# revision identifiers, used by Alembic.
+revision = "e8a4c2f7b9d3"
+down_revision = "d3f6b8a2e5c1"
+branch_labels = None
+depends_on = None
+
+
+def create_monthly_partitions(since, until):
+    month = datetime(since.year, since.month, 1, tzinfo=utc)
+    while month <= until:
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        op.execute(
+            "CREATE TABLE events_y{:04d}m{:02d} PARTITION OF events FOR VALUES FROM ('{}') TO ('{}')".format(
+                month.year, month.month, month.isoformat(), next_month.isoformat()
+            )
+        )
+        month = next_month
+
+
+def upgrade():
+    now = datetime.now(utc)
+    next_month = (datetime(now.year, now.month, 1, tzinfo=utc) + timedelta(days=32)).replace(day=1)
+
+    op.execute("ALTER TABLE events RENAME TO events_default")
+    op.execute("UPDATE events_default SET created_at = now() WHERE created_at IS NULL")
+    # Lets Postgres skip scanning the default partition when setting created_at NOT NULL and creating the monthly
+    # partitions, which it otherwise does for each to make sure none of its events belong there
+    op.execute(
+        "ALTER TABLE events_default ADD CONSTRAINT events_default_before_partitions "
+        "CHECK (created_at IS NOT NULL AND created_at < '{}')".format(next_month.isoformat())
+    )
+    op.execute("ALTER TABLE events_default ALTER COLUMN created_at SET NOT NULL")
+    op.execute("ALTER TABLE events_default DROP CONSTRAINT events_pkey, ADD PRIMARY KEY (id, created_at)")
+
+    op.execute("CREATE TABLE events (LIKE events_default INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    op.execute("ALTER TABLE events ADD PRIMARY KEY (id, created_at)")
+    op.execute("ALTER SEQUENCE events_id_seq OWNED BY events.id")
+    op.execute("ALTER TABLE events ATTACH PARTITION events_default DEFAULT")
+    op.create_foreign_key(None, "events", "organizations", ["org_id"], ["id"])
+    op.create_foreign_key(None, "events", "users", ["user_id"], ["id"])
+
+    create_monthly_partitions(next_month, now + timedelta(days=31 * settings.EVENTS_PARTITIONS_AHEAD))
+    op.execute("ALTER TABLE events_default DROP CONSTRAINT events_default_before_partitions")
+
+    op.create_table(
+        "events_daily_counts",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("org_id", sa.Integer(), nullable=False),
+        sa.Column("action", sa.String(length=255), nullable=False),
+        sa.Column("object_type", sa.String(length=255), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["org_id"], ["organizations.id"]),
+        sa.PrimaryKeyConstraint("day", "org_id", "action", "object_type"),
+    )
+
+
+def downgrade():
+    op.drop_table("events_daily_counts")
+
+    op.execute("ALTER TABLE events RENAME TO events_partitioned")
+    op.execute("ALTER INDEX events_pkey RENAME TO events_partitioned_pkey")
+    op.execute("CREATE TABLE events (LIKE events_partitioned INCLUDING DEFAULTS)")
+    op.execute("ALTER TABLE events ADD PRIMARY KEY (id)")
+    op.create_foreign_key(None, "events", "organizations", ["org_id"], ["id"])
+    op.create_foreign_key(None, "events", "users", ["user_id"], ["id"])
+    op.execute("ALTER SEQUENCE events_id_seq OWNED BY events.id")
+    op.execute("INSERT INTO events SELECT * FROM events_partitioned")
+    op.execute("DROP TABLE events_partitioned")
@@ -7,6 +7,7 @@ from urllib.parse import urlsplit, urlunsplit
 
 from flask import jsonify, redirect, request, session, url_for
 from flask_login import LoginManager, login_user, logout_user, user_logged_in
+from sqlalchemy.orm import make_transient_to_detached
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import select
 from werkzeug.exceptions import Unauthorized
@@ -106,32 +107,110 @@ def hmac_load_user_from_request(request):
     return None
 
 
-def get_user_from_api_key(api_key, query_id):
-    if not api_key:
-        return None
-
+def resolve_api_key(api_key, query_id, org):
+    """
+    Returns the user an API key belongs to and its principal (what `user_from_principal` needs to get it back).
+    """
     user = None
+    principal = None
 
     # TODO: once we switch all api key storage into the ApiKey model, this code will be much simplified
-    org = current_org._get_current_object()
     try:
         user = models.User.get_by_api_key_and_org(api_key, org)
         if user.is_disabled:
             user = None
+        else:
+            principal = {"user_id": user.id, "org_id": user.org_id, "group_ids": list(user.group_ids or [])}
     except models.NoResultFound:
         try:
-            api_key = models.ApiKey.get_by_api_key(api_key)
-            user = models.ApiUser(api_key, api_key.org, [])
+            api_key_object = models.ApiKey.get_by_api_key(api_key)
+            user = models.ApiUser(api_key_object, api_key_object.org, [])
+            principal = {
+                "api_key_id": api_key_object.id,
+                "org_id": api_key_object.org_id,
+                "object_type": api_key_object.object_type,
+                "object_id": api_key_object.object_id,
+            }
         except models.NoResultFound:
             if query_id:
                 query = models.Query.get_by_id_and_org(query_id, org)
                 if query and query.api_key == api_key:
+                    group_ids = list(query.groups.keys())
                     user = models.ApiUser(
                         api_key,
                         query.org,
-                        list(query.groups.keys()),
+                        group_ids,
                         name="ApiKey: Query {}".format(query.id),
                     )
+                    principal = {"query_id": query.id, "group_ids": group_ids}
+
+    return user, principal
+
+
+def _detached_instance(model, **attributes):
+    """
+    Returns the `model` instance with the given attributes as if it was loaded from the database, without querying it.
+    Its other attributes are loaded on first use.
+    """
+    instance = model(**attributes)
+    make_transient_to_detached(instance)
+    return models.db.session.merge(instance, load=False)
+
+
+def user_from_principal(principal, api_key, query_id, org):
+    """
+    Rebuilds the user of a cached principal without querying the database. Only enabled users and active keys are
+    cached, and changing them invalidates the cache.
+    """
+    if "user_id" in principal:
+        return _detached_instance(
+            models.User,
+            id=principal["user_id"],
+            org_id=principal["org_id"],
+            group_ids=list(principal["group_ids"]),
+            api_key=api_key,
+            disabled_at=None,
+        )
+    elif "api_key_id" in principal:
+        api_key_object = _detached_instance(
+            models.ApiKey,
+            id=principal["api_key_id"],
+            org_id=principal["org_id"],
+            api_key=api_key,
+            active=True,
+            object_type=principal["object_type"],
+            object_id=principal["object_id"],
+        )
+        return models.ApiUser(api_key_object, api_key_object.org, [])
+    elif query_id and str(principal["query_id"]) == str(query_id):
+        return models.ApiUser(
+            api_key,
+            org,
+            principal["group_ids"],
+            name="ApiKey: Query {}".format(principal["query_id"]),
+        )
+
+    return None
+
+
+def get_user_from_api_key(api_key, query_id):
+    if not api_key:
+        return None
+
+    org = current_org._get_current_object()
+    if not settings.API_KEY_CACHE_TTL:
+        return resolve_api_key(api_key, query_id, org)[0]
+
+    version = models.api_key_principals.version()
+    principal = models.api_key_principals.get(api_key, org.id, version)
+    if principal is not None:
+        user = user_from_principal(principal, api_key, query_id, org)
+        if user is not None:
+            return user
+
+    user, principal = resolve_api_key(api_key, query_id, org)
+    if principal is not None:
+        models.api_key_principals.set(api_key, org.id, version, principal)
 
     return user
 
@@ -211,7 +290,7 @@ def log_user_logged_in(app, user):
         "ip": request.remote_addr,
     }
 
-    record_event.delay(event)
+    record_event(event)
 
 
 @login_manager.unauthorized_handler
@@ -1,4 +1,6 @@
-from click import argument
+from datetime import timedelta
+
+from click import argument, option
 from flask.cli import AppGroup
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -62,3 +64,142 @@ def remove_tag(query_id, tag):
     models.db.session.commit()
 
     print("Tag removed.")
+
+
+@manager.command(name="runtime_report")
+@option("--org", "organization", default=None, help="The organization slug (leave blank for all).")
+@option("--data-source-id", "data_source_id", type=int, default=None, help="Only report on this data source.")
+@option("--limit", default=20, help="Number of query hashes to report on.")
+def runtime_report(organization=None, data_source_id=None, limit=20):
+    """Lists the queries that consumed the most worker time."""
+    from sqlalchemy.sql.expression import select
+
+    from redash import models
+
+    query = select(models.QueryRuntimeStats)
+    if organization:
+        org = models.Organization.get_by_slug(organization)
+        query = query.where(models.QueryRuntimeStats.org_id == org.id)
+    if data_source_id is not None:
+        query = query.where(models.QueryRuntimeStats.data_source_id == data_source_id)
+
+    stats = models.db.session.scalars(query.order_by(models.QueryRuntimeStats.total_runtime.desc()).limit(limit))
+
+    print(
+        "{:>14} {:>6} {:>6} {:>9} {:>9} {:>10} {:>12}  {}".format(
+            "worker-seconds", "runs", "fails", "p50", "p95", "rows", "bytes", "data source / query hash"
+        )
+    )
+    for s in stats:
+        print(
+            "{:>14.1f} {:>6} {:>6} {:>9.2f} {:>9.2f} {:>10} {:>12}  {}/{}".format(
+                s.total_runtime,
+                s.run_count,
+                s.failure_count,
+                s.p50_runtime or 0,
+                s.p95_runtime or 0,
+                s.last_row_count if s.last_row_count is not None else "-",
+                s.last_result_bytes if s.last_result_bytes is not None else "-",
+                s.data_source_id,
+                s.query_hash,
+            )
+        )
+
+
+@manager.command(name="schedule_load")
+@option("--org", "organization", default=None, help="The organization slug (leave blank for all).")
+@option("--bucket", default=60, help="Size of the load curve buckets, in seconds.")
+@option(
+    "--window", type=int, default=None, help="Jitter window to simulate (defaults to REDASH_SCHEDULE_JITTER_WINDOW)."
+)
+@option("--smooth", is_flag=True, default=False, help="Move interval based schedules to less loaded slots.")
+@option("--apply", "apply_", is_flag=True, default=False, help="Save the slots picked by --smooth.")
+@option("--reset", is_flag=True, default=False, help="Remove all saved slots.")
+@option("--rows", default=24, help="Number of rows of the load curve.")
+def schedule_load(organization=None, bucket=60, window=None, smooth=False, apply_=False, reset=False, rows=24):
+    """Simulates the scheduled queries load over the next 24 hours, with and without jitter and smoothing."""
+    from redash import models, settings
+    from redash.tasks.queries import smoothing
+
+    if reset:
+        print("Removed the slots of {} queries.".format(smoothing.clear_phases()))
+        return
+
+    org = models.Organization.get_by_slug(organization) if organization else None
+    window = settings.SCHEDULE_JITTER_WINDOW if window is None else window
+    queries = smoothing.simulated_queries(org)
+    start, end = smoothing.simulation_window(bucket)
+
+    if smooth:
+        phases = smoothing.assign_phases(queries, start, end, bucket, window)
+    elif settings.SCHEDULE_SMOOTHING_ENABLED:
+        phases = models.scheduled_queries_phases.get([q.id for q in queries])
+    else:
+        phases = {}
+
+    before = smoothing.load_curve(queries, start, end, bucket)
+    after = smoothing.load_curve(queries, start, end, bucket, models.schedule_offsets(queries, window, phases))
+
+    per_row = max(1, len(before) // rows)
+    scale = max(before + after + [1])
+    width = 30
+
+    print("Runs per {}s bucket, busiest bucket of each row (starting {} UTC):".format(bucket, start.strftime("%H:%M")))
+    print("{:>5}  {:>6} {:<{width}}  {:>6} {:<{width}}".format("time", "before", "", "after", "", width=width))
+    for offset in range(0, len(before), per_row):
+        row_before = max(before[offset : offset + per_row])
+        row_after = max(after[offset : offset + per_row])
+        print(
+            "{:>5}  {:>6} {:<{width}}  {:>6} {:<{width}}".format(
+                (start + timedelta(seconds=offset * bucket)).strftime("%H:%M"),
+                row_before,
+                "#" * int(round(width * row_before / scale)),
+                row_after,
+                "#" * int(round(width * row_after / scale)),
+                width=width,
+            )
+        )
+
+    for label, curve in (("before", before), ("after", after)):
+        stats = smoothing.curve_stats(curve)
+        print(
+            "{:>6}: {runs} runs, peak {peak}/bucket, mean {mean:.2f}/bucket, stddev {stddev:.2f}".format(
+                label, **stats
+            )
+        )
+
+    if smooth and apply_:
+        smoothing.save_phases(phases, [q.id for q in queries])
+        print("Saved the slots of {} queries.".format(len(phases)))
+        if not settings.SCHEDULE_SMOOTHING_ENABLED:
+            print("Slots are only used when REDASH_SCHEDULE_SMOOTHING_ENABLED is set.")
+
+
+@manager.command(name="backfill_accesses")
+@option(
+    "--days", default=None, type=int, help="How far back to look (defaults to REDASH_DEMAND_SCHEDULING_SUSPEND_DAYS)."
+)
+def backfill_accesses(days=None):
+    """Records past query accesses from the events table, for demand-driven scheduling."""
+    from redash import settings
+    from redash.tasks.queries import demand
+
+    days = days or settings.DEMAND_SCHEDULING_SUSPEND_DAYS or settings.DEMAND_SCHEDULING_IDLE_DAYS
+    print("Recorded the accesses of {} queries.".format(demand.backfill_accesses(days)))
+
+
+@manager.command(name="backfill_recent_queries")
+def backfill_recent_queries():
+    """Records the recent query edits from the events table."""
+    from redash import models
+
+    print("Recorded {} recent query edits.".format(models.recent_queries.backfill()))
+
+
+@manager.command(name="backfill_parameter_metadata")
+@option("--batch-size", default=1000, help="Number of queries to update per transaction.")
+def backfill_parameter_metadata(batch_size=1000):
+    """Stores the parameter metadata of the queries saved before it was kept."""
+    from redash import models
+
+    print("Updated the parameter metadata of {} queries.".format(models.Query.backfill_parameter_metadata(batch_size)))
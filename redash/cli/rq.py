@@ -2,7 +2,7 @@ import datetime
 import socket
 from itertools import chain
 
-from click import argument
+from click import argument, option
 from flask.cli import AppGroup
 from rq import Connection
 from rq.worker import WorkerStatus
@@ -16,6 +16,7 @@ from redash.tasks import (
     rq_scheduler,
     schedule_periodic_jobs,
 )
+from redash.tasks.queries.fair_share import simulate
 from redash.tasks.worker import Worker
 from redash.worker import default_queues
 
@@ -91,3 +92,32 @@ class WorkerHealthcheck(base.BaseCheck):
 @manager.command()
 def healthcheck():
     return check_runner.CheckRunner("worker_healthcheck", "worker", None, [(WorkerHealthcheck, {})]).run()
+
+
+@manager.command(name="fair_share_benchmark")
+@option("--workers", default=4, help="Number of simulated query workers.")
+@option("--heavy-jobs", default=300, help="Number of jobs the heavy user submits at once.")
+@option("--light-users", default=5, help="Number of users submitting a job every minute.")
+@option("--duration", default=10.0, help="Duration (in seconds) of every simulated job.")
+def fair_share_benchmark(workers, heavy_jobs, light_users, duration):
+    """
+    Compares plain FIFO dispatching with fair-share dispatching on a simulated workload, where one user fires a
+    burst of queries while other users keep running a query every minute.
+    """
+    jobs = [("heavy", 0.0, duration) for _ in range(heavy_jobs)]
+    horizon = heavy_jobs * duration / workers
+    for user in range(light_users):
+        arrival = 1.0 + user
+        while arrival < horizon:
+            jobs.append(("light-{}".format(user), arrival, duration))
+            arrival += 60
+
+    for name, fair in (("FIFO", False), ("Fair-share (DRR)", True)):
+        result = simulate(jobs, workers, fair=fair)
+        light_waits = [s["mean_wait"] for t, s in result["tenants"].items() if t != "heavy"]
+        print("{}: fairness={:.3f} makespan={:.0f}s".format(name, result["fairness"], result["makespan"]))
+        print(
+            "  heavy user:  mean wait={mean_wait:.1f}s p95 wait={p95_wait:.1f}s".format(**result["tenants"]["heavy"])
+        )
+        if light_waits:
+            print("  light users: mean wait={:.1f}s".format(sum(light_waits) / len(light_waits)))
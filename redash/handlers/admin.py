@@ -1,3 +1,4 @@
+from flask import request
 from flask_login import current_user, login_required
 from sqlalchemy.sql.expression import select
 
@@ -54,3 +55,20 @@ def queries_rq_status():
     )
 
     return json_response(rq_status())
+
+
+@routes.route("/api/admin/queries/runtime_stats", methods=["GET"])
+@require_super_admin
+@login_required
+def queries_runtime_stats():
+    data_source_id = request.args.get("data_source_id", type=int)
+    limit = min(request.args.get("limit", 50, type=int), 500)
+
+    record_event(
+        current_org,
+        current_user._get_current_object(),
+        {"action": "list", "object_type": "query_runtime_stats"},
+    )
+
+    stats = models.QueryRuntimeStats.top_by_total_runtime(current_org, data_source_id=data_source_id, limit=limit)
+    return json_response({"stats": [s.to_dict() for s in stats]})
@@ -25,6 +25,8 @@ from redash.handlers.data_sources import (
     DataSourcePauseResource,
     DataSourceResource,
     DataSourceSchemaResource,
+    DataSourceSchemaTableResource,
+    DataSourceSchemaTablesResource,
     DataSourceTestResource,
     DataSourceTypeListResource,
 )
@@ -69,6 +71,7 @@ from redash.handlers.queries import (
     QueryTagsResource,
 )
 from redash.handlers.query_results import (
+    DashboardQueryResultsResource,
     JobResource,
     QueryDropdownsResource,
     QueryResultDropdownResource,
@@ -145,6 +148,8 @@ api.add_org_resource(
 api.add_org_resource(DataSourceTypeListResource, "/api/data_sources/types", endpoint="data_source_types")
 api.add_org_resource(DataSourceListResource, "/api/data_sources", endpoint="data_sources")
 api.add_org_resource(DataSourceSchemaResource, "/api/data_sources/<data_source_id>/schema")
+api.add_org_resource(DataSourceSchemaTablesResource, "/api/data_sources/<data_source_id>/schema/tables")
+api.add_org_resource(DataSourceSchemaTableResource, "/api/data_sources/<data_source_id>/schema/table")
 api.add_org_resource(DatabricksDatabaseListResource, "/api/databricks/databases/<data_source_id>")
 api.add_org_resource(
     DatabricksSchemaResource,
@@ -224,6 +229,11 @@ api.add_org_resource(
 )
 
 api.add_org_resource(QueryResultListResource, "/api/query_results", endpoint="query_results")
+api.add_org_resource(
+    DashboardQueryResultsResource,
+    "/api/dashboards/<dashboard_id>/results",
+    endpoint="dashboard_query_results",
+)
 api.add_org_resource(
     QueryResultDropdownResource,
     "/api/queries/<query_id>/dropdown",
@@ -1,18 +1,23 @@
+import base64
+import binascii
+import hashlib
 import time
 from inspect import isclass
 
 from flask import Blueprint, current_app, request
 from flask_login import current_user, login_required
 from flask_restful import Resource, abort
-from sqlalchemy import cast
+from sqlalchemy import Text, and_, cast, false, func, inspect, literal, or_, select
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
 
-from redash import settings
+from redash import redis_connection, settings
 from redash.authentication import current_org
 from redash.models import db
 from redash.tasks import record_event as record_event_task
-from redash.utils import json_dumps
+from redash.utils import json_dumps, json_loads
 
 MAX_PER_PAGE = 250
 
@@ -59,7 +64,7 @@ def record_event(org, user, options):
     if "timestamp" not in options:
         options["timestamp"] = int(time.time())
 
-    record_event_task.delay(options)
+    record_event_task(options)
 
 
 def require_fields(req, fields):
@@ -78,17 +83,131 @@ def get_object_or_404(fn, *args, **kwargs):
     return rv
 
 
+def _sort_keys(query_set):
+    """
+    Returns `(expression, ascending)` for every ORDER BY clause of `query_set`.
+    """
+    keys = []
+    for clause in query_set._order_by_clauses:
+        if isinstance(clause, UnaryExpression) and clause.modifier in (operators.asc_op, operators.desc_op):
+            keys.append((clause.element, clause.modifier is operators.asc_op))
+        else:
+            keys.append((clause, True))
+    return keys
+
+
+def _after(keys, values):
+    """
+    Matches the rows that come after the row with the given sort key values, following the PostgreSQL default of
+    sorting NULLs last in ascending order and first in descending order. The values are the keys' text
+    representations, compared as untyped literals so the database reads them back as the keys' own types: timestamps
+    keep their microseconds and real search ranks compare equal to themselves.
+    """
+    clauses = []
+    equal = []
+    for (expression, ascending), value in zip(keys, values):
+        if value is None:
+            beyond = false() if ascending else expression.is_not(None)
+            same = expression.is_(None)
+        else:
+            value = literal(value)
+            beyond = or_(expression > value, expression.is_(None)) if ascending else expression < value
+            same = expression == value
+        clauses.append(and_(*equal, beyond))
+        equal.append(same)
+    return or_(*clauses)
+
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json_dumps(values).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor, keys_count):
+    try:
+        values = json_loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, binascii.Error):
+        values = None
+
+    if not isinstance(values, list) or len(values) != keys_count:
+        abort(400, message="Invalid cursor.")
+
+    return [value if value is None else str(value) for value in values]
+
+
+def keyset_page(query_set, cursor, per_page):
+    """
+    Returns the page of `query_set` following `cursor` (the first page for an empty cursor), and the cursor of the
+    next page or None for the last one. Pages are read with a WHERE on the sort keys instead of an OFFSET, so later
+    pages cost as much as the first one and rows added or removed meanwhile don't shift them.
+    """
+    entity = query_set.column_descriptions[0]["entity"]
+    if entity is not None:
+        # the primary key makes the order total, so rows with equal sort keys aren't skipped or repeated
+        query_set = query_set.order_by(*inspect(entity).primary_key)
+
+    keys = _sort_keys(query_set)
+    if cursor:
+        query_set = query_set.where(_after(keys, _decode_cursor(cursor, len(keys))))
+
+    query_set = query_set.add_columns(
+        *(cast(expression, Text).label("cursor_{}".format(i)) for i, (expression, _) in enumerate(keys))
+    )
+    rows = db.session.execute(query_set.limit(per_page + 1)).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = _encode_cursor(list(rows[-1][-len(keys) :]))
+
+    return [row[0] for row in rows], next_cursor
+
+
+def cached_count(query_set):
+    """
+    Counts the rows of `query_set`, reusing the count of the same statement for `PAGINATION_COUNT_CACHE_TTL` seconds.
+    """
+    count_query = select(func.count()).select_from(query_set.order_by(None).limit(None).subquery())
+    if not settings.PAGINATION_COUNT_CACHE_TTL:
+        return db.session.scalar(count_query)
+
+    compiled = count_query.compile(dialect=db.engine.dialect)
+    statement = str(compiled) + json_dumps(compiled.params, sort_keys=True)
+    key = "pagination:count:{}".format(hashlib.md5(statement.encode("utf-8")).hexdigest())
+
+    count = redis_connection.get(key)
+    if count is None:
+        count = db.session.scalar(count_query)
+        redis_connection.set(key, count, ex=settings.PAGINATION_COUNT_CACHE_TTL)
+
+    return int(count)
+
+
 def paginate(query_set, page, per_page, serializer, **kwargs):
+    """
+    Returns a page of `query_set`. Clients passing a `cursor` request argument (empty for the first page) get keyset
+    pages along with the `next_cursor` to request, and a count that may be up to `PAGINATION_COUNT_CACHE_TTL` seconds
+    old. Without it pages are selected by `page` number as before.
+    """
     if per_page > MAX_PER_PAGE:
         abort(400, message=f"Page size is out of range (1-{MAX_PER_PAGE})")
-    results = db.paginate(query_set, page=page, per_page=per_page, max_per_page=MAX_PER_PAGE)
+
+    cursor = request.args.get("cursor")
+    extra = {}
+    if cursor is None:
+        results = db.paginate(query_set, page=page, per_page=per_page, max_per_page=MAX_PER_PAGE)
+        results, count = results.items, results.total
+    else:
+        if per_page < 1:
+            abort(400, message=f"Page size is out of range (1-{MAX_PER_PAGE})")
+        results, extra["next_cursor"] = keyset_page(query_set, cursor, per_page)
+        count = cached_count(query_set)
 
     # support for old function based serializers
     if isclass(serializer):
-        items = serializer(results.items, **kwargs).serialize()
+        items = serializer(results, **kwargs).serialize()
     else:
-        items = [serializer(result) for result in results.items]
-    return {"count": results.total, "page": page, "per_page": per_page, "results": items}
+        items = [serializer(result) for result in results]
+    return dict({"count": count, "page": page, "per_page": per_page, "results": items}, **extra)
 
 
 def org_scoped_rule(rule):
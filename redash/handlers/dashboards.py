@@ -56,6 +56,7 @@ class DashboardListResource(BaseResource):
 
         :qparam number per_page: Number of queries to return per page
         :qparam number page: Page number to retrieve
+        :qparam string cursor: Cursor of the page to retrieve, as returned in ``next_cursor`` (empty for the first page)
         :qparam number order: Name of column to order by
         :qparam number q: Full text search term
 
@@ -123,6 +124,7 @@ class MyDashboardsResource(BaseResource):
 
         :qparam number per_page: Number of dashboards to return per page
         :qparam number page: Page number to retrieve
+        :qparam string cursor: Cursor of the page to retrieve, as returned in ``next_cursor`` (empty for the first page)
         :qparam number order: Name of column to order by
         :qparam number search: Full text search term
 
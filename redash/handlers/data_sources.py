@@ -8,6 +8,7 @@ from sqlalchemy.exc import IntegrityError
 
 from redash import models
 from redash.handlers.base import (
+    MAX_PER_PAGE,
     BaseResource,
     get_object_or_404,
     require_fields,
@@ -172,18 +173,99 @@ class DataSourceSchemaResource(BaseResource):
         data_source = get_object_or_404(models.DataSource.get_by_id_and_org, data_source_id, self.current_org)
         require_access(data_source, self.current_user, view_only)
         refresh = request.args.get("refresh") is not None
+        since = request.args.get("since", type=int)
 
         if not refresh:
+            if since is not None:
+                changes = models.schema_changes.since(data_source.id, since)
+                if changes is not None:
+                    return {"version": models.schema_changes.version(data_source.id), "changes": changes}
+
             cached_schema = data_source.get_cached_schema()
 
             if cached_schema is not None:
-                return {"schema": cached_schema}
+                return {"schema": cached_schema, "version": models.schema_changes.version(data_source.id)}
 
         job = get_schema.delay(data_source.id, refresh)
 
         return serialize_job(job)
 
 
+def _table_summary(table, matched_columns=None):
+    summary = {key: value for key, value in table.items() if key != "columns"}
+    summary["columns_count"] = len(table.get("columns", []))
+    if matched_columns is not None:
+        summary["matched_columns"] = matched_columns
+
+    return summary
+
+
+class DataSourceSchemaTablesResource(BaseResource):
+    def get(self, data_source_id):
+        """
+        Lists the tables of the cached schema (without their columns), a page at a time.
+
+        :qparam q: only tables matching every word of it, by a prefix of a word of their name or of a column name
+        :qparam prefix: only tables whose name starts with it
+        :qparam page: page number
+        :qparam per_page: tables per page
+        """
+        data_source = get_object_or_404(models.DataSource.get_by_id_and_org, data_source_id, self.current_org)
+        require_access(data_source, self.current_user, view_only)
+
+        page = request.args.get("page", 1, type=int)
+        per_page = request.args.get("per_page", 100, type=int)
+        if page < 1:
+            abort(400, message="Page must be positive integer.")
+        if not 1 <= per_page <= MAX_PER_PAGE:
+            abort(400, message=f"Page size is out of range (1-{MAX_PER_PAGE})")
+
+        index = data_source.get_schema_index()
+        if index is None:
+            return serialize_job(get_schema.delay(data_source.id, False))
+
+        offset = (page - 1) * per_page
+        search_term = request.args.get("q")
+        if search_term:
+            count, matches = index.search(data_source.id, search_term, offset, per_page)
+            tables = index.tables(data_source.id, [name for name, _ in matches])
+            tables = {table["name"]: table for table in data_source.with_table_stats(tables)}
+            results = [_table_summary(tables[name], columns) for name, columns in matches if name in tables]
+        else:
+            count, names = index.table_names(data_source.id, request.args.get("prefix"), offset, per_page)
+            tables = data_source.with_table_stats(index.tables(data_source.id, names))
+            results = [_table_summary(table) for table in tables]
+
+        return {
+            "count": count,
+            "page": page,
+            "per_page": per_page,
+            "results": results,
+            "version": models.schema_changes.version(data_source.id),
+        }
+
+
+class DataSourceSchemaTableResource(BaseResource):
+    def get(self, data_source_id):
+        """
+        Returns a table of the cached schema along with its columns.
+
+        :qparam name: table name
+        """
+        data_source = get_object_or_404(models.DataSource.get_by_id_and_org, data_source_id, self.current_org)
+        require_access(data_source, self.current_user, view_only)
+
+        index = data_source.get_schema_index()
+        if index is None:
+            return serialize_job(get_schema.delay(data_source.id, False))
+
+        table = index.table(data_source.id, request.args.get("name", ""))
+        if table is None:
+            abort(404, message="Table not found.")
+
+        return data_source.with_table_stats([table])[0]
+
+
 class DataSourcePauseResource(BaseResource):
     @require_admin
     def post(self, data_source_id):
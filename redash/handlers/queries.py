@@ -130,6 +130,7 @@ class BaseQueryListResource(BaseResource):
 
         :qparam number per_page: Number of queries to return per page
         :qparam number page: Page number to retrieve
+        :qparam string cursor: Cursor of the page to retrieve, as returned in ``next_cursor`` (empty for the first page)
         :qparam number order: Name of column to order by
         :qparam number q: Full text search term
 
@@ -273,6 +274,7 @@ class MyQueriesResource(BaseResource):
 
         :qparam number per_page: Number of queries to return per page
         :qparam number page: Page number to retrieve
+        :qparam string cursor: Cursor of the page to retrieve, as returned in ``next_cursor`` (empty for the first page)
         :qparam number order: Name of column to order by
         :qparam number search: Full text search term
 
@@ -1,13 +1,15 @@
+import time
 import unicodedata
+import uuid
 from urllib.parse import quote
 
 import regex
-from flask import make_response, request
+from flask import Response, make_response, request, stream_with_context
 from flask_login import current_user
 from flask_restful import abort
 from rq.job import JobStatus
 
-from redash import models, settings
+from redash import models, redis_connection, rq_redis_connection, settings
 from redash.handlers.base import BaseResource, get_object_or_404, record_event
 from redash.models.parameterized_query import (
     InvalidParameterError,
@@ -33,10 +35,15 @@ from redash.tasks import Job
 from redash.tasks.queries import enqueue_query
 from redash.utils import (
     collect_parameters_from_request,
+    gen_query_hash,
     json_dumps,
     to_filename,
 )
 
+DASHBOARD_RESULTS_STREAM_POLL_INTERVAL = 0.5
+DASHBOARD_RESULTS_STREAMS_KEY = "dashboard_results:streams"
+TERMINAL_JOB_STATUSES = (JobStatus.FINISHED, JobStatus.FAILED, JobStatus.CANCELED, JobStatus.STOPPED)
+
 
 def error_response(message, http_status=400):
     return {"job": {"status": JobStatus.FAILED, "error": message}}, http_status
@@ -57,9 +64,13 @@ error_messages = {
 }
 
 
-def run_query(query, parameters, data_source, query_id, should_apply_auto_limit, max_age=0):
+def prepare_query(query, parameters, data_source, should_apply_auto_limit, query_runner=None):
+    """
+    Applies the parameter values to a query. Returns the text to run and None, or None and an error response.
+    Raises `InvalidParameterError` and `QueryDetachedFromDataSourceError` when the values can't be applied.
+    """
     if not data_source:
-        return error_messages["no_data_source"]
+        return None, error_messages["no_data_source"]
 
     if data_source.paused:
         if data_source.pause_reason:
@@ -67,17 +78,27 @@ def run_query(query, parameters, data_source, query_id, should_apply_auto_limit,
         else:
             message = "{} is paused. Please try later.".format(data_source.name)
 
-        return error_response(message)
+        return None, error_response(message)
+
+    query.apply(parameters)
 
+    query_runner = query_runner or data_source.query_runner
+    query_text = query_runner.apply_auto_limit(query.text, should_apply_auto_limit)
+
+    if query.missing_params:
+        return None, error_response("Missing parameter value for: {}".format(", ".join(query.missing_params)))
+
+    return query_text, None
+
+
+def run_query(query, parameters, data_source, query_id, should_apply_auto_limit, max_age=0):
     try:
-        query.apply(parameters)
+        query_text, error = prepare_query(query, parameters, data_source, should_apply_auto_limit)
     except (InvalidParameterError, QueryDetachedFromDataSourceError) as e:
         abort(400, message=str(e))
 
-    query_text = data_source.query_runner.apply_auto_limit(query.text, should_apply_auto_limit)
-
-    if query.missing_params:
-        return error_response("Missing parameter value for: {}".format(", ".join(query.missing_params)))
+    if error is not None:
+        return error
 
     if max_age == 0:
         query_result = None
@@ -114,6 +135,14 @@ def run_query(query, parameters, data_source, query_id, should_apply_auto_limit,
         return serialize_job(job)
 
 
+def _max_age(params):
+    max_age = params.get("max_age", -1)
+    # max_age might have the value of None, in which case calling int(None) will fail
+    if max_age is None:
+        max_age = -1
+    return int(max_age)
+
+
 def get_download_filename(query_result, query, filetype):
     retrieved_at = query_result.retrieved_at.strftime("%Y_%m_%d")
     if query:
@@ -159,11 +188,7 @@ class QueryResultListResource(BaseResource):
         params = request.get_json(force=True)
 
         query = params["query"]
-        max_age = params.get("max_age", -1)
-        # max_age might have the value of None, in which case calling int(None) will fail
-        if max_age is None:
-            max_age = -1
-        max_age = int(max_age)
+        max_age = _max_age(params)
         query_id = params.get("query_id", "adhoc")
         parameters = params.get("parameters", collect_parameters_from_request(request.args))
 
@@ -252,15 +277,11 @@ class QueryResultResource(BaseResource):
         params = request.get_json(force=True, silent=True) or {}
         parameter_values = params.get("parameters", {})
 
-        max_age = params.get("max_age", -1)
-        # max_age might have the value of None, in which case calling int(None) will fail
-        if max_age is None:
-            max_age = -1
-        max_age = int(max_age)
+        max_age = _max_age(params)
 
         query = get_object_or_404(models.Query.get_by_id_and_org, query_id, self.current_org)
 
-        allow_executing_with_view_only_permissions = query.parameterized.is_safe
+        allow_executing_with_view_only_permissions = query.is_safe
         if "apply_auto_limit" in params:
             should_apply_auto_limit = params.get("apply_auto_limit", False)
         else:
@@ -276,7 +297,7 @@ class QueryResultResource(BaseResource):
                 max_age,
             )
         else:
-            if not query.parameterized.is_safe:
+            if not query.is_safe:
                 if current_user.is_api_user():
                     return error_messages["unsafe_when_shared"]
                 else:
@@ -396,6 +417,199 @@ class QueryResultResource(BaseResource):
         return make_response(serialize_query_result_to_xlsx(query_result), 200, headers)
 
 
+class DashboardQueryResultsResource(BaseResource):
+    @require_any_of_permission(("view_query", "execute_query"))
+    def post(self, dashboard_id):
+        """
+        Fetch the results of the queries of a dashboard's widgets in one request: the cached results where available
+        and the jobs executing the queries otherwise.
+
+        :param number dashboard_id: The ID of the dashboard
+        :<json object parameters: Parameter values to apply, by widget ID. Widgets left out use the default values
+                                  of their query's parameters.
+        :<json array widget_ids: Only fetch the results of these widgets (optional)
+        :<json number max_age: As for executing a saved query
+        :qparam stream: Respond with one JSON document per line and widget, as soon as its result is available
+                        (waiting up to `DASHBOARD_RESULTS_STREAM_TIMEOUT` seconds for the queries to run). A waiting
+                        stream holds its web worker, so at most `DASHBOARD_RESULTS_MAX_STREAMS` wait at once; beyond
+                        that the jobs are streamed right away for the client to poll.
+
+        :>json array results: A `{"widget_id", "query_id"}` object per widget, with either a `query_result` or a `job`
+        """
+        params = request.get_json(force=True, silent=True) or {}
+        parameters = params.get("parameters") or {}
+        widget_ids = params.get("widget_ids")
+        max_age = _max_age(params)
+
+        dashboard = get_object_or_404(models.Dashboard.get_by_id_and_org, dashboard_id, self.current_org)
+        widgets = models.Widget.query_widgets(dashboard, widget_ids)
+
+        is_api_user = current_user.is_api_user()
+        if is_api_user:
+            api_key = models.ApiKey.get_by_object(dashboard)
+            shared_dashboard = api_key is not None and api_key.api_key == current_user.id
+        else:
+            groups = models.DataSource.groups_of({w.visualization.query.data_source_id for w in widgets} - {None})
+
+        results = []
+        # (data source id, query hash) -> the results entries and what to run for them
+        to_run = {}
+        query_runners = {}
+        for widget in widgets:
+            query = widget.visualization.query
+            entry = {"widget_id": widget.id, "query_id": query.id}
+            results.append(entry)
+
+            is_safe = query.is_safe
+            if is_api_user:
+                allowed = is_safe and (shared_dashboard or query.api_key == current_user.id)
+            else:
+                allowed = has_access(groups.get(query.data_source_id, {}), current_user, is_safe)
+
+            if not allowed:
+                if not is_safe:
+                    error = error_messages["unsafe_when_shared" if is_api_user else "unsafe_on_view_only"]
+                else:
+                    error = error_messages["no_permission"]
+                entry.update(error[0])
+                continue
+
+            data_source = query.data_source
+            if data_source is not None and data_source.id not in query_runners:
+                query_runners[data_source.id] = data_source.query_runner
+
+            values = parameters.get(str(widget.id))
+            if values is None:
+                values = {p["name"]: p.get("value") for p in query.parameters}
+
+            try:
+                query_text, error = prepare_query(
+                    query.parameterized,
+                    values,
+                    data_source,
+                    query.options.get("apply_auto_limit", False),
+                    query_runners.get(query.data_source_id),
+                )
+            except (InvalidParameterError, QueryDetachedFromDataSourceError) as e:
+                query_text, error = None, error_response(str(e))
+
+            if error is not None:
+                entry.update(error[0])
+                continue
+
+            key = (data_source.id, gen_query_hash(query_text))
+            to_run.setdefault(key, {"query_text": query_text, "data_source": data_source, "entries": []})
+            to_run[key]["entries"].append(entry)
+
+        cached = {} if max_age == 0 else models.QueryResult.get_latest_many(to_run, max_age)
+
+        jobs = {}
+        for key, run in to_run.items():
+            if key in cached:
+                query_result = serialize_query_result(cached[key], is_api_user)
+                for entry in run["entries"]:
+                    entry["query_result"] = query_result
+                continue
+
+            job = enqueue_query(
+                run["query_text"],
+                run["data_source"],
+                current_user.id,
+                is_api_user,
+                metadata={
+                    "Username": current_user.get_actual_user(),
+                    "query_id": run["entries"][0]["query_id"],
+                },
+            )
+            job_payload = serialize_job(job)
+            for entry in run["entries"]:
+                entry.update(job_payload)
+            jobs[job.id] = run["entries"]
+
+        record_event(
+            current_user.org,
+            current_user,
+            {
+                "action": "execute_queries",
+                "object_id": dashboard.id,
+                "object_type": "dashboard",
+                "cache": {"hit": len(cached), "miss": len(jobs)},
+                "query_ids": sorted({entry["query_id"] for entry in results}),
+            },
+        )
+
+        if request.args.get("stream") is None:
+            return {"results": results}
+
+        return Response(
+            stream_with_context(self.stream_results(results, jobs, is_api_user)),
+            mimetype="application/x-ndjson",
+        )
+
+    def stream_results(self, results, jobs, is_api_user):
+        waiting = {id(entry) for entries in jobs.values() for entry in entries}
+        for entry in results:
+            if id(entry) not in waiting:
+                yield json_dumps(entry) + "\n"
+
+        deadline = time.time() + settings.DASHBOARD_RESULTS_STREAM_TIMEOUT
+        stream_id = _open_stream(deadline) if jobs else None
+        try:
+            if stream_id is not None:
+                yield from self.wait_for_jobs(jobs, deadline, is_api_user)
+        finally:
+            if stream_id is not None:
+                redis_connection.zrem(DASHBOARD_RESULTS_STREAMS_KEY, stream_id)
+
+        # The rest are still running, the client polls their jobs as usual.
+        for entries in jobs.values():
+            for entry in entries:
+                yield json_dumps(entry) + "\n"
+
+    def wait_for_jobs(self, jobs, deadline, is_api_user):
+        while jobs and time.time() < deadline:
+            # Don't keep a database connection checked out while waiting
+            models.db.session.remove()
+            time.sleep(DASHBOARD_RESULTS_STREAM_POLL_INTERVAL)
+            job_ids = list(jobs)
+            for job_id, job in zip(job_ids, Job.fetch_many(job_ids, connection=rq_redis_connection)):
+                if job is None:
+                    payload = error_response("Query job expired.")[0]
+                else:
+                    payload = serialize_job(job)
+                    if payload["job"]["status"] not in TERMINAL_JOB_STATUSES:
+                        continue
+
+                    result_id = payload["job"]["result_id"]
+                    if result_id is not None:
+                        query_result = models.QueryResult.get_by_id_and_org(result_id, self.current_org)
+                        payload = {"query_result": serialize_query_result(query_result, is_api_user)}
+
+                for entry in jobs.pop(job_id):
+                    entry.pop("job", None)
+                    entry.update(payload)
+                    yield json_dumps(entry) + "\n"
+
+
+def _open_stream(deadline):
+    """
+    Takes one of the `DASHBOARD_RESULTS_MAX_STREAMS` slots for waiting on query jobs until `deadline`, returning its
+    ID, or None when they are all taken. Slots of streams that never closed are freed once past their deadline.
+    """
+    stream_id = str(uuid.uuid4())
+    pipe = redis_connection.pipeline()
+    pipe.zremrangebyscore(DASHBOARD_RESULTS_STREAMS_KEY, "-inf", time.time())
+    pipe.zadd(DASHBOARD_RESULTS_STREAMS_KEY, {stream_id: deadline})
+    pipe.zcard(DASHBOARD_RESULTS_STREAMS_KEY)
+    pipe.expire(DASHBOARD_RESULTS_STREAMS_KEY, settings.DASHBOARD_RESULTS_STREAM_TIMEOUT)
+    open_streams = pipe.execute()[2]
+
+    if open_streams > settings.DASHBOARD_RESULTS_MAX_STREAMS:
+        redis_connection.zrem(DASHBOARD_RESULTS_STREAMS_KEY, stream_id)
+        return None
+    return stream_id
+
+
 class JobResource(BaseResource):
     def get(self, job_id, query_id=None):
         """
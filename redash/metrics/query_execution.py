@@ -0,0 +1,39 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Histogram
+
+queryExecutionPhaseHistogram = Histogram(
+    "query_execution_phase_seconds",
+    "Duration of query execution phases",
+    ["data_source_type", "queue", "phase"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, float("inf")),
+)
+
+
+class PhaseTimer:
+    """
+    Collects the time spent in each phase of a query execution job (queue wait, connecting, executing, fetching,
+    storing the result, alert fan-out...). Time spent in the same phase more than once is summed up.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    def record(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + max(seconds, 0.0)
+
+    @contextmanager
+    def phase(self, name):
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - started_at)
+
+    def observe(self, data_source_type, queue):
+        for phase, seconds in self.timings.items():
+            queryExecutionPhaseHistogram.labels(data_source_type, queue, phase).observe(seconds)
+
+    def to_dict(self):
+        return {phase: round(seconds, 3) for phase, seconds in self.timings.items()}
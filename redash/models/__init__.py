@@ -1,26 +1,34 @@
 import calendar
+import hashlib
 import logging
+import math
 import numbers
+import re
 import time
+import uuid
+from collections import defaultdict
 from datetime import (
     datetime,
     timedelta,
 )
 
 from pytz import utc
-from sqlalchemy import UniqueConstraint, func, or_
-from sqlalchemy.dialects.postgresql import ARRAY, DOUBLE_PRECISION, JSONB
+from sqlalchemy import UniqueConstraint, func, inspect, or_, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, DOUBLE_PRECISION, JSONB, insert
 from sqlalchemy.event import listens_for
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import (
     contains_eager,
     joinedload,
     load_only,
+    selectinload,
     subqueryload,
 )
+from sqlalchemy.orm.attributes import get_history
 from sqlalchemy.orm.exc import NoResultFound  # noqa: F401
 from sqlalchemy.sql import text
-from sqlalchemy.sql.expression import delete, select, update
+from sqlalchemy.sql.expression import bindparam, delete, select, update
 from sqlalchemy_searchable import search as searchable_search
 from sqlalchemy_utils import generic_relationship
 from sqlalchemy_utils.models import generic_repr
@@ -50,6 +58,7 @@ from redash.models.parameterized_query import (
     InvalidParameterError,
     ParameterizedQuery,
     QueryDetachedFromDataSourceError,
+    collect_parameter_metadata,
 )
 from redash.models.types import (
     EncryptedConfiguration,
@@ -64,12 +73,14 @@ from redash.models.users import (  # noqa
     ApiUser,
     Group,
     User,
+    api_key_principals,
 )
 from redash.query_runner import (
     TYPE_BOOLEAN,
     TYPE_DATE,
     TYPE_DATETIME,
     BaseQueryRunner,
+    NotSupported,
     get_configuration_schema_for_query_runner_type,
     get_query_runner,
     with_ssh_tunnel,
@@ -95,8 +106,14 @@ class ScheduledQueriesExecutions:
     def __init__(self):
         self.executions = {}
 
-    def refresh(self):
-        self.executions = redis_connection.hgetall(self.KEY_NAME)
+    def refresh(self, query_ids=None):
+        if query_ids is None:
+            self.executions = redis_connection.hgetall(self.KEY_NAME)
+        elif query_ids:
+            timestamps = redis_connection.hmget(self.KEY_NAME, query_ids)
+            self.executions = {str(query_id): ts for query_id, ts in zip(query_ids, timestamps) if ts is not None}
+        else:
+            self.executions = {}
 
     def update(self, query_id):
         redis_connection.hset(self.KEY_NAME, mapping={query_id: time.time()})
@@ -112,6 +129,536 @@ class ScheduledQueriesExecutions:
 scheduled_queries_executions = ScheduledQueriesExecutions()
 
 
+class ScheduledQueriesPhases:
+    """
+    The slots interval based schedules are pinned to by load smoothing (see `redash.tasks.queries.smoothing`).
+    """
+
+    KEY_NAME = "sq:phase"
+
+    def get(self, query_ids=None):
+        if query_ids is None:
+            return {int(query_id): int(phase) for query_id, phase in redis_connection.hgetall(self.KEY_NAME).items()}
+
+        if not query_ids:
+            return {}
+
+        phases = redis_connection.hmget(self.KEY_NAME, query_ids)
+        return {query_id: int(phase) for query_id, phase in zip(query_ids, phases) if phase is not None}
+
+    def replace(self, phases, query_ids):
+        pipe = redis_connection.pipeline()
+        pipe.hdel(self.KEY_NAME, *query_ids)
+        if phases:
+            pipe.hset(self.KEY_NAME, mapping=phases)
+        pipe.execute()
+
+    def clear(self):
+        redis_connection.delete(self.KEY_NAME)
+
+
+scheduled_queries_phases = ScheduledQueriesPhases()
+
+
+class QueryAccesses:
+    """
+    When the results of each query were last accessed (viewed, directly or on a dashboard, or fetched through the
+    API), along with the runs demand-driven scheduling skipped.
+    """
+
+    KEY_NAME = "sq:accessed_at"
+    SKIPPED_KEY_NAME = "sq:demand:skipped"
+
+    def get(self, query_ids):
+        if not query_ids:
+            return {}
+
+        timestamps = redis_connection.hmget(self.KEY_NAME, query_ids)
+        return {
+            query_id: utils.dt_from_timestamp(timestamp)
+            for query_id, timestamp in zip(query_ids, timestamps)
+            if timestamp is not None
+        }
+
+    def update(self, accessed_at):
+        """
+        Records `{query_id: datetime}` accesses (keeping later ones already recorded) and returns the previous ones.
+        """
+        query_ids = list(accessed_at)
+        previous = self.get(query_ids)
+        mapping = {
+            query_id: accessed.timestamp()
+            for query_id, accessed in accessed_at.items()
+            if query_id not in previous or previous[query_id] < accessed
+        }
+        if mapping:
+            redis_connection.hset(self.KEY_NAME, mapping=mapping)
+
+        return previous
+
+    def skip_run(self, runtime):
+        pipe = redis_connection.pipeline()
+        pipe.hincrby(self.SKIPPED_KEY_NAME, "runs", 1)
+        pipe.hincrbyfloat(self.SKIPPED_KEY_NAME, "seconds", runtime)
+        pipe.execute()
+
+    def skipped(self):
+        skipped = redis_connection.hgetall(self.SKIPPED_KEY_NAME)
+        return {"runs": int(skipped.get("runs", 0)), "seconds": float(skipped.get("seconds", 0))}
+
+
+query_accesses = QueryAccesses()
+
+
+class RecentQueries:
+    """
+    The queries edited (or whose source was viewed) the most lately, by organization and by user: a sorted set a day
+    of query ids scored by their number of edits that day, keeping the `RECENT_QUERIES_SIZE` most edited. The last
+    `RECENT_QUERIES_DAYS` days are summed up when read, an edit from `HALF_LIFE_DAYS` days ago counting half as much
+    as one from today.
+    """
+
+    KEY_NAME = "recent_queries"
+    ACTIONS = ("edit", "scalars", "edit_name", "edit_description", "view_source")
+    HALF_LIFE_DAYS = 7
+
+    def _key(self, day, org_id, user_id=None):
+        if user_id is None:
+            return "{}:org:{}:{}".format(self.KEY_NAME, org_id, day.isoformat())
+        return "{}:org:{}:user:{}:{}".format(self.KEY_NAME, org_id, user_id, day.isoformat())
+
+    def _days(self):
+        today = utils.utcnow().date()
+        return [today - timedelta(days=days) for days in range(settings.RECENT_QUERIES_DAYS)]
+
+    def record(self, edits, replace=False):
+        """
+        Records `(query_id, org_id, user_id, edited_at, count)` edits, ignoring the ones older than
+        `RECENT_QUERIES_DAYS` days. With `replace`, the counts of the queries replace the ones recorded so far instead
+        of adding up to them.
+        """
+        days = set(self._days())
+        counts = defaultdict(lambda: defaultdict(int))
+        expire_at = {}
+        for query_id, org_id, user_id, edited_at, count in edits:
+            day = edited_at.astimezone(utc).date()
+            if day not in days:
+                continue
+
+            keys = [self._key(day, org_id)]
+            if user_id is not None:
+                keys.append(self._key(day, org_id, user_id))
+            for key in keys:
+                counts[key][query_id] += count
+                expire_at[key] = calendar.timegm((day + timedelta(days=settings.RECENT_QUERIES_DAYS)).timetuple())
+
+        pipe = redis_connection.pipeline()
+        for key, key_counts in counts.items():
+            if replace:
+                pipe.zadd(key, key_counts)
+            else:
+                for query_id, count in key_counts.items():
+                    pipe.zincrby(key, count, query_id)
+            pipe.zremrangebyrank(key, 0, -settings.RECENT_QUERIES_SIZE - 1)
+            pipe.expireat(key, expire_at[key])
+        pipe.execute()
+
+    def record_events(self, events):
+        edits = []
+        for event in events:
+            if event.object_type != "query" or event.action not in self.ACTIONS or event.org_id is None:
+                continue
+            try:
+                query_id = int(event.object_id)
+            except (TypeError, ValueError):
+                continue
+            edited_at = event.created_at or utils.utcnow()
+            edits.append((query_id, event.org_id, event.user_id, edited_at, 1))
+
+        if edits:
+            self.record(edits)
+
+    def get(self, org_id, user_id=None, offset=0, count=20):
+        """
+        Returns the ids of the queries of the organization (or the user) edited the most in the last
+        `RECENT_QUERIES_DAYS` days.
+        """
+        weights = {
+            self._key(day, org_id, user_id): 0.5 ** (days / self.HALF_LIFE_DAYS)
+            for days, day in enumerate(self._days())
+        }
+        total_key = "{}:total:{}".format(self.KEY_NAME, uuid.uuid4())
+        pipe = redis_connection.pipeline()
+        pipe.zunionstore(total_key, weights)
+        pipe.zrevrange(total_key, offset, offset + count - 1)
+        pipe.delete(total_key)
+        query_ids = pipe.execute()[1]
+        return [int(query_id) for query_id in query_ids]
+
+    def backfill(self):
+        """
+        Records the edits of the last `RECENT_QUERIES_DAYS` days from the events table, returning how many. Running it
+        again recounts them rather than adding them up twice.
+        """
+        since = datetime.combine(self._days()[-1], datetime.min.time(), tzinfo=utc)
+        day = func.date(func.timezone("UTC", Event.created_at))
+        rows = db.session.execute(
+            select(Event.object_id, Event.org_id, Event.user_id, day, func.count())
+            .where(
+                Event.object_type == "query",
+                Event.action.in_(self.ACTIONS),
+                Event.created_at >= since,
+            )
+            .group_by(Event.object_id, Event.org_id, Event.user_id, day)
+        ).all()
+
+        edits = [
+            (int(object_id), org_id, user_id, datetime.combine(edit_day, datetime.min.time(), tzinfo=utc), count)
+            for object_id, org_id, user_id, edit_day, count in rows
+            if object_id is not None and object_id.isdigit() and org_id is not None
+        ]
+        if edits:
+            self.record(edits, replace=True)
+
+        return sum(edit[-1] for edit in edits)
+
+
+recent_queries = RecentQueries()
+
+
+def diff_schema(previous, current):
+    """
+    Returns the tables added to and updated in `current`, and the names of the tables removed from it, compared to
+    `previous`.
+    """
+    previous_tables = {table["name"]: table for table in previous}
+    current_tables = {table["name"]: table for table in current}
+
+    added = [table for name, table in current_tables.items() if name not in previous_tables]
+    updated = [
+        table for name, table in current_tables.items() if name in previous_tables and previous_tables[name] != table
+    ]
+    removed = [name for name in previous_tables if name not in current_tables]
+
+    return added, updated, removed
+
+
+class SchemaChanges:
+    """
+    Log of the changes of data source schemas, so clients holding a schema can fetch what changed since instead of
+    the whole schema. Every refresh that changes a schema gets the next version number, and only the last
+    `SCHEMA_CHANGE_LOG_SIZE` changes are kept.
+    """
+
+    def _key(self, data_source_id):
+        return "data_source:schema:{}:changes".format(data_source_id)
+
+    def _version_key(self, data_source_id):
+        return "data_source:schema:{}:version".format(data_source_id)
+
+    def keys(self, data_source_id):
+        return [self._key(data_source_id), self._version_key(data_source_id)]
+
+    def version(self, data_source_id):
+        return int(redis_connection.get(self._version_key(data_source_id)) or 0)
+
+    def record(self, data_source_id, previous, current, ttl):
+        added, updated, removed = diff_schema(previous, current)
+        if not (added or updated or removed):
+            return None
+
+        version = redis_connection.incr(self._version_key(data_source_id))
+        change = {"version": version, "added": added, "updated": updated, "removed": removed}
+
+        pipe = redis_connection.pipeline()
+        pipe.rpush(self._key(data_source_id), json_dumps(change))
+        pipe.ltrim(self._key(data_source_id), -settings.SCHEMA_CHANGE_LOG_SIZE, -1)
+        pipe.expire(self._key(data_source_id), ttl)
+        pipe.expire(self._version_key(data_source_id), ttl)
+        pipe.execute()
+
+        return version
+
+    def since(self, data_source_id, version):
+        """
+        Returns the changes made after `version`, oldest first, or None when the log doesn't go back that far.
+        """
+        current = self.version(data_source_id)
+        if version == current:
+            return []
+        if version > current:
+            return None
+
+        changes = [json_loads(change) for change in redis_connection.lrange(self._key(data_source_id), 0, -1)]
+        changes = [change for change in changes if change["version"] > version]
+        if not changes or changes[0]["version"] != version + 1:
+            return None
+
+        return changes
+
+
+schema_changes = SchemaChanges()
+
+
+def schema_tokens(name):
+    """
+    Returns the tokens a table or column is found by: its lowercase name and the words it's made of.
+    """
+    name = name.lower()
+    return {name} | {word for word in re.split(r"[\W_]+", name) if word}
+
+
+def schema_column_name(column):
+    return column["name"] if isinstance(column, dict) else column
+
+
+class SchemaIndex:
+    """
+    Search index of the cached schema of data sources, so clients can page through tables, search them and fetch the
+    columns of a table when they need them, instead of downloading the whole schema:
+
+    * `data_source:schema:<id>:tables` is a sorted set of the table names (all with the same score, so they're
+      ordered and range-queried lexicographically).
+    * `data_source:schema:<id>:columns` holds the JSON definition of every table.
+    * `data_source:schema:<id>:tokens` is a sorted set of `<token> \0 <table> \0 <column>` entries (the column is
+      empty for tokens of the table name), for prefix search over the tokens of table and column names.
+    * `data_source:schema:<id>:indexed` marks the schema as indexed, even when it has no tables.
+
+    The index is updated with the changes of the schema on every refresh.
+    """
+
+    SEPARATOR = "\0"
+    # Upper bound of lexicographic ranges, greater than any UTF-8 encoded text
+    LAST = chr(0x10FFFF)
+    BATCH = 1000
+
+    def _tables_key(self, data_source_id):
+        return "data_source:schema:{}:tables".format(data_source_id)
+
+    def _columns_key(self, data_source_id):
+        return "data_source:schema:{}:columns".format(data_source_id)
+
+    def _tokens_key(self, data_source_id):
+        return "data_source:schema:{}:tokens".format(data_source_id)
+
+    def _indexed_key(self, data_source_id):
+        return "data_source:schema:{}:indexed".format(data_source_id)
+
+    def keys(self, data_source_id):
+        return [
+            self._tables_key(data_source_id),
+            self._columns_key(data_source_id),
+            self._tokens_key(data_source_id),
+            self._indexed_key(data_source_id),
+        ]
+
+    def exists(self, data_source_id):
+        return bool(redis_connection.exists(self._indexed_key(data_source_id)))
+
+    def _entries(self, table):
+        entries = [self.SEPARATOR.join([token, table["name"], ""]) for token in schema_tokens(table["name"])]
+        for column in table.get("columns", []):
+            column = schema_column_name(column)
+            entries.extend(self.SEPARATOR.join([token, table["name"], column]) for token in schema_tokens(column))
+
+        return entries
+
+    def update(self, data_source_id, previous, current, ttl):
+        """
+        Indexes the `current` schema, given the index holds the `previous` one (None to rebuild the index).
+        """
+        if previous is None or not self.exists(data_source_id):
+            redis_connection.delete(*self.keys(data_source_id))
+            removed, indexed = [], current
+        else:
+            added, updated, removed_names = diff_schema(previous, current)
+            previous_tables = {table["name"]: table for table in previous}
+            removed = [previous_tables[name] for name in removed_names] + [
+                previous_tables[table["name"]] for table in updated
+            ]
+            indexed = added + updated
+
+        for offset in range(0, len(removed), self.BATCH):
+            batch = removed[offset : offset + self.BATCH]
+            pipe = redis_connection.pipeline()
+            pipe.zrem(self._tokens_key(data_source_id), *[e for table in batch for e in self._entries(table)])
+            pipe.zrem(self._tables_key(data_source_id), *[table["name"] for table in batch])
+            pipe.hdel(self._columns_key(data_source_id), *[table["name"] for table in batch])
+            pipe.execute()
+
+        for offset in range(0, len(indexed), self.BATCH):
+            batch = indexed[offset : offset + self.BATCH]
+            pipe = redis_connection.pipeline()
+            pipe.zadd(self._tokens_key(data_source_id), {e: 0 for table in batch for e in self._entries(table)})
+            pipe.zadd(self._tables_key(data_source_id), {table["name"]: 0 for table in batch})
+            pipe.hset(self._columns_key(data_source_id), mapping={table["name"]: json_dumps(table) for table in batch})
+            pipe.execute()
+
+        pipe = redis_connection.pipeline()
+        pipe.set(self._indexed_key(data_source_id), 1)
+        for key in self.keys(data_source_id):
+            pipe.expire(key, ttl)
+        pipe.execute()
+
+    def tables(self, data_source_id, names):
+        if not names:
+            return []
+
+        tables = redis_connection.hmget(self._columns_key(data_source_id), names)
+        return [json_loads(table) for table in tables if table is not None]
+
+    def table(self, data_source_id, name):
+        table = redis_connection.hget(self._columns_key(data_source_id), name)
+        return json_loads(table) if table is not None else None
+
+    def table_names(self, data_source_id, prefix=None, offset=0, limit=25):
+        """
+        Returns the number of tables (whose name starts with `prefix`) and the names of the requested page of them.
+        """
+        low, high = ("[" + prefix, "[" + prefix + self.LAST) if prefix else ("-", "+")
+        key = self._tables_key(data_source_id)
+
+        pipe = redis_connection.pipeline()
+        pipe.zlexcount(key, low, high)
+        pipe.zrangebylex(key, low, high, start=offset, num=limit)
+        return tuple(pipe.execute())
+
+    def _token_entries(self, data_source_id, word):
+        """
+        Yields the entries of the tokens starting with `word`, fetching them `BATCH` at a time.
+        """
+        key = self._tokens_key(data_source_id)
+        low, high = "[" + word, "[" + word + self.LAST
+        while True:
+            entries = redis_connection.zrangebylex(key, low, high, start=0, num=self.BATCH)
+            yield from entries
+            if len(entries) < self.BATCH:
+                return
+            low = "(" + entries[-1]
+
+    def search(self, data_source_id, query, offset=0, limit=25):
+        """
+        Returns the number of tables matching every word of `query` (a table matches a word when the word is a prefix
+        of a token of its name or of one of its columns), and the requested page of `(table name, matched columns)`.
+        Tables matching by name come first.
+        """
+        words = [word for word in query.lower().split() if word]
+        if not words:
+            return 0, []
+
+        matches = None
+        by_name = set()
+        for word in words:
+            word_matches = {}
+            for entry in self._token_entries(data_source_id, word):
+                _, table, column = entry.split(self.SEPARATOR, 2)
+                # Only the tables matching the previous words can still match
+                if matches is not None and table not in matches:
+                    continue
+
+                word_matches.setdefault(table, set())
+                if column:
+                    word_matches[table].add(column)
+                else:
+                    by_name.add(table)
+
+            if matches is None:
+                matches = word_matches
+            else:
+                matches = {table: matches[table] | columns for table, columns in word_matches.items()}
+            if not matches:
+                break
+
+        names = sorted(matches, key=lambda name: (name not in by_name, name))
+        return len(names), [(name, sorted(matches[name])) for name in names[offset : offset + limit]]
+
+
+schema_index = SchemaIndex()
+
+
+class TableStats:
+    """
+    Row counts of the tables of data sources (`{table: {"rows": ..., "estimated": ..., "updated_at": ...}}`), kept
+    apart from the schemas, which change far less often, and expiring after `SCHEMA_TABLE_STATS_TTL` seconds without
+    a refresh.
+    """
+
+    def _key(self, data_source_id):
+        return "data_source:table_stats:{}".format(data_source_id)
+
+    def keys(self, data_source_id):
+        return [self._key(data_source_id)]
+
+    def get(self, data_source_id, table_names=None):
+        if table_names is None:
+            stats = redis_connection.hgetall(self._key(data_source_id))
+        elif table_names:
+            stats = dict(zip(table_names, redis_connection.hmget(self._key(data_source_id), table_names)))
+        else:
+            stats = {}
+
+        return {name: json_loads(value) for name, value in stats.items() if value is not None}
+
+    def save(self, data_source_id, stats, table_names):
+        """
+        Stores `stats` and drops the stats of tables that are no longer in `table_names`.
+        """
+        key = self._key(data_source_id)
+        table_names = set(table_names)
+        dropped = [name for name in redis_connection.hkeys(key) if name not in table_names]
+
+        pipe = redis_connection.pipeline()
+        if dropped:
+            pipe.hdel(key, *dropped)
+        if stats:
+            pipe.hset(key, mapping={name: json_dumps(value) for name, value in stats.items()})
+        pipe.expire(key, settings.SCHEMA_TABLE_STATS_TTL)
+        pipe.execute()
+
+
+table_stats = TableStats()
+
+
+def schedule_jitter(query_id, window):
+    if window <= 0:
+        return 0
+
+    digest = hashlib.md5(str(query_id).encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % window
+
+
+def schedule_offsets(queries, window=None, phases=None):
+    """
+    Maps scheduled queries to their schedule offsets (see `next_scheduled_run`): a deterministic jitter of up to
+    `SCHEDULE_JITTER_WINDOW` seconds for schedules with a specific time, and the assigned slot of interval based
+    ones when smoothing is enabled.
+    """
+    window = settings.SCHEDULE_JITTER_WINDOW if window is None else window
+    if phases is None:
+        phases = {}
+        if settings.SCHEDULE_SMOOTHING_ENABLED:
+            phases = scheduled_queries_phases.get([q.id for q in queries if q.schedule.get("time") is None])
+
+    offsets = {}
+    for query in queries:
+        try:
+            if query.schedule.get("time") is None:
+                if query.id in phases:
+                    offsets[query.id] = phases[query.id]
+            elif window > 0:
+                # Keep the jitter well within the interval, so a delayed run can't slip past the next one.
+                offsets[query.id] = schedule_jitter(query.id, min(window, int(query.schedule["interval"]) // 2))
+        except (TypeError, ValueError):
+            # Malformed schedules are disabled by `Query.outdated_queries`.
+            continue
+
+    return offsets
+
+
+# Tables fetched per query by incremental schema refreshes
+SCHEMA_INCREMENTAL_REFRESH_BATCH = 1000
+
+
 @generic_repr("id", "name", "type", "org_id", "created_at")
 class DataSource(BelongsToOrgMixin, db.Model):
     id = primary_key("DataSource")
@@ -207,25 +754,42 @@ class DataSource(BelongsToOrgMixin, db.Model):
             update(Query).where(Query.data_source == self).values(data_source_id=None, latest_query_data_id=None)
         )
         db.session.execute(delete(QueryResult).where(QueryResult.data_source == self))
+        db.session.execute(delete(QueryRuntimeStats).where(QueryRuntimeStats.data_source_id == self.id))
         res = db.session.delete(self)
         db.session.commit()
 
+        redis_connection.delete(
+            self._schema_fingerprints_key,
+            *schema_changes.keys(self.id),
+            *schema_index.keys(self.id),
+            *table_stats.keys(self.id),
+        )
         redis_connection.delete(self._schema_key)
 
         return res
 
-    def get_cached_schema(self):
+    def _load_cached_schema(self):
         cache = redis_connection.get(self._schema_key)
         return json_loads(cache) if cache else None
 
+    def get_cached_schema(self):
+        return self.with_table_stats(self._load_cached_schema())
+
     def get_schema(self, refresh=False):
         out_schema = None
         if not refresh:
-            out_schema = self.get_cached_schema()
+            out_schema = self._load_cached_schema()
 
         if out_schema is None:
             query_runner = self.query_runner
-            schema = query_runner.get_schema(get_stats=refresh)
+            previous_schema = self._load_cached_schema() if refresh else None
+            ttl = int(timedelta(minutes=settings.SCHEMAS_REFRESH_SCHEDULE, days=7).total_seconds())
+
+            schema = None
+            if refresh and settings.SCHEMA_INCREMENTAL_REFRESH_ENABLED:
+                schema = self._fetch_schema_incrementally(query_runner, previous_schema, ttl)
+            if schema is None:
+                schema = query_runner.get_schema()
 
             try:
                 out_schema = self._sort_schema(schema)
@@ -233,10 +797,136 @@ class DataSource(BelongsToOrgMixin, db.Model):
                 logging.exception("Error sorting schema columns for data_source {}".format(self.id))
                 out_schema = schema
             finally:
-                ttl = int(timedelta(minutes=settings.SCHEMAS_REFRESH_SCHEDULE, days=7).total_seconds())
-                redis_connection.set(self._schema_key, json_dumps(out_schema), ex=ttl)
+                if previous_schema is not None and previous_schema == out_schema:
+                    redis_connection.expire(self._schema_key, ttl)
+                else:
+                    redis_connection.set(self._schema_key, json_dumps(out_schema), ex=ttl)
+
+            if isinstance(previous_schema, list) and isinstance(out_schema, list):
+                schema_changes.record(self.id, previous_schema, out_schema, ttl)
+            if isinstance(out_schema, list):
+                schema_index.update(
+                    self.id, previous_schema if isinstance(previous_schema, list) else None, out_schema, ttl
+                )
 
-        return out_schema
+        return self.with_table_stats(out_schema)
+
+    def with_table_stats(self, tables):
+        """
+        Sets the `size` of the given tables (of the schema) from the cached table stats.
+        """
+        if not settings.SCHEMA_RUN_TABLE_SIZE_CALCULATIONS or not isinstance(tables, list):
+            return tables
+
+        stats = table_stats.get(self.id, [table["name"] for table in tables if isinstance(table, dict)])
+        for table in tables:
+            if isinstance(table, dict) and table["name"] in stats:
+                table["size"] = stats[table["name"]]["rows"]
+
+        return tables
+
+    def refresh_table_stats(self):
+        """
+        Estimates the row counts of the tables of the cached schema, and counts the rows of the tables without an
+        estimate whose count is missing or older than `SCHEMA_TABLE_STATS_TTL` (the least recently counted first, up
+        to `SCHEMA_TABLE_STATS_MAX_COUNTS` of them).
+        """
+        schema = self._load_cached_schema()
+        if not isinstance(schema, list):
+            return {}
+
+        query_runner = self.query_runner
+        table_names = [table["name"] for table in schema if isinstance(table, dict)]
+        now = time.time()
+
+        try:
+            estimates = query_runner.get_table_row_estimates()
+        except NotSupported:
+            estimates = {}
+
+        stats = {
+            name: {"rows": estimates[name], "estimated": True, "updated_at": now}
+            for name in table_names
+            if name in estimates
+        }
+
+        cached = table_stats.get(self.id)
+        counted_at = {name: cached[name]["updated_at"] for name in cached if not cached[name]["estimated"]}
+        outdated = [
+            name
+            for name in table_names
+            if name not in stats and now - counted_at.get(name, 0) > settings.SCHEMA_TABLE_STATS_TTL
+        ]
+        outdated.sort(key=lambda name: counted_at.get(name, 0))
+
+        try:
+            counts = query_runner.count_table_rows(outdated[: settings.SCHEMA_TABLE_STATS_MAX_COUNTS])
+        except NotSupported:
+            counts = {}
+
+        stats.update({name: {"rows": rows, "estimated": False, "updated_at": now} for name, rows in counts.items()})
+        table_stats.save(self.id, stats, table_names)
+
+        logger.info(
+            "Refreshed table stats of data source %s: %d estimated, %d counted", self.id, len(estimates), len(counts)
+        )
+        return stats
+
+    def get_schema_index(self):
+        """
+        Returns the search index of the cached schema, building it if needed, or None when no schema is cached.
+        """
+        if schema_index.exists(self.id):
+            return schema_index
+
+        schema = self._load_cached_schema()
+        if not isinstance(schema, list):
+            return None
+
+        ttl = redis_connection.ttl(self._schema_key)
+        schema_index.update(self.id, None, schema, ttl if ttl > 0 else int(timedelta(days=7).total_seconds()))
+        return schema_index
+
+    def _fetch_schema_incrementally(self, query_runner, previous_schema, ttl):
+        """
+        Fetches only the tables whose fingerprint changed since the previous refresh, and merges them into the
+        previous schema. Falls back to fetching the whole schema when there's nothing to merge into or most tables
+        changed. Returns None when the query runner can't fingerprint tables.
+        """
+        try:
+            fingerprints = query_runner.get_table_fingerprints()
+        except NotSupported:
+            return None
+
+        previous_fingerprints = redis_connection.hgetall(self._schema_fingerprints_key)
+        changed = [
+            name for name, fingerprint in fingerprints.items() if previous_fingerprints.get(name) != fingerprint
+        ]
+
+        if not isinstance(previous_schema, list) or not previous_fingerprints or 2 * len(changed) > len(fingerprints):
+            schema = query_runner.get_schema()
+        else:
+            unchanged = set(fingerprints) - set(changed)
+            tables = {t["name"]: t for t in previous_schema if t["name"] in unchanged}
+            for offset in range(0, len(changed), SCHEMA_INCREMENTAL_REFRESH_BATCH):
+                batch = changed[offset : offset + SCHEMA_INCREMENTAL_REFRESH_BATCH]
+                tables.update({t["name"]: t for t in query_runner.get_tables_schema(batch)})
+            schema = list(tables.values())
+
+        pipe = redis_connection.pipeline()
+        pipe.delete(self._schema_fingerprints_key)
+        if fingerprints:
+            pipe.hset(self._schema_fingerprints_key, mapping=fingerprints)
+            pipe.expire(self._schema_fingerprints_key, ttl)
+        pipe.execute()
+
+        logger.info(
+            "Refreshed schema of data source %s incrementally: %d of %d tables changed",
+            self.id,
+            len(changed),
+            len(fingerprints),
+        )
+        return schema
 
     def _sort_schema(self, schema):
         return [
@@ -257,6 +947,10 @@ class DataSource(BelongsToOrgMixin, db.Model):
     def _schema_key(self):
         return "data_source:schema:{}".format(self.id)
 
+    @property
+    def _schema_fingerprints_key(self):
+        return "data_source:schema:{}:fingerprints".format(self.id)
+
     @property
     def _pause_key(self):
         return "ds:{}:pause".format(self.id)
@@ -285,6 +979,8 @@ class DataSource(BelongsToOrgMixin, db.Model):
             delete(DataSourceGroup).where(DataSourceGroup.group == group, DataSourceGroup.data_source == self)
         )
         db.session.commit()
+        # The groups of the API keys of its queries changed
+        api_key_principals.invalidate()
 
     def update_group_permission(self, group, view_only):
         dsg = db.session.scalars(
@@ -317,6 +1013,25 @@ class DataSource(BelongsToOrgMixin, db.Model):
         grps = db.session.scalars(select(DataSourceGroup).where(DataSourceGroup.data_source == self)).all()
         return {g.group_id: g.view_only for g in grps}
 
+    @classmethod
+    def groups_of(cls, data_source_ids):
+        """
+        Returns `{data_source_id: groups}` (see `groups`) for several data sources at once.
+        """
+        groups = {data_source_id: {} for data_source_id in data_source_ids}
+        if not groups:
+            return groups
+
+        rows = db.session.execute(
+            select(DataSourceGroup.data_source_id, DataSourceGroup.group_id, DataSourceGroup.view_only).where(
+                DataSourceGroup.data_source_id.in_(groups)
+            )
+        ).all()
+        for row in rows:
+            groups[row.data_source_id][row.group_id] = row.view_only
+
+        return groups
+
 
 @generic_repr("id", "data_source_id", "group_id", "view_only")
 class DataSourceGroup(db.Model):
@@ -332,6 +1047,12 @@ class DataSourceGroup(db.Model):
     __table_args__ = ({"extend_existing": True},)
 
 
+@listens_for(DataSourceGroup, "after_insert")
+@listens_for(DataSourceGroup, "after_delete")
+def data_source_groups_changed(mapper, connection, target):
+    api_key_principals.invalidate_on_commit(target)
+
+
 @generic_repr("id", "org_id", "data_source_id", "query_hash", "runtime", "retrieved_at")
 class QueryResult(db.Model, BelongsToOrgMixin):
     id = primary_key("QueryResult")
@@ -391,6 +1112,33 @@ class QueryResult(db.Model, BelongsToOrgMixin):
 
         return db.session.scalar(query.order_by(cls.retrieved_at.desc()))
 
+    @classmethod
+    def get_latest_many(cls, keys, max_age=0):
+        """
+        Like `get_latest` for several `(data_source_id, query_hash)` pairs at once. Returns the latest results by pair,
+        leaving out the pairs without a result (recent enough).
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+
+        if max_age == -1 and settings.QUERY_RESULTS_EXPIRED_TTL_ENABLED:
+            max_age = settings.QUERY_RESULTS_EXPIRED_TTL
+
+        conditions = [tuple_(cls.data_source_id, cls.query_hash).in_(keys)]
+        if max_age != -1:
+            conditions.append(
+                func.timezone("utc", cls.retrieved_at) + timedelta(seconds=max_age) >= func.timezone("utc", func.now())
+            )
+
+        query = (
+            select(cls)
+            .where(*conditions)
+            .distinct(cls.data_source_id, cls.query_hash)
+            .order_by(cls.data_source_id, cls.query_hash, cls.retrieved_at.desc())
+        )
+        return {(result.data_source_id, result.query_hash): result for result in db.session.scalars(query)}
+
     @classmethod
     def store_result(cls, org, data_source, query_hash, query, data, run_time, retrieved_at):
         queries = db.session.scalars(
@@ -421,12 +1169,143 @@ class QueryResult(db.Model, BelongsToOrgMixin):
         return self.data_source.groups
 
 
-def should_schedule_next(previous_iteration, now, interval, time=None, day_of_week=None, failures=0):
+def _percentile(values, percent):
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+class QueryRuntimeStats(db.Model, BelongsToOrgMixin):
+    """
+    Rolling execution statistics per (data source, query hash), updated by the query executor after every run.
+    Percentiles are computed over the last `QUERY_RUNTIME_STATS_HISTORY` runs, while the counters and totals cover
+    every run since the statistics were created.
+    """
+
+    id = primary_key("QueryRuntimeStats")
+    org_id = Column(key_type("Organization"), db.ForeignKey("organizations.id"))
+    org = db.relationship(Organization, uselist=False)
+    data_source_id = Column(key_type("DataSource"), db.ForeignKey("data_sources.id", ondelete="CASCADE"))
+    data_source = db.relationship(DataSource, uselist=False)
+    query_hash = Column(db.String(32))
+    run_count = Column(db.Integer, default=0)
+    failure_count = Column(db.Integer, default=0)
+    total_runtime = Column(DOUBLE_PRECISION, default=0)
+    p50_runtime = Column(DOUBLE_PRECISION, nullable=True)
+    p95_runtime = Column(DOUBLE_PRECISION, nullable=True)
+    last_runtime = Column(DOUBLE_PRECISION, nullable=True)
+    last_row_count = Column(db.Integer, nullable=True)
+    last_result_bytes = Column(db.BigInteger, nullable=True)
+    recent_runs = Column(MutableList.as_mutable(JSONB), default=[])
+    last_run_at = Column(db.DateTime(True), nullable=True)
+
+    __tablename__ = "query_runtime_stats"
+    __table_args__ = (
+        UniqueConstraint("data_source_id", "query_hash", name="unique_query_runtime_stats"),
+        db.Index("ix_query_runtime_stats_total_runtime", "org_id", "total_runtime"),
+    )
+
+    def to_dict(self):
+        return {
+            "data_source_id": self.data_source_id,
+            "query_hash": self.query_hash,
+            "run_count": self.run_count,
+            "failure_count": self.failure_count,
+            "total_runtime": self.total_runtime,
+            "p50_runtime": self.p50_runtime,
+            "p95_runtime": self.p95_runtime,
+            "last_runtime": self.last_runtime,
+            "last_row_count": self.last_row_count,
+            "last_result_bytes": self.last_result_bytes,
+            "last_run_at": self.last_run_at,
+            "recent_runs": self.recent_runs,
+        }
+
+    def add_run(self, runtime, run_at, row_count=None, result_bytes=None, failed=False):
+        self.run_count = (self.run_count or 0) + 1
+        self.failure_count = (self.failure_count or 0) + (1 if failed else 0)
+        self.total_runtime = (self.total_runtime or 0) + runtime
+        self.last_runtime = runtime
+        self.last_run_at = run_at
+
+        if not failed:
+            self.last_row_count = row_count
+            self.last_result_bytes = result_bytes
+
+        recent_runs = list(self.recent_runs or [])
+        recent_runs.append(
+            {
+                "run_at": run_at.isoformat(),
+                "runtime": runtime,
+                "rows": row_count,
+                "bytes": result_bytes,
+                "failed": failed,
+            }
+        )
+        self.recent_runs = recent_runs[-settings.QUERY_RUNTIME_STATS_HISTORY :]
+
+        runtimes = [run["runtime"] for run in self.recent_runs]
+        self.p50_runtime = _percentile(runtimes, 50)
+        self.p95_runtime = _percentile(runtimes, 95)
+
+    @classmethod
+    def get(cls, data_source_id, query_hash):
+        return db.session.scalar(select(cls).where(cls.data_source_id == data_source_id, cls.query_hash == query_hash))
+
+    @classmethod
+    def record_run(cls, org_id, data_source_id, query_hash, runtime, row_count=None, result_bytes=None, failed=False):
+        # Make sure the row exists and lock it, so concurrent runs of the same query don't lose updates.
+        db.session.execute(
+            insert(cls)
+            .values(
+                org_id=org_id,
+                data_source_id=data_source_id,
+                query_hash=query_hash,
+                run_count=0,
+                failure_count=0,
+                total_runtime=0,
+                recent_runs=[],
+            )
+            .on_conflict_do_nothing(index_elements=["data_source_id", "query_hash"])
+        )
+        stats = db.session.scalar(
+            select(cls).where(cls.data_source_id == data_source_id, cls.query_hash == query_hash).with_for_update()
+        )
+        stats.add_run(runtime, utils.utcnow(), row_count, result_bytes, failed)
+        db.session.add(stats)
+
+        return stats
+
+    @classmethod
+    def top_by_total_runtime(cls, org, data_source_id=None, limit=50):
+        query = select(cls).where(cls.org == org)
+        if data_source_id is not None:
+            query = query.where(cls.data_source_id == data_source_id)
+
+        return db.session.scalars(query.order_by(cls.total_runtime.desc()).limit(limit)).all()
+
+
+def next_scheduled_run(previous_iteration, interval, time=None, day_of_week=None, failures=0, offset=None):
+    """
+    Returns when a query that last ran at `previous_iteration` is due next, or None if it will never be due (the
+    failure backoff overflows).
+
+    `offset` (seconds) delays schedules with a specific time. For interval based schedules it's the query's slot
+    instead: the query runs at `offset + k * interval` seconds since the epoch, the first such slot at least half an
+    interval after the previous run, so its period doesn't change.
+    """
     # if time exists then interval > 23 hours (82800s)
     # if day_of_week exists then interval > 6 days (518400s)
     if time is None:
         ttl = int(interval)
         next_iteration = previous_iteration + timedelta(seconds=ttl)
+
+        if offset is not None and ttl > 0:
+            earliest = previous_iteration.timestamp() + ttl / 2.0
+            slot = (math.floor((earliest - offset % ttl) / ttl) + 1) * ttl + offset % ttl
+            next_iteration = previous_iteration + timedelta(seconds=slot - previous_iteration.timestamp())
     else:
         hour, minute = time.split(":")
         hour, minute = int(hour), int(minute)
@@ -449,12 +1328,40 @@ def should_schedule_next(previous_iteration, now, interval, time=None, day_of_we
         next_iteration = (previous_iteration + timedelta(days=days_delay) + timedelta(days=days_to_add)).replace(
             hour=hour, minute=minute
         )
+        if offset:
+            next_iteration += timedelta(seconds=offset)
     if failures:
         try:
             next_iteration += timedelta(minutes=2**failures)
         except OverflowError:
-            return False
-    return now > next_iteration
+            return None
+    return next_iteration
+
+
+def should_schedule_next(previous_iteration, now, interval, time=None, day_of_week=None, failures=0):
+    next_iteration = next_scheduled_run(previous_iteration, interval, time, day_of_week, failures)
+    return next_iteration is not None and now > next_iteration
+
+
+def demand_deferral(previous_iteration, next_iteration, last_activity, now, schedule):
+    """
+    Demand-driven scheduling: returns when a due query whose results weren't accessed lately should be evaluated
+    again instead of running now, or None if it should run. Queries idle for DEMAND_SCHEDULING_IDLE_DAYS run
+    DEMAND_SCHEDULING_SLOWDOWN times less often, and queries idle for DEMAND_SCHEDULING_SUSPEND_DAYS don't run at all.
+    """
+    idle = now - last_activity
+    if settings.DEMAND_SCHEDULING_SUSPEND_DAYS and idle > timedelta(days=settings.DEMAND_SCHEDULING_SUSPEND_DAYS):
+        run_at = None
+    elif settings.DEMAND_SCHEDULING_SLOWDOWN > 1 and idle > timedelta(days=settings.DEMAND_SCHEDULING_IDLE_DAYS):
+        run_at = previous_iteration + (next_iteration - previous_iteration) * settings.DEMAND_SCHEDULING_SLOWDOWN
+        if now > run_at:
+            return None
+    else:
+        return None
+
+    # Evaluate the query again when its next run would have been due, so every skipped run is accounted for.
+    upcoming = next_scheduled_run(now, schedule["interval"], schedule["time"], schedule["day_of_week"])
+    return min(run_at, upcoming) if run_at else upcoming
 
 
 @gfk_type
@@ -498,8 +1405,14 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
     schedule = Column(MutableDict.as_mutable(JSONB), nullable=True)
     interval = json_cast_property(db.Integer, "schedule", "interval", default=0)
     schedule_failures = Column(db.Integer, default=0)
+    # A lower bound of when the query is due next, so the scheduler only looks at queries that might be due. Reset
+    # to "now" whenever the schedule or the latest result changes and pushed forward by `outdated_queries`.
+    next_run_at = Column(db.DateTime(True), nullable=True, index=True)
     visualizations = db.relationship("Visualization", cascade="all, delete-orphan")
     options = Column(MutableDict.as_mutable(JSONB), default={})
+    # Parameter names, types and `is_safe`, worked out of the text and options when the query is saved (see
+    # `collect_parameter_metadata`). None until then.
+    parameter_metadata = Column(JSONB(none_as_null=True), nullable=True)
     alerts = db.relationship("Alert", back_populates="query", lazy="noload")
     search_vector = Column(
         TSVectorType(
@@ -515,7 +1428,17 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
 
     query_class = SearchBaseQuery
     __tablename__ = "queries"
-    __table_args__ = ({"extend_existing": True},)
+    __table_args__ = (
+        # Trigram indexes, for the substring matching of the multi byte search
+        db.Index("ix_queries_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        db.Index(
+            "ix_queries_description_trgm",
+            "description",
+            postgresql_using="gin",
+            postgresql_ops={"description": "gin_trgm_ops"},
+        ),
+        {"extend_existing": True},
+    )
     __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
 
     def __str__(self):
@@ -623,41 +1546,82 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
                 queries.append(query)
         return queries
 
+    def reschedule(self, next_run_at):
+        if self.next_run_at != next_run_at:
+            self.next_run_at = next_run_at
+            # Rescheduling isn't a modification of the query
+            self.skip_updated_at = True
+
     @classmethod
-    def outdated_queries(cls):
-        queries = db.session.scalars(
-            select(Query).where(func.jsonb_typeof(Query.schedule) != "null").order_by(Query.id)
+    def outdated_queries(cls, query_ids=None):
+        """
+        Returns the scheduled queries that are due, most overdue first (only among `query_ids` when given). The next run
+        times of the queries that aren't due are updated in the session, for the caller to commit.
+        """
+        # Flush pending changes first, so queries marked for re-evaluation aren't stamped after `now`.
+        db.session.flush()
+        now = utils.utcnow()
+        due = select(Query, QueryResult.retrieved_at, QueryResult.runtime).outerjoin(
+            QueryResult, QueryResult.id == Query.latest_query_data_id
+        )
+        if query_ids is not None:
+            due = due.where(Query.id.in_(query_ids))
+        rows = db.session.execute(
+            due.where(func.jsonb_typeof(Query.schedule) != "null", Query.next_run_at <= now).order_by(Query.id)
         ).all()
+        query_ids = [row[0].id for row in rows]
 
-        now = utils.utcnow()
         outdated_queries = {}
-        scheduled_queries_executions.refresh()
+        due_at = {}
+        scheduled_queries_executions.refresh(query_ids)
+        offsets = schedule_offsets([row[0] for row in rows])
 
-        for query in queries:
+        demand_driven = settings.DEMAND_SCHEDULING_ENABLED and query_ids
+        if demand_driven:
+            accessed_at = query_accesses.get(query_ids)
+            # Alerts consume results whether or not anybody looks at them.
+            alerted = set(db.session.scalars(select(Alert.query_id).where(Alert.query_id.in_(query_ids))))
+
+        for query, latest_retrieved_at, latest_runtime in rows:
             try:
                 if query.schedule.get("disabled"):
+                    query.reschedule(None)
                     continue
 
                 if query.schedule["until"]:
                     schedule_until = utc.localize(datetime.strptime(query.schedule["until"], "%Y-%m-%d"))
 
                     if schedule_until <= now:
+                        query.reschedule(None)
                         continue
 
-                retrieved_at = scheduled_queries_executions.get(query.id) or (
-                    query.latest_query_data and query.latest_query_data.retrieved_at
-                )
+                retrieved_at = scheduled_queries_executions.get(query.id) or latest_retrieved_at
 
-                if should_schedule_next(
+                next_iteration = next_scheduled_run(
                     retrieved_at or now,
-                    now,
                     query.schedule["interval"],
                     query.schedule["time"],
                     query.schedule["day_of_week"],
                     query.schedule_failures,
-                ):
+                    offsets.get(query.id),
+                )
+
+                if next_iteration is not None and now > next_iteration:
+                    if demand_driven and query.id not in alerted:
+                        last_activity = max(filter(None, [accessed_at.get(query.id), query.created_at]))
+                        deferred_until = demand_deferral(
+                            retrieved_at or now, next_iteration, last_activity, now, query.schedule
+                        )
+                        if deferred_until is not None:
+                            query_accesses.skip_run(latest_runtime or 0)
+                            query.reschedule(deferred_until)
+                            continue
+
                     key = "{}:{}".format(query.query_hash, query.data_source_id)
                     outdated_queries[key] = query
+                    due_at[key] = next_iteration
+                else:
+                    query.reschedule(next_iteration)
             except Exception as e:
                 query.schedule["disabled"] = True
                 db.session.commit()
@@ -669,7 +1633,28 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
                 logging.info(message)
                 sentry.capture_exception(type(e)(message).with_traceback(e.__traceback__))
 
-        return list(outdated_queries.values())
+        return [outdated_queries[key] for key in sorted(outdated_queries, key=due_at.get)]
+
+    @classmethod
+    def substring_search(cls, queries, term):
+        """
+        Since tsvector doesn't work well with CJK languages, the multi byte search matches `term` anywhere in the name
+        or description. Like the full text search, matches in the name rank first.
+
+        The matches are ranked in an outer select, as `queries` are ordered by ID for their DISTINCT ON. The trigram
+        indexes only narrow down terms of at least 3 characters: pg_trgm can't extract a trigram from shorter ones
+        (most CJK words are 1 or 2 characters), so those are matched against every query `queries` selects.
+        """
+        pattern = "%{}%".format(term)
+        matches = queries.where(or_(cls.name.ilike(pattern), cls.description.ilike(pattern))).with_only_columns(cls.id)
+        rank = func.word_similarity(term, cls.name) * 2 + func.coalesce(func.word_similarity(term, cls.description), 0)
+        return (
+            select(cls, User)
+            .outerjoin(User, User.id == cls.user_id)
+            .outerjoin(QueryResult, QueryResult.id == cls.latest_query_data_id)
+            .where(cls.id.in_(matches))
+            .order_by(rank.desc(), cls.id)
+        )
 
     @classmethod
     def search(
@@ -690,13 +1675,7 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
         )
 
         if multi_byte_search:
-            # Since tsvector doesn't work well with CJK languages, use `ilike` too
-            pattern = "%{}%".format(term)
-            return (
-                all_queries.where(or_(cls.name.ilike(pattern), cls.description.ilike(pattern)))
-                .order_by(Query.id)
-                .limit(limit)
-            )
+            return cls.substring_search(all_queries, term).limit(limit)
 
         # sort the result using the weight as defined in the search vector column
         return searchable_search(all_queries, term, sort=True).limit(limit)
@@ -704,42 +1683,43 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
     @classmethod
     def search_by_user(cls, term, user, limit=None, multi_byte_search=False):
         if multi_byte_search:
-            # Since tsvector doesn't work well with CJK languages, use `ilike` too
-            pattern = "%{}%".format(term)
-            return (
-                cls.by_user(user)
-                .where(or_(cls.name.ilike(pattern), cls.description.ilike(pattern)))
-                .order_by(Query.id)
-                .limit(limit)
-            )
+            return cls.substring_search(cls.by_user(user), term).limit(limit)
 
         return searchable_search(cls.by_user(user), term, sort=True).limit(limit)
 
     @classmethod
     def recent(cls, group_ids, user_id=None, limit=20):
-        query = (
-            select(cls)
-            .where(Event.created_at > (func.current_date() - 7))
-            .join(Event, Query.id == Event.object_id.cast(db.Integer))
-            .join(DataSourceGroup, Query.data_source_id == DataSourceGroup.data_source_id)
-            .where(
-                Event.action.in_(["edit", "scalars", "edit_name", "edit_description", "view_source"]),
-                Event.object_id is not None,
-                Event.object_type == "query",
-                DataSourceGroup.group_id.in_(group_ids),
-                or_(Query.is_draft.is_(False), Query.user_id is user_id),
-                Query.is_archived.is_(False),
-            )
-            .group_by(Event.object_id, Query.id)
-            .order_by(db.desc(func.count(0)))
-        )
-
-        if user_id:
-            query = query.where(Event.user_id == user_id)
+        """
+        Returns the queries the user (or anyone in their organization) edited the most lately, among the ones
+        `group_ids` give access to.
+        """
+        org_id = db.session.scalar(select(Group.org_id).where(Group.id.in_(group_ids)).limit(1))
+        if org_id is None:
+            return []
 
-        query = query.limit(limit)
+        recent = []
+        offset = 0
+        while len(recent) < limit:
+            # Access is checked after reading the ids, so read a few more than needed
+            query_ids = recent_queries.get(org_id, user_id, offset=offset, count=limit * 2)
+            if not query_ids:
+                break
+            offset += len(query_ids)
+
+            queries = db.session.scalars(
+                select(cls)
+                .join(DataSourceGroup, Query.data_source_id == DataSourceGroup.data_source_id)
+                .where(
+                    Query.id.in_(query_ids),
+                    DataSourceGroup.group_id.in_(group_ids),
+                    or_(Query.is_draft.is_(False), Query.user_id == user_id),
+                    Query.is_archived.is_(False),
+                )
+            ).unique()
+            by_id = {query.id: query for query in queries}
+            recent.extend(by_id[query_id] for query_id in query_ids if query_id in by_id)
 
-        return db.session.scalars(query).all()
+        return recent[:limit]
 
     @classmethod
     def get_by_id(cls, _id):
@@ -810,7 +1790,52 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
 
     @property
     def parameterized(self):
-        return ParameterizedQuery(self.query_text, self.parameters, self.org)
+        names = self.parameter_metadata["names"] if self.parameter_metadata else None
+        return ParameterizedQuery(self.query_text, self.parameters, self.org, parameter_names=names)
+
+    @property
+    def is_safe(self):
+        if self.parameter_metadata:
+            return self.parameter_metadata["is_safe"]
+
+        return self.parameterized.is_safe
+
+    def update_parameter_metadata(self):
+        self.parameter_metadata = collect_parameter_metadata(self.query_text, (self.options or {}).get("parameters"))
+
+    @classmethod
+    def backfill_parameter_metadata(cls, batch_size=1000):
+        """
+        Stores the parameter metadata of the queries saved before it was kept, `batch_size` queries at a time, without
+        touching anything else. Returns the number of queries updated.
+        """
+        table = cls.__table__
+        updated = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(cls.id, cls.query_text, cls.options)
+                .where(cls.parameter_metadata.is_(None), cls.id > last_id)
+                .order_by(cls.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return updated
+
+            db.session.execute(
+                update(table).where(table.c.id == bindparam("_id")).values(parameter_metadata=bindparam("_metadata")),
+                [
+                    {
+                        "_id": row.id,
+                        "_metadata": collect_parameter_metadata(row.query_text, (row.options or {}).get("parameters")),
+                    }
+                    for row in rows
+                ],
+            )
+            db.session.commit()
+
+            updated += len(rows)
+            last_id = rows[-1].id
 
     @property
     def dashboard_api_keys(self):
@@ -844,11 +1869,43 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
         self.query_hash = query_runner.gen_query_hash(query_text, should_apply_auto_limit)
 
 
+# Changes to these make the scheduler re-evaluate when the query is due next.
+SCHEDULING_ATTRIBUTES = ("schedule", "schedule_failures", "latest_query_data", "latest_query_data_id")
+
+
 @listens_for(Query, "before_insert")
 @listens_for(Query, "before_update")
 def receive_before_insert_update(mapper, connection, target):
     target.update_query_hash()
 
+    state = inspect(target)
+    if target.parameter_metadata is None or any(
+        state.attrs[attr].history.has_changes() for attr in ("query_text", "options")
+    ):
+        target.update_parameter_metadata()
+
+    if state.pending or any(state.attrs[attr].history.has_changes() for attr in SCHEDULING_ATTRIBUTES):
+        target.next_run_at = utils.utcnow() if target.schedule else None
+
+
+@listens_for(Query.query_text, "set")
+@listens_for(Query.options, "set")
+def query_parameters_changed(target, val, oldval, initiator):
+    # Worked out again when the query is saved
+    target.parameter_metadata = None
+
+
+@listens_for(Query.__table__, "before_create")
+def create_trigram_extension(target, connection, **kw):
+    # The trigram indexes need pg_trgm, which migrations create on existing databases
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
+@listens_for(Query, "after_update")
+def query_api_key_changed(mapper, connection, target):
+    if any(get_history(target, attr).has_changes() for attr in ("api_key", "data_source_id", "org_id")):
+        api_key_principals.invalidate_on_commit(target)
+
 
 @listens_for(Query.user_id, "set")
 def query_last_modified_by(target, val, oldval, initiator):
@@ -1212,6 +2269,49 @@ class Widget(TimestampMixin, BelongsToOrgMixin, db.Model):
     def get_by_id_and_org(cls, object_id, org):
         return super(Widget, cls).get_by_id_and_org(object_id, org, Dashboard)
 
+    @classmethod
+    def query_widgets(cls, dashboard, widget_ids=None):
+        """
+        Returns the visualization widgets of a dashboard along with their visualizations, queries and data sources,
+        in a single statement.
+        """
+        query = (
+            select(cls)
+            .join(Visualization, Visualization.id == cls.visualization_id)
+            .join(Query, Query.id == Visualization.query_id)
+            .outerjoin(DataSource, DataSource.id == Query.data_source_id)
+            .options(
+                contains_eager(cls.visualization).contains_eager(Visualization.query).contains_eager(Query.data_source)
+            )
+            .where(cls.dashboard_id == dashboard.id)
+            .order_by(cls.id)
+        )
+        if widget_ids is not None:
+            query = query.where(cls.id.in_(widget_ids))
+
+        return db.session.scalars(query).unique().all()
+
+    @classmethod
+    def dashboard_widgets(cls, dashboard):
+        """
+        Returns the widgets of a dashboard along with what serializing them needs (their visualizations, queries and
+        the queries' authors), in a fixed number of statements.
+        """
+        query = (
+            select(cls)
+            .outerjoin(Visualization, Visualization.id == cls.visualization_id)
+            .outerjoin(Query, Query.id == Visualization.query_id)
+            .options(
+                contains_eager(cls.visualization)
+                .contains_eager(Visualization.query)
+                .options(selectinload(Query.user), selectinload(Query.last_modified_by))
+            )
+            .where(cls.dashboard_id == dashboard.id)
+            .order_by(cls.id)
+        )
+
+        return db.session.scalars(query).unique().all()
+
     def copy(self, dashboard_id):
         return {
             "options": self.options,
@@ -1224,7 +2324,7 @@ class Widget(TimestampMixin, BelongsToOrgMixin, db.Model):
 
 @generic_repr("id", "object_type", "object_id", "action", "user_id", "org_id", "created_at")
 class Event(db.Model):
-    id = primary_key("Event")
+    id = Column(key_type("Event"), primary_key=True, autoincrement=True)
     org_id = Column(key_type("Organization"), db.ForeignKey("organizations.id"))
     org = db.relationship(Organization, back_populates="events", uselist=False)
     user_id = Column(key_type("User"), db.ForeignKey("users.id"), nullable=True)
@@ -1233,9 +2333,12 @@ class Event(db.Model):
     object_type = Column(db.String(255))
     object_id = Column(db.String(255), nullable=True)
     additional_properties = Column(MutableDict.as_mutable(JSONB), nullable=True, default={})
-    created_at = Column(db.DateTime(True), default=func.now())
+    # Part of the primary key, as the table is partitioned by month of creation (see `create_partitions`)
+    created_at = Column(db.DateTime(True), default=func.now(), primary_key=True)
 
     __tablename__ = "events"
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
+    DEFAULT_PARTITION = "events_default"
 
     def __str__(self):
         return "%s,%s,%s,%s" % (
@@ -1258,6 +2361,7 @@ class Event(db.Model):
 
     @classmethod
     def record(cls, event):
+        event_id = event.pop("id", None)
         org_id = event.pop("org_id")
         user_id = event.pop("user_id", None)
         action = event.pop("action")
@@ -1267,6 +2371,7 @@ class Event(db.Model):
         created_at = datetime.utcfromtimestamp(event.pop("timestamp"))
 
         event = cls(
+            id=event_id,
             org_id=org_id,
             user_id=user_id,
             action=action,
@@ -1278,6 +2383,168 @@ class Event(db.Model):
         db.session.add(event)
         return event
 
+    @classmethod
+    def allocate_ids(cls, count):
+        """
+        Returns `count` ids from the events sequence, for events to know theirs before they are inserted.
+        """
+        return db.session.scalars(
+            text("SELECT nextval('events_id_seq') FROM generate_series(1, :count)"), {"count": count}
+        ).all()
+
+    @staticmethod
+    def partition_name(month):
+        return "events_y{:04d}m{:02d}".format(month.year, month.month)
+
+    @classmethod
+    def partition_month(cls, name):
+        match = re.match(r"^events_y(\d{4})m(\d{2})$", name)
+        if match is None:
+            return None
+        return datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=utc)
+
+    @classmethod
+    def create_partitions(cls, connection, since, months):
+        """
+        Creates the monthly partitions from the month of `since` to `months` months after it, unless they exist.
+        Returns the names of the ones that can't be created as the default partition holds events of their month
+        (which the events table migrated into the default partition does for the month of the migration).
+        """
+        skipped = []
+        month = datetime(since.year, since.month, 1, tzinfo=utc)
+        for _ in range(months + 1):
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            try:
+                with connection.begin_nested():
+                    connection.execute(
+                        text(
+                            "CREATE TABLE IF NOT EXISTS {} PARTITION OF events FOR VALUES FROM ('{}') TO ('{}')".format(
+                                cls.partition_name(month), month.isoformat(), next_month.isoformat()
+                            )
+                        )
+                    )
+            except IntegrityError:
+                skipped.append(cls.partition_name(month))
+            month = next_month
+        return skipped
+
+    @classmethod
+    def partitions(cls, connection):
+        """
+        Returns `{name: month}` of the monthly partitions.
+        """
+        names = connection.scalars(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "WHERE parent.relname = 'events'"
+            )
+        )
+        months = {name: cls.partition_month(name) for name in names}
+        return {name: month for name, month in months.items() if month is not None}
+
+    @classmethod
+    def drop_partitions(cls, connection, before):
+        """
+        Drops the monthly partitions of the events created before `before`, and the default partition once it holds
+        events created before `before` only, replacing it with an empty one. This is how the events table migrated
+        into the default partition goes away at once instead of being deleted row by row. Returns the names of the
+        dropped partitions.
+        """
+        dropped = []
+        for name, month in sorted(cls.partitions(connection).items()):
+            if (month + timedelta(days=32)).replace(day=1) <= before:
+                connection.execute(text("DROP TABLE {}".format(name)))
+                dropped.append(name)
+
+        expired, kept = connection.execute(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM {0} WHERE created_at < :before), "
+                "EXISTS (SELECT 1 FROM {0} WHERE created_at >= :before)".format(cls.DEFAULT_PARTITION)
+            ),
+            {"before": before},
+        ).one()
+        if expired and not kept:
+            connection.execute(text("ALTER TABLE events DETACH PARTITION {}".format(cls.DEFAULT_PARTITION)))
+            connection.execute(text("DROP TABLE {}".format(cls.DEFAULT_PARTITION)))
+            connection.execute(text("CREATE TABLE {} PARTITION OF events DEFAULT".format(cls.DEFAULT_PARTITION)))
+            dropped.append(cls.DEFAULT_PARTITION)
+        return dropped
+
+    @classmethod
+    def delete_expired(cls, connection, before, limit):
+        """
+        Deletes up to `limit` of the events of the default partition created before `before`, for the ones it can't
+        be dropped with. Returns how many were deleted.
+        """
+        result = connection.execute(
+            text(
+                "DELETE FROM {0} WHERE ctid IN "
+                "(SELECT ctid FROM {0} WHERE created_at < :before LIMIT :limit)".format(cls.DEFAULT_PARTITION)
+            ),
+            {"before": before, "limit": limit},
+        )
+        return result.rowcount
+
+
+@listens_for(Event.__table__, "after_create")
+def create_event_partitions(target, connection, **kw):
+    # Events out of the range of the monthly partitions end up in the default one
+    connection.execute(
+        text("CREATE TABLE IF NOT EXISTS {} PARTITION OF events DEFAULT".format(Event.DEFAULT_PARTITION))
+    )
+    Event.create_partitions(connection, utils.utcnow(), settings.EVENTS_PARTITIONS_AHEAD)
+
+
+class EventDailyCount(db.Model):
+    """
+    Daily counts of events by organization, action and object type, which outlive the events themselves.
+    """
+
+    day = Column(db.Date, primary_key=True)
+    org_id = Column(key_type("Organization"), db.ForeignKey("organizations.id"), primary_key=True)
+    action = Column(db.String(255), primary_key=True)
+    object_type = Column(db.String(255), primary_key=True)
+    count = Column(db.Integer, nullable=False)
+
+    __tablename__ = "events_daily_counts"
+
+    @classmethod
+    def rollup(cls, until):
+        """
+        Counts the events of the days after the last one counted, up to the day before `until` (a UTC midnight).
+        Returns the number of days counted.
+        """
+        last_day = db.session.scalar(select(func.max(cls.day)))
+        if last_day is not None:
+            since = datetime(last_day.year, last_day.month, last_day.day, tzinfo=utc) + timedelta(days=1)
+        else:
+            since = db.session.scalar(select(func.min(Event.created_at)))
+            if since is None:
+                return 0
+            since = since.astimezone(utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        if since >= until:
+            return 0
+
+        day = func.date(func.timezone("UTC", Event.created_at))
+        counts = (
+            select(day, Event.org_id, Event.action, Event.object_type, func.count())
+            .where(Event.created_at >= since, Event.created_at < until)
+            .group_by(day, Event.org_id, Event.action, Event.object_type)
+        )
+        statement = insert(cls).from_select(["day", "org_id", "action", "object_type", "count"], counts)
+        db.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["day", "org_id", "action", "object_type"],
+                set_={"count": statement.excluded["count"]},
+            )
+        )
+        db.session.commit()
+
+        return (until - since).days
+
 
 @generic_repr("id", "created_by_id", "org_id", "active")
 class ApiKey(TimestampMixin, GFKBase, db.Model):
@@ -1313,6 +2580,12 @@ class ApiKey(TimestampMixin, GFKBase, db.Model):
         return k
 
 
+@listens_for(ApiKey, "after_update")
+@listens_for(ApiKey, "after_delete")
+def api_key_changed(mapper, connection, target):
+    api_key_principals.invalidate_on_commit(target)
+
+
 @generic_repr("id", "name", "type", "user_id", "org_id", "created_at")
 class NotificationDestination(BelongsToOrgMixin, db.Model):
     id = primary_key("NotificationDestination")
@@ -68,6 +68,25 @@ def _collect_query_parameters(query):
     return keys
 
 
+def collect_parameter_metadata(template, schema):
+    """
+    Returns what is worked out of a query's text and parameter definitions, to be stored with the query when it's
+    saved: the names of the parameters used in the text (None when it can't be parsed), the type of each defined
+    parameter and whether the query is safe to run with view only permissions.
+    """
+    schema = schema or []
+    try:
+        names = _collect_query_parameters(template or "")
+    except Exception:
+        names = None
+
+    return {
+        "names": names,
+        "types": {param["name"]: param.get("type") for param in schema},
+        "is_safe": ParameterizedQuery(template, schema).is_safe,
+    }
+
+
 def _parameter_names(parameter_values):
     names = []
     for key, value in parameter_values.items():
@@ -104,12 +123,14 @@ def _is_value_within_options(value, dropdown_options, allow_list=False):
 
 
 class ParameterizedQuery:
-    def __init__(self, template, schema=None, org=None):
+    def __init__(self, template, schema=None, org=None, parameter_names=None):
         self.schema = schema or []
         self.org = org
         self.template = template
         self.query = template
         self.parameters = {}
+        # Names of the parameters used in the template, when already known (see `collect_parameter_metadata`)
+        self.parameter_names = parameter_names
 
     def apply(self, parameters):
         invalid_parameter_names = [key for (key, value) in parameters.items() if not self._valid(key, value)]
@@ -175,7 +196,10 @@ class ParameterizedQuery:
 
     @property
     def missing_params(self):
-        query_parameters = set(_collect_query_parameters(self.template))
+        if self.parameter_names is None:
+            query_parameters = set(_collect_query_parameters(self.template))
+        else:
+            query_parameters = set(self.parameter_names)
         return set(query_parameters) - set(_parameter_names(self.parameters))
 
     @property
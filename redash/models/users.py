@@ -1,20 +1,26 @@
 import hashlib
 import itertools
 import logging
+import threading
 import time
+from collections import OrderedDict
 from functools import reduce
 from operator import or_
 
 from flask import current_app, request_started, url_for
 from flask_login import AnonymousUserMixin, UserMixin, current_user
 from passlib.apps import custom_app_context as pwd_context
-from sqlalchemy import func
+from prometheus_client import Counter, Histogram
+from sqlalchemy import cast, column, func, values
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB
-from sqlalchemy.sql.expression import delete, select
+from sqlalchemy.event import listens_for
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.sql.expression import delete, select, update
 from sqlalchemy_utils import EmailType
 from sqlalchemy_utils.models import generic_repr
 
-from redash import redis_connection
+from redash import redis_connection, settings
 from redash.models.base import Column, GFKBase, db, key_type, primary_key
 from redash.models.mixins import BelongsToOrgMixin, TimestampMixin
 from redash.models.types import MutableDict, MutableList, json_cast_property
@@ -25,23 +31,67 @@ logger = logging.getLogger(__name__)
 
 LAST_ACTIVE_KEY = "users:last_active_at"
 
+# Returns the fields and values of a hash and deletes it, atomically
+_take_hash = redis_connection.register_script(
+    """
+local values = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return values
+"""
+)
+
+syncLastActiveAtHistogram = Histogram(
+    "sync_last_active_at_seconds",
+    "Duration of the syncs of the users' last activity to the database, by phase",
+    ["phase"],
+)
+syncedLastActiveAtCounter = Counter("synced_last_active_at", "Users whose last activity was synced to the database")
+
 
 def sync_last_active_at():
     """
-    Update User model with the active_at timestamp from Redis. We first fetch
-    all the user_ids to update, and then fetch the timestamp to minimize the
-    time between fetching the value and updating the DB. This is because there
-    might be a more recent update we skip otherwise.
+    Update User model with the active_at timestamps from Redis. The hash of
+    timestamps is read and cleared in one step, so activity recorded in the
+    meantime waits for the next sync instead of being lost, and the users are
+    updated with a single statement.
     """
-    user_ids = redis_connection.hkeys(LAST_ACTIVE_KEY)
-    for user_id in user_ids:
-        timestamp = redis_connection.hget(LAST_ACTIVE_KEY, user_id)
-        active_at = dt_from_timestamp(timestamp)
-        user = db.session.scalar(select(User).where(User.id == user_id))
-        if user:
-            user.active_at = active_at
-        redis_connection.hdel(LAST_ACTIVE_KEY, user_id)
-    db.session.commit()
+    started = time.time()
+    flat = _take_hash(keys=[LAST_ACTIVE_KEY])
+    timestamps = dict(zip(flat[::2], flat[1::2]))
+    syncLastActiveAtHistogram.labels("fetch").observe(time.time() - started)
+    if not timestamps:
+        return 0
+
+    started = time.time()
+    active = values(column("id", User.id.type), column("active_at", db.Text), name="active").data(
+        [(int(user_id), dt_from_timestamp(timestamp).isoformat()) for user_id, timestamp in timestamps.items()]
+    )
+    try:
+        db.session.execute(
+            update(User)
+            .where(User.id == active.c.id)
+            .values(
+                details=func.jsonb_set(
+                    func.coalesce(User.details, cast({}, JSONB)),
+                    cast(["active_at"], ARRAY(db.Text)),
+                    func.to_jsonb(active.c.active_at),
+                )
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Leave the timestamps to the next sync, unless newer ones were recorded since
+        pipe = redis_connection.pipeline()
+        for user_id, timestamp in timestamps.items():
+            pipe.hsetnx(LAST_ACTIVE_KEY, user_id, timestamp)
+        pipe.execute()
+        raise
+
+    syncLastActiveAtHistogram.labels("update").observe(time.time() - started)
+    syncedLastActiveAtCounter.inc(len(timestamps))
+    return len(timestamps)
 
 
 def update_user_active_at(sender, *args, **kwargs):
@@ -61,6 +111,102 @@ def init_app(app):
     request_started.connect(update_user_active_at, app)
 
 
+apiKeyPrincipalsCounter = Counter(
+    "api_key_principals_cache", "Lookups of the principals of API keys in the cache, by result", ["result"]
+)
+
+
+class ApiKeyPrincipals:
+    """
+    What API keys resolve to (a user, an API key or a query with its groups), cached by every process for
+    `API_KEY_CACHE_TTL` seconds and up to `API_KEY_CACHE_SIZE` keys, so API clients aren't looked up on each request.
+    Entries are keyed by the hash of the key and tagged with a version kept in Redis. Committing a change to a key, to
+    a user's status or groups, or to the groups of a query bumps the version, which the committing process sees at
+    once and the others within `VERSION_INTERVAL` seconds.
+    """
+
+    VERSION_KEY = "api_key_principals:version"
+    # Seconds a process goes without reading the version again
+    VERSION_INTERVAL = 1
+    # Set in `Session.info` by changes that make the cached principals stale
+    STALE = "api_key_principals_stale"
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_read_at = 0
+
+    @staticmethod
+    def _key(api_key, org_id):
+        return "{}:{}".format(hashlib.sha256(api_key.encode()).hexdigest(), org_id)
+
+    def version(self):
+        with self._lock:
+            if time.time() - self._version_read_at < self.VERSION_INTERVAL:
+                return self._version
+
+        version = redis_connection.get(self.VERSION_KEY)
+        with self._lock:
+            self._version, self._version_read_at = version, time.time()
+        return version
+
+    def get(self, api_key, org_id, version):
+        """
+        Returns the principal `api_key` resolved to in the organization, if it's cached for the current `version`.
+        """
+        key = self._key(api_key, org_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                apiKeyPrincipalsCounter.labels("hit").inc()
+                return entry[2]
+            self._entries.pop(key, None)
+
+        apiKeyPrincipalsCounter.labels("miss").inc()
+        return None
+
+    def set(self, api_key, org_id, version, principal):
+        """
+        Caches `principal` for `version`, the one read before resolving it, so a change committed meanwhile isn't
+        hidden.
+        """
+        with self._lock:
+            self._entries[self._key(api_key, org_id)] = (version, time.time() + settings.API_KEY_CACHE_TTL, principal)
+            while len(self._entries) > settings.API_KEY_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        version = redis_connection.incr(self.VERSION_KEY)
+        with self._lock:
+            self._entries.clear()
+            self._version, self._version_read_at = str(version), time.time()
+
+    def invalidate_on_commit(self, target):
+        session = object_session(target)
+        if session is not None:
+            session.info[self.STALE] = True
+
+
+api_key_principals = ApiKeyPrincipals()
+
+
+@listens_for(Session, "after_commit")
+def invalidate_api_key_principals(session):
+    if session.info.pop(ApiKeyPrincipals.STALE, False):
+        api_key_principals.invalidate()
+
+
+@listens_for(Session, "after_rollback")
+def keep_api_key_principals(session):
+    session.info.pop(ApiKeyPrincipals.STALE, None)
+
+
+def _has_changes(target, attributes):
+    return any(get_history(target, attribute).has_changes() for attribute in attributes)
+
+
 class PermissionsCheckMixin:
     def has_permission(self, permission):
         return self.has_permissions((permission,))
@@ -411,22 +557,40 @@ class AnonymousUser(AnonymousUserMixin, PermissionsCheckMixin):
         return False
 
 
+@listens_for(User, "after_update")
+def user_principal_changed(mapper, connection, target):
+    if _has_changes(target, ("api_key", "disabled_at", "group_ids", "org_id")):
+        api_key_principals.invalidate_on_commit(target)
+
+
+@listens_for(User, "after_delete")
+def user_deleted(mapper, connection, target):
+    api_key_principals.invalidate_on_commit(target)
+
+
 class ApiUser(UserMixin, PermissionsCheckMixin):
     def __init__(self, api_key, org, groups, name=None):
-        self.object = None
+        self._api_key = None
         if isinstance(api_key, str):
             self.id = api_key
             self.name = name
         else:
             self.id = api_key.api_key
             self.name = "ApiKey: {}".format(api_key.id)
-            self.object = api_key.object
+            self._api_key = api_key
         self.group_ids = groups
         self.org = org
 
     def __repr__(self):
         return "<{}>".format(self.name)
 
+    @property
+    def object(self):
+        # Loaded on first use, as only the dashboards shared by the key need it
+        if self._api_key is None:
+            return None
+        return self._api_key.object
+
     @staticmethod
     def is_api_user():
         return True
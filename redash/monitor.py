@@ -1,3 +1,5 @@
+import datetime
+
 from funcy import flatten
 from rq import Queue, Worker
 from rq.job import Job
@@ -35,8 +37,24 @@ def get_object_counts():
     return status
 
 
+def oldest_job_age(queue):
+    """
+    Returns how many seconds the job at the head of a queue has been waiting, or None for an empty queue.
+    """
+    job_ids = queue.get_job_ids(0, 1)
+    jobs = Job.fetch_many(job_ids, connection=rq_redis_connection) if job_ids else []
+    if not jobs or jobs[0] is None or not isinstance(jobs[0].enqueued_at, datetime.datetime):
+        return None
+
+    # RQ stores naive UTC timestamps
+    return max((datetime.datetime.utcnow() - jobs[0].enqueued_at).total_seconds(), 0.0)
+
+
 def get_queues_status():
-    return {queue.name: {"size": len(queue)} for queue in Queue.all(connection=rq_redis_connection)}
+    return {
+        queue.name: {"size": len(queue), "oldest_job_age": oldest_job_age(queue)}
+        for queue in Queue.all(connection=rq_redis_connection)
+    }
 
 
 def get_db_sizes():
@@ -61,6 +79,10 @@ def get_status():
     status.update(get_object_counts())
     status["manager"] = redis_connection.hgetall("redash:status")
     status["manager"]["queues"] = get_queues_status()
+    if settings.DEMAND_SCHEDULING_ENABLED:
+        from redash.tasks.queries.demand import savings
+
+        status["manager"].update(savings())
     status["database_metrics"] = {}
     status["database_metrics"]["metrics"] = get_db_sizes()
 
@@ -92,11 +114,14 @@ def fetch_jobs(job_ids):
 
 
 def rq_queues():
+    from redash.tasks.queries.fair_share import pending_counts
+
     return {
         q.name: {
             "name": q.name,
             "started": fetch_jobs(StartedJobRegistry(queue=q).get_job_ids()),
             "queued": len(q.job_ids),
+            "fair_share_pending": pending_counts(q.name),
         }
         for q in sorted(Queue.all(), key=lambda q: q.name)
     }
@@ -37,6 +37,23 @@ def has_access_to_groups(obj, user, need_view_only):
     if "admin" in user.permissions:
         return True
 
+    return _has_access_to_groups(groups, user, need_view_only)
+
+
+def accessible_ids(groups_by_id, user, need_view_only):
+    """
+    Like `has_access_to_groups`, for several objects given by `{object_id: groups}`. Returns the ids of the objects the
+    user has access to.
+    """
+    if "admin" in user.permissions:
+        return set(groups_by_id)
+
+    return {
+        object_id for object_id, groups in groups_by_id.items() if _has_access_to_groups(groups, user, need_view_only)
+    }
+
+
+def _has_access_to_groups(groups, user, need_view_only):
     matching_groups = set(groups.keys()).intersection(user.group_ids)
 
     if not matching_groups:
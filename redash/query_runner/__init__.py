@@ -1,6 +1,11 @@
 import logging
+import math
+import os
+import threading
+import time
 from collections import defaultdict
-from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack, nullcontext
 from functools import wraps
 
 import requests
@@ -117,6 +122,10 @@ class BaseQueryRunner:
     limit_query = " LIMIT 1000"
     limit_keywords = ["LIMIT", "OFFSET"]
     limit_after_select = False
+    # Set by the query executor to collect per-phase timings, see `timed_phase`.
+    phase_timer = None
+    # Whether `run_query` may be called from several threads at once (not when it goes through an SSH tunnel).
+    concurrent_queries = True
     queryRunnerResultsCounter = Counter(
         "query_runner_results",
         "Query Runner results counter",
@@ -195,6 +204,13 @@ class BaseQueryRunner:
     def configuration_schema(cls):
         return {}
 
+    def timed_phase(self, name):
+        """Times a phase of `run_query` (e.g. "connect", "execute" or "fetch") when running inside a query job."""
+        if self.phase_timer is None:
+            return nullcontext()
+
+        return self.phase_timer.phase(name)
+
     def annotate_query(self, query, metadata):
         if not self.should_annotate_query:
             return query
@@ -233,6 +249,33 @@ class BaseQueryRunner:
     def get_schema(self, get_stats=False):
         raise NotSupported()
 
+    def get_table_fingerprints(self):
+        """
+        Returns `{table_name: fingerprint}` for the tables `get_schema` returns, where the fingerprint of a table
+        changes whenever its definition does. Runners implementing it (along with `get_tables_schema`) have their
+        schema refreshed incrementally.
+        """
+        raise NotSupported()
+
+    def get_tables_schema(self, table_names, get_stats=False):
+        """
+        Returns the schema of the given tables only, in the format of `get_schema`.
+        """
+        raise NotSupported()
+
+    def get_table_row_estimates(self):
+        """
+        Returns `{table_name: rows}` estimated from the catalog (without scanning the tables), for the tables the
+        database keeps estimates of.
+        """
+        raise NotSupported()
+
+    def count_table_rows(self, table_names):
+        """
+        Returns `{table_name: rows}` of the given tables, leaving out the ones that couldn't be counted in time.
+        """
+        raise NotSupported()
+
     def _handle_run_query_error(self, error):
         if error is None:
             return
@@ -268,6 +311,20 @@ class BaseQueryRunner:
         return utils.gen_query_hash(query_text)
 
 
+# Python threads can't be stopped, so a count that hangs past its deadline keeps its thread (and connection) until the
+# database answers. Capping the counts running in a process at once keeps those from piling up across refreshes.
+_count_slots = threading.BoundedSemaphore(settings.SCHEMA_TABLE_STATS_MAX_THREADS)
+
+
+def _reset_count_slots():
+    # A forked child doesn't inherit the parent's threads, so neither should it inherit the slots they hold
+    global _count_slots
+    _count_slots = threading.BoundedSemaphore(settings.SCHEMA_TABLE_STATS_MAX_THREADS)
+
+
+os.register_at_fork(after_in_child=_reset_count_slots)
+
+
 class BaseSQLQueryRunner(BaseQueryRunner):
     def get_schema(self, get_stats=False):
         schema_dict = {}
@@ -280,10 +337,65 @@ class BaseSQLQueryRunner(BaseQueryRunner):
         return []
 
     def _get_tables_stats(self, tables_dict):
-        for t in tables_dict.keys():
-            if isinstance(tables_dict[t], dict):
-                res = self._run_query_internal("select count(*) as cnt from %s" % t)
-                tables_dict[t]["size"] = res[0]["cnt"]
+        table_names = [t for t in tables_dict.keys() if isinstance(tables_dict[t], dict)]
+
+        try:
+            rows = self.get_table_row_estimates()
+        except NotSupported:
+            rows = {}
+
+        rows = {t: rows[t] for t in table_names if t in rows}
+        rows.update(self.count_table_rows([t for t in table_names if t not in rows]))
+
+        for t, count in rows.items():
+            tables_dict[t]["size"] = count
+
+    def _count_rows_query(self, table_name):
+        """
+        Returns the query counting the rows of a table, which should give up after `SCHEMA_TABLE_STATS_TIMEOUT`
+        seconds where the database supports it.
+        """
+        return "select count(*) as cnt from %s" % table_name
+
+    def _count_rows(self, table_name):
+        return self._run_query_internal(self._count_rows_query(table_name))[0]["cnt"]
+
+    def _count_rows_in_slot(self, table_name, deadline):
+        slots = _count_slots
+        if not slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise Exception("all of the process's count slots are taken by earlier counts")
+        try:
+            return self._count_rows(table_name)
+        finally:
+            slots.release()
+
+    def count_table_rows(self, table_names):
+        if not table_names:
+            return {}
+
+        workers = settings.SCHEMA_TABLE_STATS_CONCURRENCY if self.concurrent_queries else 1
+        # Counts that don't time out on the database side are abandoned once every table had its share of time
+        timeout = settings.SCHEMA_TABLE_STATS_TIMEOUT * math.ceil(len(table_names) / float(workers))
+        deadline = time.monotonic() + timeout
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {executor.submit(self._count_rows_in_slot, t, deadline): t for t in table_names}
+        done, not_done = wait(futures, timeout=timeout)
+        for future in not_done:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+        counts = {}
+        for future in done:
+            try:
+                counts[futures[future]] = future.result()
+            except Exception as e:
+                logger.info("Failed counting the rows of %s: %s", futures[future], e)
+
+        if not_done:
+            logger.info("Gave up counting the rows of %d tables", len(not_done))
+
+        return counts
 
     @property
     def supports_auto_limit(self):
@@ -517,5 +629,7 @@ def with_ssh_tunnel(query_runner, details):
         return wrapper
 
     query_runner.run_query = tunnel(query_runner.run_query)
+    # The tunnel's address is set on the runner for the duration of every query.
+    query_runner.concurrent_queries = False
 
     return query_runner
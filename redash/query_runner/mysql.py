@@ -2,6 +2,7 @@ import logging
 import os
 import threading
 
+from redash import settings
 from redash.query_runner import (
     TYPE_DATE,
     TYPE_DATETIME,
@@ -173,6 +174,41 @@ class Mysql(BaseSQLQueryRunner):
 
         return list(schema.values())
 
+    def get_table_row_estimates(self):
+        query = """
+        SELECT tbl.table_schema as table_schema,
+               tbl.table_name as table_name,
+               tbl.table_rows as table_rows
+        FROM `information_schema`.`tables` tbl
+        WHERE tbl.table_type = 'BASE TABLE'
+        AND tbl.table_schema NOT IN ('information_schema', 'performance_schema', 'mysql', 'sys');
+        """
+
+        results, error = self.run_query(query, None)
+
+        if error is not None:
+            self._handle_run_query_error(error)
+
+        estimates = {}
+        for row in results["rows"]:
+            if row["table_rows"] is None:
+                continue
+
+            if row["table_schema"] != self.configuration["db"]:
+                table_name = "{}.{}".format(row["table_schema"], row["table_name"])
+            else:
+                table_name = row["table_name"]
+
+            estimates[table_name] = int(row["table_rows"])
+
+        return estimates
+
+    def _count_rows_query(self, table_name):
+        # MariaDB ignores the hint, as it doesn't support per query time limits
+        return "SELECT /*+ MAX_EXECUTION_TIME({}) */ count(*) AS cnt FROM {}".format(
+            settings.SCHEMA_TABLE_STATS_TIMEOUT * 1000, table_name
+        )
+
     def run_query(self, query, user):
         ev = threading.Event()
         thread_id = ""
@@ -15,6 +15,7 @@ except ImportError:
 import psycopg2
 from psycopg2.extras import Range
 
+from redash import settings
 from redash.query_runner import (
     TYPE_BOOLEAN,
     TYPE_DATE,
@@ -25,6 +26,7 @@ from redash.query_runner import (
     BaseSQLQueryRunner,
     InterruptException,
     JobTimeoutException,
+    NotSupported,
     register,
 )
 
@@ -78,7 +80,7 @@ def full_table_name(schema, name):
     return "{}.{}".format(schema, name)
 
 
-def build_schema(query_result, schema):
+def table_display_name(row, table_names):
     # By default we omit the public schema name from the table name. But there are
     # edge cases, where this might cause conflicts. For example:
     # * We have a schema named "main" with table "users".
@@ -86,6 +88,13 @@ def build_schema(query_result, schema):
     # (while this feels unlikely, this actually happened)
     # In this case if we omit the schema name for the public table, we will have
     # a conflict.
+    if row["table_schema"] != "public" or row["table_name"] in table_names:
+        return full_table_name(row["table_schema"], row["table_name"])
+
+    return row["table_name"]
+
+
+def build_schema(query_result, schema):
     table_names = set(
         map(
             lambda r: full_table_name(r["table_schema"], r["table_name"]),
@@ -94,13 +103,7 @@ def build_schema(query_result, schema):
     )
 
     for row in query_result["rows"]:
-        if row["table_schema"] != "public":
-            table_name = full_table_name(row["table_schema"], row["table_name"])
-        else:
-            if row["table_name"] in table_names:
-                table_name = full_table_name(row["table_schema"], row["table_name"])
-            else:
-                table_name = row["table_name"]
+        table_name = table_display_name(row, table_names)
 
         if table_name not in schema:
             schema[table_name] = {"name": table_name, "columns": []}
@@ -114,6 +117,32 @@ def build_schema(query_result, schema):
         schema[table_name]["columns"].append(column)
 
 
+def quote_literal(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def table_relations(table_names):
+    """
+    Returns the (schema, table) pairs `build_schema` may have named `table_names`, along with the tables their names
+    could conflict with (so the tables are named the same way as when the whole schema is built).
+    """
+    relations = set()
+    for table_name in table_names:
+        relations.add(("public", table_name))
+
+        schema, _, name = table_name.partition(".")
+        if not name:
+            continue
+
+        if len(name) > 1 and name.startswith('"') and name.endswith('"'):
+            name = name[1:-1]
+            if "." in name:
+                relations.add(tuple(name.split(".", 1)))
+        relations.add((schema, name))
+
+    return relations
+
+
 def _create_cert_file(configuration, key, ssl_config):
     file_key = key + "File"
     if file_key in configuration:
@@ -142,6 +171,9 @@ def _get_ssl_config(configuration):
 
 class PostgreSQL(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    # Whether the catalog queries of `get_table_fingerprints`, `get_tables_schema` and `get_table_row_estimates`
+    # work on this database
+    catalog_queries = True
 
     @classmethod
     def configuration_schema(cls):
@@ -205,7 +237,7 @@ class PostgreSQL(BaseSQLQueryRunner):
 
         build_schema(results, schema)
 
-    def _get_tables(self, schema):
+    def _get_tables(self, schema, relations=None):
         """
         relkind constants per https://www.postgresql.org/docs/10/static/catalog-pg-class.html
         r = regular table
@@ -220,6 +252,15 @@ class PostgreSQL(BaseSQLQueryRunner):
         c = composite type
         """
 
+        relation_filter = column_filter = ""
+        if relations is not None:
+            if not relations:
+                return []
+
+            values = ", ".join("({}, {})".format(quote_literal(s), quote_literal(t)) for s, t in sorted(relations))
+            relation_filter = "AND (s.nspname::text, c.relname::text) IN (VALUES {})".format(values)
+            column_filter = "AND (table_schema::text, table_name::text) IN (VALUES {})".format(values)
+
         query = """
         SELECT s.nspname as table_schema,
                c.relname as table_name,
@@ -236,6 +277,7 @@ class PostgreSQL(BaseSQLQueryRunner):
         AND a.attnum > 0
         AND NOT a.attisdropped
         WHERE c.relkind IN ('m', 'f', 'p') AND has_table_privilege(s.nspname || '.' || c.relname, 'select')
+        {relation_filter}
 
         UNION
 
@@ -253,12 +295,101 @@ class PostgreSQL(BaseSQLQueryRunner):
         ON pgd.objoid=st.relid
         AND pgd.objsubid=isc.ordinal_position
         WHERE table_schema NOT IN ('pg_catalog', 'information_schema')
-        """
+        {column_filter}
+        """.format(
+            relation_filter=relation_filter, column_filter=column_filter
+        )
 
         self._get_definitions(schema, query)
 
         return list(schema.values())
 
+    def get_table_fingerprints(self):
+        """
+        Postgres doesn't keep track of when a table's definition changed, so the fingerprint is a hash of the
+        catalog entries the schema is built of, computed by the server.
+        """
+        if not self.catalog_queries:
+            raise NotSupported()
+
+        query = """
+        SELECT s.nspname as table_schema,
+               c.relname as table_name,
+               md5(string_agg(
+                   a.attname || ':' || format_type(a.atttypid, a.atttypmod) || ':' || coalesce(d.description, ''),
+                   ',' ORDER BY a.attnum
+               )) as fingerprint
+        FROM pg_class c
+        JOIN pg_namespace s
+        ON c.relnamespace = s.oid
+        AND s.nspname NOT IN ('pg_catalog', 'information_schema')
+        JOIN pg_attribute a
+        ON a.attrelid = c.oid
+        AND a.attnum > 0
+        AND NOT a.attisdropped
+        LEFT JOIN pg_catalog.pg_description d
+        ON d.objoid = c.oid
+        AND d.objsubid = a.attnum
+        WHERE (c.relkind IN ('r', 'v', 'f', 'p') AND has_any_column_privilege(c.oid, 'SELECT, INSERT, UPDATE, REFERENCES'))
+        OR (c.relkind = 'm' AND has_table_privilege(c.oid, 'SELECT'))
+        GROUP BY s.nspname, c.relname
+        """
+
+        results, error = self.run_query(query, None)
+        if error is not None:
+            self._handle_run_query_error(error)
+
+        table_names = set(full_table_name(r["table_schema"], r["table_name"]) for r in results["rows"])
+        return {table_display_name(row, table_names): row["fingerprint"] for row in results["rows"]}
+
+    def get_table_row_estimates(self):
+        if not self.catalog_queries:
+            raise NotSupported()
+
+        query = """
+        SELECT s.nspname as table_schema,
+               c.relname as table_name,
+               c.relkind as kind,
+               c.reltuples as estimate
+        FROM pg_class c
+        JOIN pg_namespace s
+        ON c.relnamespace = s.oid
+        AND s.nspname NOT IN ('pg_catalog', 'information_schema')
+        WHERE c.relkind IN ('r', 'v', 'm', 'f', 'p')
+        """
+
+        results, error = self.run_query(query, None)
+        if error is not None:
+            self._handle_run_query_error(error)
+
+        # Views, foreign and partitioned tables have no estimates, and tables that were never vacuumed or analyzed
+        # have a negative one.
+        table_names = set(full_table_name(r["table_schema"], r["table_name"]) for r in results["rows"])
+        return {
+            table_display_name(row, table_names): int(row["estimate"])
+            for row in results["rows"]
+            if row["kind"] in ("r", "m") and row["estimate"] is not None and row["estimate"] >= 0
+        }
+
+    def _count_rows_query(self, table_name):
+        return "SET statement_timeout = {}; select count(*) as cnt from {}".format(
+            settings.SCHEMA_TABLE_STATS_TIMEOUT * 1000, table_name
+        )
+
+    def get_tables_schema(self, table_names, get_stats=False):
+        if not self.catalog_queries:
+            raise NotSupported()
+
+        schema = {}
+        self._get_tables(schema, table_relations(table_names))
+
+        table_names = set(table_names)
+        schema = {name: table for name, table in schema.items() if name in table_names}
+        if settings.SCHEMA_RUN_TABLE_SIZE_CALCULATIONS and get_stats:
+            self._get_tables_stats(schema)
+
+        return list(schema.values())
+
     def _get_connection(self):
         self.ssl_config = _get_ssl_config(self.configuration)
         connection = psycopg2.connect(
@@ -274,18 +405,21 @@ class PostgreSQL(BaseSQLQueryRunner):
         return connection
 
     def run_query(self, query, user):
-        connection = self._get_connection()
-        _wait(connection, timeout=10)
+        with self.timed_phase("connect"):
+            connection = self._get_connection()
+            _wait(connection, timeout=10)
 
         cursor = connection.cursor()
 
         try:
-            cursor.execute(query)
-            _wait(connection)
+            with self.timed_phase("execute"):
+                cursor.execute(query)
+                _wait(connection)
 
             if cursor.description is not None:
-                columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
-                rows = [dict(zip((column["name"] for column in columns), row)) for row in cursor]
+                with self.timed_phase("fetch"):
+                    columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
+                    rows = [dict(zip((column["name"] for column in columns), row)) for row in cursor]
 
                 data = {"columns": columns, "rows": rows}
                 error = None
@@ -309,6 +443,8 @@ class PostgreSQL(BaseSQLQueryRunner):
 
 
 class Redshift(PostgreSQL):
+    catalog_queries = False
+
     @classmethod
     def type(cls):
         return "redshift"
@@ -536,6 +672,8 @@ class RedshiftIAM(Redshift):
 
 
 class CockroachDB(PostgreSQL):
+    catalog_queries = False
+
     @classmethod
     def type(cls):
         return "cockroach"
@@ -4,11 +4,21 @@ import hashlib
 import logging
 import re
 import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import parse_qs
 
-from redash import models
+from flask import current_app
+
+from redash import models, settings
 from redash.permissions import has_access, view_only
 from redash.query_runner import (
+    TYPE_BOOLEAN,
+    TYPE_DATE,
+    TYPE_DATETIME,
+    TYPE_FLOAT,
+    TYPE_INTEGER,
     TYPE_STRING,
     BaseQueryRunner,
     JobTimeoutException,
@@ -19,6 +29,15 @@ from redash.utils import json_dumps
 
 logger = logging.getLogger(__name__)
 
+SQLITE_TYPES = {
+    TYPE_INTEGER: "INTEGER",
+    TYPE_BOOLEAN: "INTEGER",
+    TYPE_FLOAT: "REAL",
+    TYPE_STRING: "TEXT",
+    TYPE_DATETIME: "TEXT",
+    TYPE_DATE: "TEXT",
+}
+
 
 class PermissionError(Exception):
     pass
@@ -63,41 +82,326 @@ def replace_query_parameters(query_text, params):
     return query_text
 
 
-def get_query_results(user, query_id, bring_from_cache, params=None):
+def _run_upstream_query(query_id, query_runner, query_text, user):
+    results, error = query_runner.run_query(query_text, user)
+    if error:
+        raise Exception("Failed loading results for query id {}.".format(query_id))
+
+    return results
+
+
+def _user_ref(user):
+    """
+    Identifies `user` by plain values, so another thread can load it into its own session (see `_load_user`).
+    """
+    if user is None:
+        return None
+    if user.is_api_user():
+        return ("api_key", user.id, user.org_id, list(user.group_ids), user.name)
+    return ("user", user.id)
+
+
+def _load_user(user_ref):
+    if user_ref is None:
+        return None
+    if user_ref[0] == "api_key":
+        _, api_key, org_id, group_ids, name = user_ref
+        return models.ApiUser(api_key, models.db.session.get(models.Organization, org_id), group_ids, name=name)
+    return models.db.session.get(models.User, user_ref[1])
+
+
+def _run_upstream_query_in_thread(app, query_id, query_runner, query_text, user_ref):
+    # Query runners may use the database (e.g. the Python one), so every thread gets its own app context, and with
+    # it its own session, rather than sharing the caller's.
+    with app.app_context():
+        return _run_upstream_query(query_id, query_runner, query_text, _load_user(user_ref))
+
+
+def _prepare_upstream_query(user, query_id, params=None):
     query = _load_query(user, query_id)
+    query_text = query.query_text
+    if params is not None:
+        query_text = replace_query_parameters(query_text, params)
+
+    return query.data_source.query_runner, query_text
+
+
+def get_query_results(user, query_id, bring_from_cache, params=None):
     if bring_from_cache:
+        query = _load_query(user, query_id)
         if query.latest_query_data_id is not None:
             results = query.latest_query_data.data
         else:
             raise Exception("No cached result available for query {}.".format(query.id))
     else:
-        query_text = query.query_text
-        if params is not None:
-            query_text = replace_query_parameters(query_text, params)
-
-        results, error = query.data_source.query_runner.run_query(query_text, user)
-        if error:
-            raise Exception("Failed loading results for query id {}.".format(query.id))
+        query_runner, query_text = _prepare_upstream_query(user, query_id, params)
+        results = _run_upstream_query(query_id, query_runner, query_text, user)
 
     return results
 
 
-def create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids=[]):
-    for query_id in set(cached_query_ids):
-        results = get_query_results(user, query_id, True)
-        table_name = "cached_query_{query_id}".format(query_id=query_id)
-        create_table(connection, table_name, results)
+def referenced_columns(query):
+    """
+    Returns a function telling whether a column of a loaded table may be used by `query`, or None when every column
+    may be used (`SELECT *`). It's deliberately conservative: a column is kept if its name appears anywhere in the query.
+    """
+    if "*" in re.sub(r"count\s*\(\s*\*\s*\)", "", query, flags=re.IGNORECASE):
+        return None
+
+    # Natural joins use columns the query doesn't mention
+    if re.search(r"\bnatural\b", query, re.IGNORECASE):
+        return None
+
+    query = query.lower()
+
+    def is_referenced(name):
+        names = {name.lower(), fix_column_name(name.lower()).strip('"')}
+        return any(re.search(r"(?<!\w){}(?!\w)".format(re.escape(n)), query) for n in names)
+
+    return is_referenced
+
+
+COMPARISON_OPERATORS = {
+    "=": lambda a, b: a == b,
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<>": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+SIMPLE_FILTER_RE = re.compile(
+    r"""^\s*"?(?P<column>[^\s"=<>!]+)"?\s*(?P<op>==|=|!=|<>|<=|>=|<|>)\s*"""
+    r"""(?:'(?P<string>[^']*)'|(?P<number>-?\d+(?:\.\d+)?))\s*$"""
+)
+
+
+def pushdown_filters(query):
+    """
+    Extracts the conditions of a single table query's WHERE clause when it's a plain conjunction of column/literal
+    comparisons (e.g. `SELECT a FROM query_1 WHERE b = 'x' AND c > 10`). Returns a list of `(column, op, value)`.
+
+    The filters only skip rows the outer query would drop anyway: the outer query keeps its WHERE clause, so a row is
+    skipped only when its value is of the same kind as the literal (or NULL).
+    """
+    normalized = " ".join(query.split())
+    tables = extract_query_ids(normalized) + extract_cached_query_ids(normalized) + extract_query_params(normalized)
+    if len(tables) != 1 or len(re.findall(r"\bselect\b", normalized, re.IGNORECASE)) != 1:
+        return []
+
+    if re.search(r"\b(union|intersect|except|join)\b", normalized, re.IGNORECASE):
+        return []
+
+    match = re.search(
+        r"\bwhere\b(.*?)(?:\bgroup\s+by\b|\border\s+by\b|\blimit\b|\bhaving\b|\bwindow\b|;|$)",
+        normalized,
+        re.IGNORECASE,
+    )
+    if match is None or re.search(r"[()]|\bor\b|\bnot\b|\bbetween\b", match.group(1), re.IGNORECASE):
+        return []
+
+    filters = []
+    for condition in re.split(r"\band\b", match.group(1), flags=re.IGNORECASE):
+        condition_match = SIMPLE_FILTER_RE.match(condition)
+        if condition_match is None:
+            return []
+
+        if condition_match.group("string") is not None:
+            value = condition_match.group("string")
+        else:
+            value = float(condition_match.group("number"))
+        filters.append((condition_match.group("column"), condition_match.group("op"), value))
+
+    return filters
+
+
+def _passes_filters(row, filters):
+    for column, op, value in filters:
+        row_value = row.get(column)
+        if row_value is None:
+            return False
+
+        if isinstance(value, str) and isinstance(row_value, str):
+            if not COMPARISON_OPERATORS[op](row_value, value):
+                return False
+        elif isinstance(value, float) and isinstance(row_value, (int, float)) and not isinstance(row_value, bool):
+            if not COMPARISON_OPERATORS[op](row_value, value):
+                return False
+
+    return True
 
-    for query in set(query_params):
-        results = get_query_results(user, query[0], False, query[1])
-        table_hash = hashlib.md5("query_{query}_{hash}".format(query=query[0], hash=query[1]).encode()).hexdigest()
-        table_name = "query_{query_id}_{param_hash}".format(query_id=query[0], param_hash=table_hash)
-        create_table(connection, table_name, results)
+
+def _open_cache():
+    cache = sqlite3.connect(settings.QUERY_RESULTS_RUNNER_CACHE_PATH, timeout=60)
+    # Only takes effect when the file is created, so the file shrinks when evicted tables are dropped:
+    cache.execute("PRAGMA auto_vacuum = FULL")
+    cache.execute(
+        "CREATE TABLE IF NOT EXISTS cache_entries "
+        "(table_name TEXT PRIMARY KEY, query_result_id INTEGER, last_used_at REAL)"
+    )
+    # Tables used by running queries, of any process, which aren't evicted until the queries are done (or the lease
+    # expires, in case its process died):
+    cache.execute("CREATE TABLE IF NOT EXISTS cache_leases (lease TEXT, table_name TEXT, expires_at REAL)")
+    return cache
+
+
+def release_cache_lease(lease):
+    """Lets the cached tables leased under `lease` be evicted again."""
+    cache = _open_cache()
+    try:
+        with cache:
+            cache.execute("DELETE FROM cache_leases WHERE lease = ?", (lease,))
+    except sqlite3.OperationalError:
+        logger.warning("Failed releasing lease %s of the query results cache, it will expire", lease, exc_info=True)
+    finally:
+        cache.close()
+
+
+def _evict_cached_tables(cache):
+    """
+    Drops the least recently used tables beyond `QUERY_RESULTS_RUNNER_CACHE_MAX_TABLES`, except those leased by a
+    running query. Eviction is best effort: when the cache is busy it's left for the next run.
+    """
+    try:
+        cache.execute("BEGIN IMMEDIATE")
+        cache.execute("DELETE FROM cache_leases WHERE expires_at < ?", (time.time(),))
+        entries = cache.execute(
+            "SELECT table_name FROM cache_entries ORDER BY last_used_at DESC LIMIT -1 OFFSET ?",
+            (settings.QUERY_RESULTS_RUNNER_CACHE_MAX_TABLES,),
+        ).fetchall()
+        leased = {table_name for (table_name,) in cache.execute("SELECT table_name FROM cache_leases")}
+
+        for (table_name,) in entries:
+            if table_name in leased:
+                continue
+
+            logger.debug("Evicting %s from the query results cache", table_name)
+            cache.execute("DROP TABLE IF EXISTS {}".format(table_name))
+            cache.execute("DELETE FROM cache_entries WHERE table_name = ?", (table_name,))
+        cache.commit()
+    except sqlite3.OperationalError:
+        cache.rollback()
+        logger.warning("Failed evicting tables from the query results cache", exc_info=True)
+
+
+def create_cached_tables(user, connection, cached_query_ids, lease):
+    """
+    Copies the `cached_query_N` tables into `connection` from the on-disk cache, loading only those whose query has a
+    newer result than the cached table. The cache holds the tables of every user, so it's only attached while the
+    tables `user` may access are copied, and detached before `connection` runs any query. The tables are leased under
+    `lease`, so they aren't evicted before they're copied.
+    """
+    cache = _open_cache()
+    table_names = []
+
+    try:
+        for query_id in set(cached_query_ids):
+            query = _load_query(user, query_id)
+            if query.latest_query_data_id is None:
+                raise Exception("No cached result available for query {}.".format(query.id))
+
+            table_name = "cached_query_{query_id}".format(query_id=query_id)
+            table_names.append(table_name)
+
+            # Take the write lock before checking, so concurrent runs don't load the same table twice, and the table
+            # can't be evicted between the check and the lease.
+            cache.execute("BEGIN IMMEDIATE")
+            entry = cache.execute(
+                "SELECT query_result_id FROM cache_entries WHERE table_name = ?", (table_name,)
+            ).fetchone()
+
+            if entry is None or entry[0] != query.latest_query_data_id:
+                logger.debug("Loading %s (result %s) into the cache", table_name, query.latest_query_data_id)
+                cache.execute("DROP TABLE IF EXISTS {}".format(table_name))
+                create_table(cache, table_name, query.latest_query_data.data)
+
+            cache.execute(
+                "INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?)",
+                (table_name, query.latest_query_data_id, time.time()),
+            )
+            cache.execute(
+                "INSERT INTO cache_leases VALUES (?, ?, ?)",
+                (lease, table_name, time.time() + settings.QUERY_RESULTS_RUNNER_CACHE_LEASE_TTL),
+            )
+            cache.commit()
+    except Exception:
+        cache.rollback()
+        cache.close()
+        raise
+
+    try:
+        _evict_cached_tables(cache)
+    finally:
+        cache.close()
+
+    connection.execute(
+        "ATTACH DATABASE ? AS cache", ("file:{}?mode=ro".format(settings.QUERY_RESULTS_RUNNER_CACHE_PATH),)
+    )
+    try:
+        for table_name in table_names:
+            connection.execute("CREATE TABLE main.{0} AS SELECT * FROM cache.{0}".format(table_name))
+        connection.commit()
+    finally:
+        connection.execute("DETACH DATABASE cache")
+
+
+def create_tables_from_query_ids(
+    user, connection, query_ids, query_params, cached_query_ids=[], query=None, lease=None
+):
+    """
+    Loads the results of the queries referenced by `query` into `connection`. Upstream queries are executed
+    concurrently, and when `query` is given only the columns (and rows) it may use are loaded. Tables of the results
+    cache are leased under `lease` until `release_cache_lease` is called, or until the lease TTL when no lease is
+    given.
+    """
+    is_referenced = referenced_columns(query) if query else None
+    filters = pushdown_filters(query) if query else []
+
+    if settings.QUERY_RESULTS_RUNNER_CACHE_PATH and cached_query_ids:
+        # Cached tables are shared between queries, so they're loaded as is.
+        create_cached_tables(user, connection, cached_query_ids, lease or uuid.uuid4().hex)
+    else:
+        for query_id in set(cached_query_ids):
+            results = get_query_results(user, query_id, True)
+            table_name = "cached_query_{query_id}".format(query_id=query_id)
+            create_table(connection, table_name, results, is_referenced, filters)
+
+    upstream = {}
+    for query_id, params in set(query_params):
+        table_hash = hashlib.md5("query_{query}_{hash}".format(query=query_id, hash=params).encode()).hexdigest()
+        table_name = "query_{query_id}_{param_hash}".format(query_id=query_id, param_hash=table_hash)
+        upstream[table_name] = (query_id,) + _prepare_upstream_query(user, query_id, params)
 
     for query_id in set(query_ids):
-        results = get_query_results(user, query_id, False)
         table_name = "query_{query_id}".format(query_id=query_id)
-        create_table(connection, table_name, results)
+        upstream[table_name] = (query_id,) + _prepare_upstream_query(user, query_id)
+
+    # Nested Query Results queries are loaded on this thread, so their own upstream queries don't nest thread pools.
+    for table_name, (query_id, query_runner, query_text) in list(upstream.items()):
+        if isinstance(query_runner, Results):
+            results = _run_upstream_query(query_id, query_runner, query_text, user)
+            create_table(connection, table_name, results, is_referenced, filters)
+            del upstream[table_name]
+
+    if not upstream:
+        return
+
+    app = current_app._get_current_object()
+    user_ref = _user_ref(user)
+    executor = ThreadPoolExecutor(max_workers=settings.QUERY_RESULTS_RUNNER_MAX_WORKERS)
+    futures = {
+        executor.submit(_run_upstream_query_in_thread, app, query_id, query_runner, query_text, user_ref): table_name
+        for table_name, (query_id, query_runner, query_text) in upstream.items()
+    }
+    try:
+        # Load every result as soon as it arrives, so results don't pile up in memory.
+        for future in as_completed(futures):
+            create_table(connection, futures[future], future.result(), is_referenced, filters)
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
 
 
 def fix_column_name(name):
@@ -115,14 +419,24 @@ def flatten(value):
         return value
 
 
-def create_table(connection, table_name, query_results):
+def create_table(connection, table_name, query_results, is_referenced=None, filters=None):
     try:
-        columns = [column["name"] for column in query_results["columns"]]
+        result_columns = query_results["columns"]
+        if is_referenced is not None:
+            result_columns = [column for column in result_columns if is_referenced(column["name"])] or result_columns[
+                :1
+            ]
+
+        columns = [column["name"] for column in result_columns]
         safe_columns = [fix_column_name(column) for column in columns]
 
         column_list = ", ".join(safe_columns)
-        create_table = "CREATE TABLE {table_name} ({column_list})".format(
-            table_name=table_name, column_list=column_list
+        column_definitions = ", ".join(
+            "{} {}".format(safe_column, SQLITE_TYPES.get(column.get("type"), "")).strip()
+            for safe_column, column in zip(safe_columns, result_columns)
+        )
+        create_table = "CREATE TABLE {table_name} ({column_definitions})".format(
+            table_name=table_name, column_definitions=column_definitions
         )
         logger.debug("CREATE TABLE query: %s", create_table)
         connection.execute(create_table)
@@ -135,9 +449,21 @@ def create_table(connection, table_name, query_results):
         place_holders=",".join(["?"] * len(columns)),
     )
 
-    for row in query_results["rows"]:
-        values = [flatten(row.get(column)) for column in columns]
-        connection.execute(insert_template, values)
+    # Filters on columns of another table, or whose literal SQLite would convert to the column's affinity, are left
+    # for the outer query only.
+    affinities = {column["name"]: SQLITE_TYPES.get(column.get("type")) for column in query_results["columns"]}
+    filters = [
+        (column, op, value)
+        for column, op, value in filters or []
+        if column in affinities
+        and (affinities[column] is None or (affinities[column] == "TEXT") == isinstance(value, str))
+    ]
+
+    rows = query_results["rows"]
+    if filters:
+        rows = (row for row in rows if _passes_filters(row, filters))
+
+    connection.executemany(insert_template, ([flatten(row.get(column)) for column in columns] for row in rows))
 
 
 def prepare_parameterized_query(query, query_params):
@@ -149,6 +475,12 @@ def prepare_parameterized_query(query, query_params):
     return query
 
 
+def _deny_attach(action, *args):
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
 class Results(BaseQueryRunner):
     should_annotate_query = False
     noop_query = "SELECT 1"
@@ -162,21 +494,26 @@ class Results(BaseQueryRunner):
         return "Query Results"
 
     def run_query(self, query, user):
-        connection = sqlite3.connect(":memory:")
+        # Opened with URI filenames enabled, so the results cache can be attached read-only while copying from it
+        connection = sqlite3.connect("file::memory:", uri=True)
 
         query_ids = extract_query_ids(query)
 
         query_params = extract_query_params(query)
 
         cached_query_ids = extract_cached_query_ids(query)
-        create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids)
+        lease = uuid.uuid4().hex
 
-        cursor = connection.cursor()
+        try:
+            create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids, query, lease)
 
-        if query_params is not None:
-            query = prepare_parameterized_query(query, query_params)
+            cursor = connection.cursor()
+            # The query may only read the tables loaded for it, not attach other databases (like the results cache)
+            connection.set_authorizer(_deny_attach)
+
+            if query_params is not None:
+                query = prepare_parameterized_query(query, query_params)
 
-        try:
             cursor.execute(query)
 
             if cursor.description is not None:
@@ -206,6 +543,8 @@ class Results(BaseQueryRunner):
             raise
         finally:
             connection.close()
+            if settings.QUERY_RESULTS_RUNNER_CACHE_PATH and cached_query_ids:
+                release_cache_lease(lease)
         return data, error
 
 
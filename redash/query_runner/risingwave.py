@@ -3,6 +3,8 @@ from redash.query_runner.pg import PostgreSQL
 
 
 class RisingWave(PostgreSQL):
+    catalog_queries = False
+
     @classmethod
     def type(cls):
         return "risingwave"
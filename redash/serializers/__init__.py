@@ -13,7 +13,7 @@ from sqlalchemy.sql.expression import select
 
 from redash import models
 from redash.models.parameterized_query import ParameterizedQuery
-from redash.permissions import has_access, view_only
+from redash.permissions import accessible_ids, has_access, view_only
 from redash.serializers.query_result import (
     serialize_query_result,
     serialize_query_result_to_dsv,
@@ -116,7 +116,7 @@ def serialize_query(
         "options": query.options,
         "version": query.version,
         "tags": query.tags or [],
-        "is_safe": query.parameterized.is_safe,
+        "is_safe": query.is_safe,
     }
 
     if with_user:
@@ -199,16 +199,38 @@ def serialize_alert(alert, full=True):
     return d
 
 
+def _query_access(widgets, user):
+    """
+    Returns a function telling whether the user may view the query of a widget, with the permissions checked once per
+    data source rather than once per widget.
+    """
+    if user is None:
+        return lambda query: False
+
+    if user.is_api_user():
+        return lambda query: has_access(query, user, view_only)
+
+    data_source_ids = {w.visualization.query.data_source_id for w in widgets if w.visualization is not None}
+    groups = models.DataSource.groups_of(data_source_ids - {None})
+    # Queries detached from their data source are only visible to admins (see `Query.groups`)
+    groups[None] = {}
+    accessible = accessible_ids(groups, user, view_only)
+
+    return lambda query: query.data_source_id in accessible
+
+
 def serialize_dashboard(obj, with_widgets=False, user=None, with_favorite_state=True):
     layout = obj.layout
 
     widgets = []
 
     if with_widgets:
-        for w in obj.widgets:
+        widget_list = models.Widget.dashboard_widgets(obj)
+        can_view = _query_access(widget_list, user)
+        for w in widget_list:
             if w.visualization_id is None:
                 widgets.append(serialize_widget(w))
-            elif user and has_access(w.visualization.query, user, view_only):
+            elif can_view(w.visualization.query):
                 widgets.append(serialize_widget(w))
             else:
                 widget = project(
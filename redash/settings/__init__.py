@@ -9,6 +9,7 @@ from redash.settings.helpers import (
     add_decode_responses_to_redis_url,
     array_from_string,
     cast_int_or_default,
+    dict_from_string,
     fix_assets_path,
     int_or_none,
     parse_boolean,
@@ -51,9 +52,31 @@ QUERY_RESULTS_EXPIRED_TTL_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_R
 # default set query results expired ttl 86400 seconds
 QUERY_RESULTS_EXPIRED_TTL = int(os.environ.get("REDASH_QUERY_RESULTS_EXPIRED_TTL", "86400"))
 
+# How long a streamed request for the results of a dashboard waits for its queries to run before leaving the rest of
+# the jobs for the client to poll.
+DASHBOARD_RESULTS_STREAM_TIMEOUT = int(os.environ.get("REDASH_DASHBOARD_RESULTS_STREAM_TIMEOUT", "30"))
+# Each waiting stream holds a web worker (a whole process with sync workers), so only this many wait at once.
+DASHBOARD_RESULTS_MAX_STREAMS = int(os.environ.get("REDASH_DASHBOARD_RESULTS_MAX_STREAMS", "4"))
+
+# Number of recent runs per query hash used to compute runtime percentiles (see QueryRuntimeStats).
+QUERY_RUNTIME_STATS_HISTORY = int(os.environ.get("REDASH_QUERY_RUNTIME_STATS_HISTORY", "50"))
+
+# On-disk SQLite cache of the `cached_query_N` tables of the Query Results data source, keyed by the id of the
+# query's latest result. Disabled when empty.
+QUERY_RESULTS_RUNNER_CACHE_PATH = os.environ.get("REDASH_QUERY_RESULTS_RUNNER_CACHE_PATH", "")
+QUERY_RESULTS_RUNNER_CACHE_MAX_TABLES = int(os.environ.get("REDASH_QUERY_RESULTS_RUNNER_CACHE_MAX_TABLES", "50"))
+# Seconds a table stays protected from eviction when the query using it never released it (e.g. its worker died).
+QUERY_RESULTS_RUNNER_CACHE_LEASE_TTL = int(os.environ.get("REDASH_QUERY_RESULTS_RUNNER_CACHE_LEASE_TTL", "3600"))
+# Number of upstream queries of a Query Results query that are executed concurrently.
+QUERY_RESULTS_RUNNER_MAX_WORKERS = int(os.environ.get("REDASH_QUERY_RESULTS_RUNNER_MAX_WORKERS", "4"))
+
 SCHEMAS_REFRESH_SCHEDULE = int(os.environ.get("REDASH_SCHEMAS_REFRESH_SCHEDULE", 30))
 
 AUTH_TYPE = os.environ.get("REDASH_AUTH_TYPE", "api_key")
+# Seconds each process keeps what API keys resolve to (0 looks them up on every request), for up to
+# API_KEY_CACHE_SIZE keys.
+API_KEY_CACHE_TTL = int(os.environ.get("REDASH_API_KEY_CACHE_TTL", "30"))
+API_KEY_CACHE_SIZE = int(os.environ.get("REDASH_API_KEY_CACHE_SIZE", "1000"))
 INVITATION_TOKEN_MAX_AGE = int(os.environ.get("REDASH_INVITATION_TOKEN_MAX_AGE", 60 * 60 * 24 * 7))
 
 # The secret key to use in the Flask app for various cryptographic features
@@ -208,6 +231,66 @@ ADHOC_QUERY_TIME_LIMIT = int(os.environ.get("REDASH_ADHOC_QUERY_TIME_LIMIT", -1)
 JOB_EXPIRY_TIME = int(os.environ.get("REDASH_JOB_EXPIRY_TIME", 3600 * 12))
 JOB_DEFAULT_FAILURE_TTL = int(os.environ.get("REDASH_JOB_DEFAULT_FAILURE_TTL", 7 * 24 * 60 * 60))
 
+# Fair-share dispatching of query jobs. When enabled, jobs are held in per-user sub-queues and moved into the RQ queue
+# in deficit round robin order across orgs, then across the users of each org, so a single org (or user) can't starve
+# everybody else.
+FAIR_SHARE_ENABLED = parse_boolean(os.environ.get("REDASH_FAIR_SHARE_ENABLED", "false"))
+FAIR_SHARE_QUEUES = set_from_string(os.environ.get("REDASH_FAIR_SHARE_QUEUES", "queries,scheduled_queries"))
+# How many jobs are allowed to wait in the RQ queue itself. Everything beyond that waits in the sub-queues.
+FAIR_SHARE_MAX_QUEUED_JOBS = int(os.environ.get("REDASH_FAIR_SHARE_MAX_QUEUED_JOBS", "10"))
+FAIR_SHARE_QUANTUM = float(os.environ.get("REDASH_FAIR_SHARE_QUANTUM", "1"))
+# Relative weights in the "id:weight,id:weight" format (e.g. "1:2,5:0.5"). Default weight is 1. Org weights split the
+# workers among orgs, group weights split an org's share among its users.
+FAIR_SHARE_ORG_WEIGHTS = dict_from_string(os.environ.get("REDASH_FAIR_SHARE_ORG_WEIGHTS", ""))
+FAIR_SHARE_GROUP_WEIGHTS = dict_from_string(os.environ.get("REDASH_FAIR_SHARE_GROUP_WEIGHTS", ""))
+
+# Runtime-aware routing. When enabled, query hashes whose p95 runtime exceeds the threshold are routed to a slow lane
+# of their queue ("<queue>_slow"), so short queries don't wait behind long ones. Workers started without explicit
+# queues process the fast lanes before the slow ones; run dedicated workers (`rq worker queries_slow`) to set aside
+# capacity for each lane.
+QUERY_LANES_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_LANES_ENABLED", "false"))
+QUERY_LANES_QUEUES = set_from_string(os.environ.get("REDASH_QUERY_LANES_QUEUES", "queries,scheduled_queries"))
+QUERY_LANES_SLOW_THRESHOLD = float(os.environ.get("REDASH_QUERY_LANES_SLOW_THRESHOLD", "60"))
+# Lane for query hashes with fewer than QUERY_LANES_MIN_RUNS recorded runs ("fast" or "slow").
+QUERY_LANES_DEFAULT_LANE = os.environ.get("REDASH_QUERY_LANES_DEFAULT_LANE", "fast")
+QUERY_LANES_MIN_RUNS = int(os.environ.get("REDASH_QUERY_LANES_MIN_RUNS", "3"))
+# Number of fast lane runs exceeding the threshold after which a query hash is moved to the slow lane.
+QUERY_LANES_MAX_OVERRUNS = int(os.environ.get("REDASH_QUERY_LANES_MAX_OVERRUNS", "2"))
+
+# Load smoothing of scheduled queries. Queries scheduled at a specific time ("daily at 00:00") are delayed by a
+# deterministic per-query jitter of up to SCHEDULE_JITTER_WINDOW seconds, and no more than SCHEDULE_MAX_ENQUEUE_RATE
+# scheduled queries are enqueued per minute (0 for no limit), most overdue first.
+SCHEDULE_JITTER_WINDOW = int(os.environ.get("REDASH_SCHEDULE_JITTER_WINDOW", "0"))
+SCHEDULE_MAX_ENQUEUE_RATE = int(os.environ.get("REDASH_SCHEDULE_MAX_ENQUEUE_RATE", "0"))
+# When enabled, interval based schedules ("every hour") run in the slots assigned by `manage queries schedule_load
+# --smooth --apply` instead of an interval after their previous run.
+SCHEDULE_SMOOTHING_ENABLED = parse_boolean(os.environ.get("REDASH_SCHEDULE_SMOOTHING_ENABLED", "false"))
+
+# Dependency-aware refresh. When enabled, a scheduled Query Results query that is due while queries it reads are being
+# refreshed is held back, and enqueued once their results land (or after the timeout, in seconds).
+SCHEDULED_QUERY_DEPENDENCIES_ENABLED = parse_boolean(
+    os.environ.get("REDASH_SCHEDULED_QUERY_DEPENDENCIES_ENABLED", "false")
+)
+SCHEDULED_QUERY_DEPENDENCIES_TIMEOUT = int(os.environ.get("REDASH_SCHEDULED_QUERY_DEPENDENCIES_TIMEOUT", "3600"))
+
+# Demand-driven scheduling. When enabled, scheduled queries whose results weren't viewed or fetched through the API
+# for DEMAND_SCHEDULING_IDLE_DAYS run DEMAND_SCHEDULING_SLOWDOWN times less often, and ones idle for
+# DEMAND_SCHEDULING_SUSPEND_DAYS (0 to never suspend) don't run until they're accessed again. Queries with alerts
+# always run. Run `manage queries backfill_accesses` when enabling it, so past views are taken into account.
+DEMAND_SCHEDULING_ENABLED = parse_boolean(os.environ.get("REDASH_DEMAND_SCHEDULING_ENABLED", "false"))
+DEMAND_SCHEDULING_IDLE_DAYS = int(os.environ.get("REDASH_DEMAND_SCHEDULING_IDLE_DAYS", "30"))
+DEMAND_SCHEDULING_SLOWDOWN = float(os.environ.get("REDASH_DEMAND_SCHEDULING_SLOWDOWN", "4"))
+DEMAND_SCHEDULING_SUSPEND_DAYS = int(os.environ.get("REDASH_DEMAND_SCHEDULING_SUSPEND_DAYS", "90"))
+
+# Backpressure for scheduled queries: a query whose previous scheduled job is still pending isn't enqueued again, and
+# data sources whose scheduled queue holds more than SCHEDULED_QUEUE_MAX_DEPTH jobs, or whose oldest job waited more
+# than SCHEDULED_QUEUE_MAX_AGE seconds, are deferred until the backlog drains.
+SCHEDULED_QUEUE_BACKPRESSURE_ENABLED = parse_boolean(
+    os.environ.get("REDASH_SCHEDULED_QUEUE_BACKPRESSURE_ENABLED", "false")
+)
+SCHEDULED_QUEUE_MAX_DEPTH = int(os.environ.get("REDASH_SCHEDULED_QUEUE_MAX_DEPTH", "500"))
+SCHEDULED_QUEUE_MAX_AGE = int(os.environ.get("REDASH_SCHEDULED_QUEUE_MAX_AGE", "900"))
+
 LOG_LEVEL = os.environ.get("REDASH_LOG_LEVEL", "INFO")
 LOG_STDOUT = parse_boolean(os.environ.get("REDASH_LOG_STDOUT", "false"))
 LOG_PREFIX = os.environ.get("REDASH_LOG_PREFIX", "")
@@ -377,6 +460,22 @@ additional_destinations = array_from_string(os.environ.get("REDASH_ADDITIONAL_DE
 DESTINATIONS = distinct(enabled_destinations + additional_destinations)
 
 EVENT_REPORTING_WEBHOOKS = array_from_string(os.environ.get("REDASH_EVENT_REPORTING_WEBHOOKS", ""))
+# Events are buffered in Redis and inserted EVENTS_FLUSH_SIZE at a time, at least every EVENTS_FLUSH_INTERVAL seconds.
+EVENTS_FLUSH_SIZE = int(os.environ.get("REDASH_EVENTS_FLUSH_SIZE", "500"))
+EVENTS_FLUSH_INTERVAL = int(os.environ.get("REDASH_EVENTS_FLUSH_INTERVAL", "10"))
+# Number of events posted to the webhooks per request. With more than 1, requests carry a list of events.
+EVENT_REPORTING_WEBHOOKS_BATCH_SIZE = int(os.environ.get("REDASH_EVENT_REPORTING_WEBHOOKS_BATCH_SIZE", "1"))
+EVENT_REPORTING_WEBHOOKS_CONCURRENCY = int(os.environ.get("REDASH_EVENT_REPORTING_WEBHOOKS_CONCURRENCY", "4"))
+EVENT_REPORTING_WEBHOOKS_TIMEOUT = int(os.environ.get("REDASH_EVENT_REPORTING_WEBHOOKS_TIMEOUT", "10"))
+# The events table is partitioned by month, with partitions created EVENTS_PARTITIONS_AHEAD months in advance. The
+# partitions of events older than EVENTS_RETENTION_DAYS days are dropped (0 keeps every event), and the ones in the
+# default partition are deleted EVENTS_DELETE_BATCH_SIZE at a time. With EVENTS_ROLLUP_ENABLED, daily counts of
+# events by organization, action and object type are kept in events_daily_counts, so usage history survives the
+# retention period.
+EVENTS_PARTITIONS_AHEAD = int(os.environ.get("REDASH_EVENTS_PARTITIONS_AHEAD", "3"))
+EVENTS_RETENTION_DAYS = int(os.environ.get("REDASH_EVENTS_RETENTION_DAYS", "0"))
+EVENTS_DELETE_BATCH_SIZE = int(os.environ.get("REDASH_EVENTS_DELETE_BATCH_SIZE", "10000"))
+EVENTS_ROLLUP_ENABLED = parse_boolean(os.environ.get("REDASH_EVENTS_ROLLUP_ENABLED", "false"))
 
 # Support for Sentry (https://getsentry.com/). Just set your Sentry DSN to enable it:
 SENTRY_DSN = os.environ.get("REDASH_SENTRY_DSN", "")
@@ -409,6 +508,13 @@ PAGE_SIZE_OPTIONS = list(
     )
 )
 TABLE_CELL_MAX_JSON_SIZE = int(os.environ.get("REDASH_TABLE_CELL_MAX_JSON_SIZE", 50000))
+# Seconds the total counts of cursor paginated lists are reused for (0 counts every page).
+PAGINATION_COUNT_CACHE_TTL = int(os.environ.get("REDASH_PAGINATION_COUNT_CACHE_TTL", "60"))
+# Recent queries are the ones edited the most in the last RECENT_QUERIES_DAYS days, counting up to RECENT_QUERIES_SIZE
+# of them a day by organization and by user. Run `manage queries backfill_recent_queries` to fill them from the events
+# table.
+RECENT_QUERIES_DAYS = int(os.environ.get("REDASH_RECENT_QUERIES_DAYS", "7"))
+RECENT_QUERIES_SIZE = int(os.environ.get("REDASH_RECENT_QUERIES_SIZE", "100"))
 
 # Features:
 FEATURE_DISABLE_REFRESH_QUERIES = parse_boolean(os.environ.get("REDASH_FEATURE_DISABLE_REFRESH_QUERIES", "false"))
@@ -431,6 +537,22 @@ ALLOW_PARAMETERS_IN_EMBEDS = parse_boolean(os.environ.get("REDASH_ALLOW_PARAMETE
 SCHEMA_RUN_TABLE_SIZE_CALCULATIONS = parse_boolean(
     os.environ.get("REDASH_SCHEMA_RUN_TABLE_SIZE_CALCULATIONS", "false")
 )
+# Table sizes are estimated from the catalog where the database keeps estimates, and counted (with
+# SCHEMA_TABLE_STATS_CONCURRENCY queries at a time, each given SCHEMA_TABLE_STATS_TIMEOUT seconds) otherwise. Counts
+# are kept for SCHEMA_TABLE_STATS_TTL seconds and at most SCHEMA_TABLE_STATS_MAX_COUNTS tables are counted per refresh.
+# Counts the database doesn't time out on its side may outlive their refresh, so a process runs at most
+# SCHEMA_TABLE_STATS_MAX_THREADS of them at once.
+SCHEMA_TABLE_STATS_TTL = int(os.environ.get("REDASH_SCHEMA_TABLE_STATS_TTL", 24 * 60 * 60))
+SCHEMA_TABLE_STATS_CONCURRENCY = int(os.environ.get("REDASH_SCHEMA_TABLE_STATS_CONCURRENCY", "4"))
+SCHEMA_TABLE_STATS_TIMEOUT = int(os.environ.get("REDASH_SCHEMA_TABLE_STATS_TIMEOUT", "30"))
+SCHEMA_TABLE_STATS_MAX_COUNTS = int(os.environ.get("REDASH_SCHEMA_TABLE_STATS_MAX_COUNTS", "100"))
+SCHEMA_TABLE_STATS_MAX_THREADS = int(os.environ.get("REDASH_SCHEMA_TABLE_STATS_MAX_THREADS", "16"))
+# Refresh schemas incrementally, fetching only the tables whose definition changed, for data sources that support it
+SCHEMA_INCREMENTAL_REFRESH_ENABLED = parse_boolean(
+    os.environ.get("REDASH_SCHEMA_INCREMENTAL_REFRESH_ENABLED", "false")
+)
+# How many schema changes are kept for clients fetching changes since the version they have
+SCHEMA_CHANGE_LOG_SIZE = int(os.environ.get("REDASH_SCHEMA_CHANGE_LOG_SIZE", "50"))
 
 # kylin
 KYLIN_OFFSET = int(os.environ.get("REDASH_KYLIN_OFFSET", 0))
@@ -11,6 +11,24 @@ def query_time_limit(is_scheduled, user_id, org_id):
         return settings.ADHOC_QUERY_TIME_LIMIT
 
 
+# Replace these methods with your own implementation in case you want to give certain orgs a bigger (or smaller)
+# share of the query workers, or certain groups a bigger (or smaller) share of their org's, when fair-share
+# dispatching is enabled.
+def fair_share_org_weight(org_id):
+    from redash import settings
+
+    return settings.FAIR_SHARE_ORG_WEIGHTS.get(org_id, 1.0)
+
+
+def fair_share_user_weight(org_id, group_ids):
+    from redash import settings
+
+    group_weights = [
+        settings.FAIR_SHARE_GROUP_WEIGHTS[g] for g in group_ids or [] if g in settings.FAIR_SHARE_GROUP_WEIGHTS
+    ]
+    return max(group_weights) if group_weights else 1.0
+
+
 def periodic_jobs():
     """Schedule any custom periodic jobs here. For example:
 
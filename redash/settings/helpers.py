@@ -30,6 +30,12 @@ def parse_boolean(s):
         raise ValueError("Invalid boolean value %r" % s)
 
 
+def dict_from_string(s, key_type=int, value_type=float):
+    """Parses a "key:value,key:value" string into a dictionary."""
+    pairs = [item.split(":", 1) for item in array_from_string(s)]
+    return {key_type(key.strip()): value_type(value.strip()) for key, value in pairs}
+
+
 def cast_int_or_default(val, default=None):
     try:
         return int(val)
@@ -2,14 +2,12 @@ from rq.connections import pop_connection, push_connection
 
 from redash import rq_redis_connection
 from redash.tasks.alerts import check_alerts_for_query
+from redash.tasks.events import flush_events, record_event
 from redash.tasks.failure_report import send_aggregated_errors
-from redash.tasks.general import (
-    record_event,
-    send_mail,
-    sync_user_details,
-)
+from redash.tasks.general import send_mail, sync_user_details
 from redash.tasks.queries import (
     cleanup_query_results,
+    dispatch_fair_share_queues,
     empty_schedules,
     enqueue_query,
     execute_query,
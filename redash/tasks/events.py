@@ -0,0 +1,240 @@
+"""
+Buffered event ingestion.
+
+Events used to be recorded by a job each, which inserted a single row and posted it to every
+`EVENT_REPORTING_WEBHOOKS` URL before the next event could be recorded. They are now appended to a Redis list, and
+`flush_events` takes them off in batches of `EVENTS_FLUSH_SIZE`: each batch is inserted at once and then delivered to
+the webhooks concurrently, over pooled connections. A flush is enqueued every `EVENTS_FLUSH_SIZE` events, and runs
+every `EVENTS_FLUSH_INTERVAL` seconds for the rest.
+
+A flush moves its batch to a processing list and gives the events their ids before inserting them, and empties the
+list once the batch is committed. A flush that dies midway leaves the batch for the next one, which skips the events
+already inserted. Webhooks get the events after the flush lock is released, at most once.
+
+The events table is partitioned by month. `maintain_events` creates the partitions ahead of time, keeps the daily
+counts of `EventDailyCount` when `EVENTS_ROLLUP_ENABLED`, and drops the partitions past `EVENTS_RETENTION_DAYS`. The
+default partition is dropped and replaced once all its events are past retention, and until then they are deleted
+from it `EVENTS_DELETE_BATCH_SIZE` at a time.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import requests
+from prometheus_client import Counter
+from requests.adapters import HTTPAdapter
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from redash import models, redis_connection, settings
+from redash.tasks.queries import demand
+from redash.utils import json_dumps, json_loads, utcnow
+from redash.worker import get_job_logger, job
+
+logger = get_job_logger(__name__)
+
+BUFFER_KEY = "events:buffer"
+PROCESSING_KEY = "events:processing"
+FLUSH_LOCK_KEY = "events:flush"
+
+EVENT_SCHEMA = "iglu:io.redash.webhooks/event/jsonschema/1-0-0"
+EVENTS_SCHEMA = "iglu:io.redash.webhooks/events/jsonschema/1-0-0"
+
+eventsFlushedCounter = Counter("events_flushed", "Events inserted from the events buffer")
+eventWebhookFailuresCounter = Counter("event_webhook_failures", "Failed deliveries of events to webhooks")
+
+_webhooks_session = None
+
+
+def record_event(raw_event):
+    length = redis_connection.rpush(BUFFER_KEY, json_dumps(raw_event))
+    if length % settings.EVENTS_FLUSH_SIZE == 0:
+        flush_events.delay()
+
+
+def webhooks_session():
+    global _webhooks_session
+
+    if _webhooks_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max(len(settings.EVENT_REPORTING_WEBHOOKS), 1),
+            pool_maxsize=settings.EVENT_REPORTING_WEBHOOKS_CONCURRENCY,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _webhooks_session = session
+
+    return _webhooks_session
+
+
+def post_events(hook, events):
+    if len(events) == 1:
+        data = {"schema": EVENT_SCHEMA, "data": events[0]}
+    else:
+        data = {"schema": EVENTS_SCHEMA, "data": events}
+
+    logger.debug("Forwarding %d events to: %s", len(events), hook)
+    try:
+        response = webhooks_session().post(hook, json=data, timeout=settings.EVENT_REPORTING_WEBHOOKS_TIMEOUT)
+        if response.status_code != 200:
+            eventWebhookFailuresCounter.inc()
+            logger.error("Failed posting to %s: %s", hook, response.content)
+    except Exception:
+        eventWebhookFailuresCounter.inc()
+        logger.exception("Failed posting to %s", hook)
+
+
+def deliver_events(events):
+    """
+    Posts `events` to every webhook, `EVENT_REPORTING_WEBHOOKS_BATCH_SIZE` events per request (a single event is
+    posted as before).
+    """
+    hooks = settings.EVENT_REPORTING_WEBHOOKS
+    if not hooks or not events:
+        return
+
+    payloads = [event.to_dict() for event in events]
+    size = settings.EVENT_REPORTING_WEBHOOKS_BATCH_SIZE
+    batches = [payloads[i : i + size] for i in range(0, len(payloads), size)]
+
+    executor = ThreadPoolExecutor(max_workers=settings.EVENT_REPORTING_WEBHOOKS_CONCURRENCY)
+    try:
+        wait([executor.submit(post_events, hook, batch) for hook in hooks for batch in batches])
+    finally:
+        executor.shutdown(wait=False)
+
+
+def _add_events(raw_events):
+    events = []
+    for raw_event in raw_events:
+        try:
+            events.append(models.Event.record(dict(raw_event)))
+        except (KeyError, TypeError, ValueError):
+            logger.exception("Dropping malformed event: %s", raw_event)
+    return events
+
+
+def insert_events(raw_events):
+    """
+    Inserts `raw_events` in one statement, or one by one when that fails, so a single bad event doesn't hold back the
+    rest of the buffer.
+    """
+    events = _add_events(raw_events)
+    try:
+        models.db.session.commit()
+        return events
+    except SQLAlchemyError:
+        models.db.session.rollback()
+        logger.exception("Failed inserting %d events at once, inserting them one by one.", len(raw_events))
+
+    inserted = []
+    for raw_event in raw_events:
+        events = _add_events([raw_event])
+        try:
+            models.db.session.commit()
+            inserted.extend(events)
+        except SQLAlchemyError:
+            models.db.session.rollback()
+            logger.exception("Dropping event that can't be inserted: %s", raw_event)
+
+    return inserted
+
+
+def _take_batch():
+    """
+    Returns the raw events of the batch to flush, with their ids, and whether a flush that died left the batch over
+    (so some of its events may be inserted already).
+    """
+    raw_events = [json_loads(raw_event) for raw_event in redis_connection.lrange(PROCESSING_KEY, 0, -1)]
+    if raw_events and "id" in raw_events[0]:
+        return raw_events, True
+
+    if not raw_events:
+        pipe = redis_connection.pipeline()
+        for _ in range(settings.EVENTS_FLUSH_SIZE):
+            pipe.lmove(BUFFER_KEY, PROCESSING_KEY)
+        raw_events = [json_loads(raw_event) for raw_event in pipe.execute() if raw_event is not None]
+        if not raw_events:
+            return [], False
+
+    for raw_event, event_id in zip(raw_events, models.Event.allocate_ids(len(raw_events))):
+        raw_event["id"] = event_id
+
+    pipe = redis_connection.pipeline()
+    pipe.delete(PROCESSING_KEY)
+    pipe.rpush(PROCESSING_KEY, *[json_dumps(raw_event) for raw_event in raw_events])
+    pipe.execute()
+    return raw_events, False
+
+
+@job("default", timeout=300)
+def flush_events():
+    """
+    Inserts the buffered events, `EVENTS_FLUSH_SIZE` at a time, and returns how many were inserted.
+    """
+    lock = redis_connection.lock(FLUSH_LOCK_KEY, timeout=300)
+    if not lock.acquire(blocking=False):
+        # Another flush is emptying the buffer
+        return 0
+
+    inserted = []
+    try:
+        while True:
+            raw_events, left_over = _take_batch()
+            if not raw_events:
+                break
+
+            if left_over:
+                ids = [raw_event["id"] for raw_event in raw_events]
+                existing = set(models.db.session.scalars(select(models.Event.id).where(models.Event.id.in_(ids))))
+                raw_events = [raw_event for raw_event in raw_events if raw_event["id"] not in existing]
+
+            events = insert_events(raw_events)
+            redis_connection.delete(PROCESSING_KEY)
+            inserted.extend(events)
+            eventsFlushedCounter.inc(len(events))
+
+            demand.track_accesses(events)
+            models.recent_queries.record_events(events)
+    finally:
+        lock.release()
+
+    deliver_events(inserted)
+    return len(inserted)
+
+
+@job("default", timeout=3600)
+def maintain_events():
+    now = utcnow()
+    try:
+        skipped = models.Event.create_partitions(models.db.session.connection(), now, settings.EVENTS_PARTITIONS_AHEAD)
+        models.db.session.commit()
+        if skipped:
+            logger.info(
+                "Skipped creating %s, as the default partition holds events of their months.", ", ".join(skipped)
+            )
+    except SQLAlchemyError:
+        models.db.session.rollback()
+        logger.exception("Failed creating the partitions of the events table.")
+
+    if settings.EVENTS_ROLLUP_ENABLED:
+        days = models.EventDailyCount.rollup(now.replace(hour=0, minute=0, second=0, microsecond=0))
+        logger.info("Counted the events of %d days.", days)
+
+    if settings.EVENTS_RETENTION_DAYS:
+        before = now - timedelta(days=settings.EVENTS_RETENTION_DAYS)
+        dropped = models.Event.drop_partitions(models.db.session.connection(), before)
+        models.db.session.commit()
+        logger.info("Dropped the events created before %s (partitions: %s).", before, ", ".join(dropped) or "none")
+
+        # committed a batch at a time, so the locks and the WAL of deleting them stay bounded
+        deleted = 0
+        while True:
+            count = models.Event.delete_expired(
+                models.db.session.connection(), before, settings.EVENTS_DELETE_BATCH_SIZE
+            )
+            models.db.session.commit()
+            deleted += count
+            if count < settings.EVENTS_DELETE_BATCH_SIZE:
+                break
+        logger.info("Deleted %d events created before %s from the default partition.", deleted, before)
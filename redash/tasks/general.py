@@ -1,9 +1,9 @@
-import requests
 from flask_mail import Message
 
-from redash import mail, models, settings
+from redash import mail, models
 from redash.models import users
 from redash.query_runner import NotSupported
+from redash.tasks import events
 from redash.tasks.worker import Queue
 from redash.worker import get_job_logger, job
 
@@ -12,21 +12,8 @@ logger = get_job_logger(__name__)
 
 @job("default")
 def record_event(raw_event):
-    event = models.Event.record(raw_event)
-    models.db.session.commit()
-
-    for hook in settings.EVENT_REPORTING_WEBHOOKS:
-        logger.debug("Forwarding event to: %s", hook)
-        try:
-            data = {
-                "schema": "iglu:io.redash.webhooks/event/jsonschema/1-0-0",
-                "data": event.to_dict(),
-            }
-            response = requests.post(hook, json=data)
-            if response.status_code != 200:
-                logger.error("Failed posting to %s: %s", hook, response.content)
-        except Exception:
-            logger.exception("Failed posting to %s", hook)
+    # Left for the jobs enqueued before events were buffered
+    events.record_event(raw_event)
 
 
 @job("emails")
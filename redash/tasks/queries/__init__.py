@@ -1,4 +1,5 @@
 from redash.tasks.queries.execution import enqueue_query, execute_query
+from redash.tasks.queries.fair_share import dispatch_fair_share_queues
 from redash.tasks.queries.maintenance import (
     cleanup_query_results,
     empty_schedules,
@@ -0,0 +1,162 @@
+"""
+Queue-depth backpressure for scheduled queries.
+
+After an outage (of the workers or of a data source) every scheduled query is due at once, and `refresh_queries` kept
+adding jobs to queues that were already far behind. By the time the queues drained, most of those jobs refreshed
+results that were about to be refreshed again. With backpressure enabled the scheduler looks at the queues first:
+
+* A query that still has a scheduled job waiting or running isn't enqueued again: its refreshes are coalesced into the
+  pending job, even when its text changed in between (e.g. an incremental refresh with a newer watermark).
+* A data source is deferred when its scheduled queue (including its slow lane) holds more than
+  `SCHEDULED_QUEUE_MAX_DEPTH` jobs or its oldest job waited more than `SCHEDULED_QUEUE_MAX_AGE` seconds, and the data
+  source has jobs of its own waiting in it. Data sources that share the queue but have nothing waiting still get
+  their queries in, so one slow data source doesn't hold back the others. A data source with more than
+  `SCHEDULED_QUEUE_MAX_DEPTH` jobs waiting is deferred regardless of the queue.
+
+Deferred queries stay due and are enqueued by the first run after the backlog drained. The scheduled jobs of every data
+source are tracked in `sq:pending:<data source id>` (query id -> job id), so checking a data source costs one lookup
+per job it has pending, which backpressure itself keeps bounded.
+"""
+from prometheus_client import Counter, Gauge
+from rq.job import JobStatus
+
+from redash import redis_connection, rq_redis_connection, settings
+from redash.monitor import oldest_job_age
+from redash.tasks.queries import lanes
+from redash.tasks.worker import Job, Queue
+from redash.worker import get_job_logger
+
+logger = get_job_logger(__name__)
+
+COALESCED = "coalesced"
+DEFERRED = "deferred"
+
+PENDING_STATUSES = (JobStatus.QUEUED, JobStatus.DEFERRED, JobStatus.SCHEDULED, JobStatus.STARTED)
+
+scheduledQueueSizeGauge = Gauge(
+    "scheduled_queue_size",
+    "Jobs waiting in the scheduled queries queues, as seen by the scheduler",
+    ["queue"],
+)
+scheduledQueueOldestJobAgeGauge = Gauge(
+    "scheduled_queue_oldest_job_age",
+    "Seconds the oldest job of the scheduled queries queues has been waiting, as seen by the scheduler",
+    ["queue"],
+)
+scheduledQueriesBackpressureCounter = Counter(
+    "scheduled_queries_backpressure",
+    "Due scheduled queries that weren't enqueued because of queue backpressure",
+    ["reason"],
+)
+
+
+def _pending_key(data_source_id):
+    return "sq:pending:{}".format(data_source_id)
+
+
+def is_enabled():
+    return settings.SCHEDULED_QUEUE_BACKPRESSURE_ENABLED
+
+
+def queue_names(data_source):
+    queue_name = data_source.scheduled_queue_name
+    if lanes.is_enabled(queue_name):
+        return [queue_name, lanes.lane_queue_name(queue_name, lanes.SLOW)]
+
+    return [queue_name]
+
+
+def queue_backlog(queue_name):
+    """
+    Returns the size of a queue and the age (in seconds) of its oldest job, and exports both.
+    """
+    queue = Queue(queue_name, connection=rq_redis_connection)
+    size = len(queue)
+    age = oldest_job_age(queue) if size else None
+
+    scheduledQueueSizeGauge.labels(queue_name).set(size)
+    scheduledQueueOldestJobAgeGauge.labels(queue_name).set(age or 0)
+
+    return size, age
+
+
+def is_congested(size, age):
+    return size > settings.SCHEDULED_QUEUE_MAX_DEPTH or (age or 0) > settings.SCHEDULED_QUEUE_MAX_AGE
+
+
+def pending_jobs(data_source_id):
+    """
+    Returns `{query_id: job}` of the scheduled jobs of a data source that are still waiting or running, and forgets
+    the rest.
+    """
+    key = _pending_key(data_source_id)
+    pending = redis_connection.hgetall(key)
+    if not pending:
+        return {}
+
+    query_ids = list(pending)
+    jobs = Job.fetch_many([pending[query_id] for query_id in query_ids], connection=rq_redis_connection)
+
+    live = {}
+    done = []
+    for query_id, job in zip(query_ids, jobs):
+        if job is not None and job.get_status(refresh=False) in PENDING_STATUSES:
+            live[int(query_id)] = job
+        else:
+            done.append(query_id)
+
+    if done:
+        redis_connection.hdel(key, *done)
+
+    return live
+
+
+def track(query, job, pending):
+    key = _pending_key(query.data_source_id)
+    pipe = redis_connection.pipeline()
+    pipe.hset(key, query.id, job.id)
+    pipe.expire(key, settings.JOB_EXPIRY_TIME)
+    pipe.execute()
+
+    pending.setdefault(query.data_source_id, {})[query.id] = job
+
+
+def check(query, backlogs, pending):
+    """
+    Returns why a due query shouldn't be enqueued right now (`COALESCED` or `DEFERRED`), or None.
+
+    `backlogs` (queue name -> size and oldest job age) and `pending` (data source id -> pending jobs) cache what was
+    read from Redis during the current `refresh_queries` run.
+    """
+    data_source = query.data_source
+    if data_source.id not in pending:
+        pending[data_source.id] = pending_jobs(data_source.id)
+
+    jobs = pending[data_source.id]
+    if query.id in jobs:
+        return COALESCED
+
+    waiting = sum(1 for job in jobs.values() if job.get_status(refresh=False) != JobStatus.STARTED)
+    if not waiting:
+        return None
+
+    if waiting > settings.SCHEDULED_QUEUE_MAX_DEPTH:
+        return DEFERRED
+
+    for queue_name in queue_names(data_source):
+        if queue_name not in backlogs:
+            backlogs[queue_name] = queue_backlog(queue_name)
+        if is_congested(*backlogs[queue_name]):
+            return DEFERRED
+
+    return None
+
+
+def hold(query, reason):
+    scheduledQueriesBackpressureCounter.labels(reason).inc()
+    if reason == DEFERRED:
+        logger.debug(
+            "Deferring refresh of %s because queue of data source %s is backed up.", query.id, query.data_source_id
+        )
+    else:
+        logger.debug("Skipping refresh of %s because its previous refresh is still pending.", query.id)
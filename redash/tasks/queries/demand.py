@@ -0,0 +1,140 @@
+"""
+Access tracking for demand-driven scheduling (see `models.demand_deferral`).
+
+Every view of a query, a visualization embed or a dashboard, and every `api_get` of a query's results, counts as an
+access of the queries involved. An access of a query that was idle makes the scheduler evaluate it right away, so
+slowed down or suspended schedules resume on their next access.
+"""
+from datetime import timedelta
+
+from sqlalchemy import func
+from sqlalchemy.sql.expression import select, update
+
+from redash import models, settings, utils
+
+ACCESS_ACTIONS = ("view", "api_get")
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def accessed_queries(accesses):
+    """
+    Maps `(object_type, object_id, additional_properties, accessed_at)` accesses to `{query_id: accessed_at}`.
+    """
+    accessed = {}
+    dashboards = {}
+    results = {}
+
+    def touch(query_id, accessed_at):
+        if query_id is not None and (query_id not in accessed or accessed[query_id] < accessed_at):
+            accessed[query_id] = accessed_at
+
+    for object_type, object_id, properties, accessed_at in accesses:
+        if object_type == "query":
+            touch(_as_int(object_id), accessed_at)
+        elif object_type == "visualization":
+            touch(_as_int((properties or {}).get("query_id")), accessed_at)
+        elif object_type == "dashboard" and _as_int(object_id) is not None:
+            dashboards[int(object_id)] = max(accessed_at, dashboards.get(int(object_id), accessed_at))
+        elif object_type == "query_result" and _as_int(object_id) is not None:
+            results[int(object_id)] = max(accessed_at, results.get(int(object_id), accessed_at))
+
+    if dashboards:
+        rows = models.db.session.execute(
+            select(models.Widget.dashboard_id, models.Visualization.query_id)
+            .join(models.Visualization, models.Visualization.id == models.Widget.visualization_id)
+            .where(models.Widget.dashboard_id.in_(dashboards))
+        ).all()
+        for row in rows:
+            touch(row.query_id, dashboards[row.dashboard_id])
+
+    if results:
+        rows = models.db.session.execute(
+            select(models.Query.id, models.Query.latest_query_data_id).where(
+                models.Query.latest_query_data_id.in_(results)
+            )
+        ).all()
+        for row in rows:
+            touch(row.id, results[row.latest_query_data_id])
+
+    return accessed
+
+
+def record_accesses(accessed):
+    previous = models.query_accesses.update(accessed)
+    idle_since = utils.utcnow() - timedelta(days=settings.DEMAND_SCHEDULING_IDLE_DAYS)
+    resumed = [query_id for query_id in accessed if query_id not in previous or previous[query_id] < idle_since]
+
+    if resumed:
+        # The stored next runs of idle queries were pushed back, have the scheduler evaluate them again.
+        models.db.session.execute(
+            update(models.Query)
+            .where(
+                models.Query.id.in_(resumed),
+                func.jsonb_typeof(models.Query.schedule) != "null",
+                models.Query.next_run_at.is_(None) | (models.Query.next_run_at > utils.utcnow()),
+            )
+            .values(next_run_at=utils.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        models.db.session.commit()
+
+    return resumed
+
+
+def track_accesses(events):
+    if not settings.DEMAND_SCHEDULING_ENABLED:
+        return
+
+    now = utils.utcnow()
+    accessed = accessed_queries(
+        (event.object_type, event.object_id, event.additional_properties, now)
+        for event in events
+        if event.action in ACCESS_ACTIONS
+    )
+    if accessed:
+        record_accesses(accessed)
+
+
+def track_access(event):
+    track_accesses([event])
+
+
+def backfill_accesses(days):
+    """
+    Records the accesses of the last `days` days from the events table.
+    """
+    since = utils.utcnow() - timedelta(days=days)
+    query_id = models.Event.additional_properties["query_id"].astext
+    rows = models.db.session.execute(
+        select(
+            models.Event.object_type,
+            models.Event.object_id,
+            query_id,
+            func.max(models.Event.created_at),
+        )
+        .where(models.Event.action.in_(ACCESS_ACTIONS), models.Event.created_at >= since)
+        .group_by(models.Event.object_type, models.Event.object_id, query_id)
+    ).all()
+
+    accessed = accessed_queries(
+        (object_type, object_id, {"query_id": event_query_id}, accessed_at)
+        for object_type, object_id, event_query_id, accessed_at in rows
+    )
+    if accessed:
+        record_accesses(accessed)
+
+    return len(accessed)
+
+
+def savings():
+    skipped = models.query_accesses.skipped()
+    return {
+        "skipped_scheduled_runs": skipped["runs"],
+        "saved_worker_hours": round(skipped["seconds"] / 3600.0, 2),
+    }
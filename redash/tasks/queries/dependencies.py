@@ -0,0 +1,234 @@
+"""
+Dependency-aware refresh of scheduled queries.
+
+Queries on a Query Results data source read other queries (`query_N` / `cached_query_N`). When such a downstream query
+is due while one of its upstream queries is being refreshed (or is due in the same refresh), running it right away
+would read stale data and it would have to run again. Instead the scheduler holds it back and the executor enqueues it
+once the results of all the upstream queries it waits for have landed:
+
+* `sq:in_flight:<id>` marks a scheduled query that was enqueued and hasn't finished yet.
+* `sq:waiting:<id>` holds the upstream query ids a held back query still waits for, and `sq:waiting_on:<id>` the
+  held back queries waiting for an upstream query.
+
+A query waiting for several upstream queries runs once, after the last one finishes (whether it succeeded or not). All
+keys expire after `SCHEDULED_QUERY_DEPENDENCIES_TIMEOUT` seconds, after which a held back query is scheduled as usual.
+Cycles are detected when the dependency graph is built, and queries in a cycle don't wait for each other.
+"""
+from sqlalchemy.sql.expression import select
+
+from redash import models, redis_connection, settings
+from redash.query_runner.query_results import (
+    extract_cached_query_ids,
+    extract_query_ids,
+)
+from redash.worker import get_job_logger
+
+logger = get_job_logger(__name__)
+
+RESULTS_DATA_SOURCE_TYPE = "results"
+
+
+def _in_flight_key(query_id):
+    return "sq:in_flight:{}".format(query_id)
+
+
+def _waiting_key(query_id):
+    return "sq:waiting:{}".format(query_id)
+
+
+def _waiting_on_key(query_id):
+    return "sq:waiting_on:{}".format(query_id)
+
+
+def is_enabled():
+    return settings.SCHEDULED_QUERY_DEPENDENCIES_ENABLED
+
+
+def upstream_query_ids(query_text):
+    return set(extract_query_ids(query_text)) | set(extract_cached_query_ids(query_text))
+
+
+def cyclic_query_ids(graph):
+    """
+    Returns the ids of the queries that are part of a dependency cycle (Tarjan's strongly connected components,
+    iteratively so long chains don't hit the recursion limit).
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    cyclic = set()
+    counter = 0
+
+    for root in graph:
+        if root in index:
+            continue
+
+        work = [(root, iter(graph.get(root, ())))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+
+        while work:
+            node, children = work[-1]
+            child = next(children, None)
+
+            if child is not None:
+                if child not in index:
+                    index[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(graph.get(child, ()))))
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+
+                if len(component) > 1 or node in graph.get(node, ()):
+                    cyclic.update(component)
+
+    return cyclic
+
+
+def dependency_graph(queries):
+    """
+    Returns `{query_id: upstream query ids}` for the given queries and, transitively, for the Query Results queries
+    they read. Edges between queries of a dependency cycle are left out.
+    """
+    graph = {}
+    results_queries = [q for q in queries if q.data_source and q.data_source.type == RESULTS_DATA_SOURCE_TYPE]
+    pending = [q.id for q in results_queries]
+    texts = {q.id: q.query_text for q in results_queries}
+
+    while pending:
+        missing = [query_id for query_id in pending if query_id not in texts]
+        if missing:
+            rows = models.db.session.execute(
+                select(models.Query.id, models.Query.query_text)
+                .join(models.DataSource, models.DataSource.id == models.Query.data_source_id)
+                .where(models.Query.id.in_(missing), models.DataSource.type == RESULTS_DATA_SOURCE_TYPE)
+            ).all()
+            texts.update({row.id: row.query_text for row in rows})
+
+        next_pending = []
+        for query_id in pending:
+            if query_id in graph or query_id not in texts:
+                continue
+
+            graph[query_id] = upstream_query_ids(texts[query_id])
+            next_pending.extend(u for u in graph[query_id] if u not in graph)
+        pending = next_pending
+
+    cyclic = cyclic_query_ids(graph)
+    if cyclic:
+        logger.warning("Scheduled queries %s depend on each other and are refreshed independently", sorted(cyclic))
+
+    return {
+        query_id: {u for u in upstream_ids if not (query_id in cyclic and u in cyclic)}
+        for query_id, upstream_ids in graph.items()
+    }
+
+
+def topological_order(queries, graph):
+    """
+    Orders queries so upstream queries come before the queries reading them, otherwise keeping their order.
+    """
+    by_id = {q.id: q for q in queries}
+    ordered = []
+    visited = set()
+
+    for query in queries:
+        if query.id in visited:
+            continue
+
+        work = [(query.id, False)]
+        while work:
+            query_id, expanded = work.pop()
+            if expanded:
+                ordered.append(by_id[query_id])
+                continue
+            if query_id in visited:
+                continue
+
+            visited.add(query_id)
+            if query_id in by_id:
+                work.append((query_id, True))
+            for upstream_id in sorted(graph.get(query_id, ()), reverse=True):
+                if upstream_id in by_id and upstream_id not in visited:
+                    work.append((upstream_id, False))
+
+    return ordered
+
+
+def pending_upstreams(upstream_ids, held_back=()):
+    """
+    Returns the upstream queries (out of `upstream_ids`) that are being refreshed or are held back themselves.
+    """
+    upstream_ids = sorted(upstream_ids)
+    if not upstream_ids:
+        return []
+
+    pipe = redis_connection.pipeline()
+    for upstream_id in upstream_ids:
+        pipe.exists(_in_flight_key(upstream_id), _waiting_key(upstream_id))
+    return [u for u, exists in zip(upstream_ids, pipe.execute()) if exists or u in held_back]
+
+
+def is_waiting(query_id):
+    return bool(redis_connection.exists(_waiting_key(query_id)))
+
+
+def mark_in_flight(query_id):
+    redis_connection.set(_in_flight_key(query_id), 1, ex=settings.SCHEDULED_QUERY_DEPENDENCIES_TIMEOUT)
+
+
+def wait_for(query_id, upstream_ids):
+    timeout = settings.SCHEDULED_QUERY_DEPENDENCIES_TIMEOUT
+    pipe = redis_connection.pipeline()
+    pipe.sadd(_waiting_key(query_id), *upstream_ids)
+    pipe.expire(_waiting_key(query_id), timeout)
+    for upstream_id in upstream_ids:
+        pipe.sadd(_waiting_on_key(upstream_id), query_id)
+        pipe.expire(_waiting_on_key(upstream_id), timeout)
+    pipe.execute()
+
+    logger.info("Holding back query %s until queries %s are refreshed", query_id, sorted(upstream_ids))
+
+
+def release(query_ids):
+    """
+    Called when the results of `query_ids` landed (or their refresh failed). Returns the ids of the held back queries
+    that no longer wait for anything.
+    """
+    ready = []
+    for query_id in set(query_ids):
+        pipe = redis_connection.pipeline()
+        pipe.smembers(_waiting_on_key(query_id))
+        pipe.delete(_waiting_on_key(query_id), _in_flight_key(query_id))
+        downstream_ids, _ = pipe.execute()
+
+        for downstream_id in downstream_ids:
+            pipe = redis_connection.pipeline()
+            pipe.srem(_waiting_key(downstream_id), query_id)
+            pipe.scard(_waiting_key(downstream_id))
+            _, remaining = pipe.execute()
+
+            if remaining == 0:
+                ready.append(int(downstream_id))
+
+    return ready
@@ -1,3 +1,4 @@
+import datetime
 import signal
 import time
 
@@ -6,11 +7,15 @@ from rq import get_current_job
 from rq.exceptions import NoSuchJobError
 from rq.job import JobStatus
 from rq.timeouts import JobTimeoutException
+from sqlalchemy import func
+from sqlalchemy.sql.expression import select
 
 from redash import models, redis_connection, settings
+from redash.metrics.query_execution import PhaseTimer
 from redash.query_runner import InterruptException
 from redash.tasks.alerts import check_alerts_for_query
 from redash.tasks.failure_report import track_failure
+from redash.tasks.queries import dependencies, fair_share, incremental, lanes
 from redash.tasks.worker import Job, Queue
 from redash.utils import gen_query_hash, utcnow
 from redash.worker import get_job_logger
@@ -77,6 +82,10 @@ def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query
                     queue_name = data_source.queue_name
                     scheduled_query_id = None
 
+                lane = None
+                if lanes.is_enabled(queue_name):
+                    queue_name, lane = lanes.route(queue_name, data_source.id, query_hash)
+
                 time_limit = settings.dynamic_settings.query_time_limit(scheduled_query, user_id, data_source.org_id)
                 metadata["Queue"] = queue_name
 
@@ -93,13 +102,26 @@ def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query
                         "scheduled": scheduled_query_id is not None,
                         "query_id": metadata.get("query_id"),
                         "user_id": user_id,
+                        "lane": lane,
                     },
                 }
 
                 if not scheduled_query:
                     enqueue_kwargs["result_ttl"] = settings.JOB_EXPIRY_TIME
 
-                job = queue.enqueue(execute_query, query, data_source.id, metadata, **enqueue_kwargs)
+                if fair_share.is_enabled(queue_name):
+                    enqueue_kwargs["meta"]["fair_share"] = True
+                    job = queue.create_job(
+                        execute_query,
+                        args=(query, data_source.id, metadata),
+                        kwargs={k: enqueue_kwargs.pop(k) for k in ("user_id", "scheduled_query_id", "is_api_key")},
+                        timeout=enqueue_kwargs.pop("job_timeout"),
+                        **enqueue_kwargs,
+                    )
+                    job.save()
+                    fair_share.submit(job, data_source.org_id, user_id, is_api_key)
+                else:
+                    job = queue.enqueue(execute_query, query, data_source.id, metadata, **enqueue_kwargs)
 
                 logger.info("[%s] Created new job: %s", query_hash, job.id)
                 pipe.set(
@@ -164,6 +186,7 @@ class QueryExecutor:
         models.db.session.close()
         self.query_hash = gen_query_hash(self.query)
         self.is_scheduled_query = is_scheduled_query
+        self.timer = PhaseTimer()
         if self.is_scheduled_query:
             # Load existing tracker or create a new one if the job was created before code update:
             models.scheduled_queries_executions.update(self.query_model.id)
@@ -172,14 +195,23 @@ class QueryExecutor:
         signal.signal(signal.SIGINT, signal_handler)
         started_at = time.time()
 
+        fair_share_hold, queue_wait = self._queue_wait()
+        if fair_share_hold is not None:
+            self.timer.record("fair_share_hold", fair_share_hold)
+        if queue_wait is not None:
+            self.timer.record("queue_wait", queue_wait)
+            self._save_timings()
+
         logger.debug("Executing query:\n%s", self.query)
         self._log_progress("executing_query")
 
         query_runner = self.data_source.query_runner
+        query_runner.phase_timer = self.timer
         annotated_query = self._annotate_query(query_runner)
 
         try:
-            data, error = query_runner.run_query(annotated_query, self.user)
+            with self.timer.phase("run_query"):
+                data, error = query_runner.run_query(annotated_query, self.user)
         except Exception as e:
             if isinstance(e, JobTimeoutException):
                 error = TIMEOUT_MESSAGE
@@ -201,11 +233,19 @@ class QueryExecutor:
 
         _unlock(self.query_hash, self.data_source.id)
 
+        if self.job.meta.get("lane"):
+            lanes.record_run(self.job.meta["lane"], self.job.origin, self.data_source.id, self.query_hash, run_time)
+
         if error is not None and data is None:
             result = QueryExecutionError(error)
             if self.is_scheduled_query:
                 self.query_model = models.db.session.merge(self.query_model, load=False)
                 track_failure(self.query_model, error)
+            self._record_runtime_stats(run_time, failed=True)
+            models.db.session.commit()
+            self._save_timings(observe=True)
+            if self.query_model:
+                self._refresh_downstream_queries([self.query_model.id])
             raise result
         else:
             if self.query_model and self.query_model.schedule_failures > 0:
@@ -214,26 +254,126 @@ class QueryExecutor:
                 self.query_model.skip_updated_at = True
                 models.db.session.add(self.query_model)
 
-            query_result = models.QueryResult.store_result(
-                self.data_source.org_id,
-                self.data_source,
-                self.query_hash,
-                self.query,
-                data,
-                run_time,
-                utcnow(),
-            )
+            # The storing and alerts phases happen after the result is saved, so they're only available in the job's
+            # metadata and the metrics.
+            data.setdefault("metadata", {})["timings"] = self.timer.to_dict()
+
+            query_hash = self.query_hash
+            incremental_options = incremental.get_options(self.query_model) if self.query_model else None
+            if incremental_options:
+                data, query_hash = self._apply_incremental(data, incremental_options)
+
+            # Includes serializing the result, which happens when the session is flushed.
+            with self.timer.phase("store"):
+                query_result = models.QueryResult.store_result(
+                    self.data_source.org_id,
+                    self.data_source,
+                    query_hash,
+                    self.query,
+                    data,
+                    run_time,
+                    utcnow(),
+                )
+
+                models.db.session.commit()  # make sure that alert sees the latest query result
 
-            models.db.session.commit()  # make sure that alert sees the latest query result
             self._log_progress("checking_alerts")
-            for q in query_result.queries:
-                check_alerts_for_query.delay(q.id, self.metadata)
+            with self.timer.phase("alerts"):
+                for q in query_result.queries:
+                    check_alerts_for_query.delay(q.id, self.metadata)
             self._log_progress("finished")
+            self._record_runtime_stats(run_time, query_result=query_result)
+            self._save_timings(observe=True)
 
             result = query_result.id
             models.db.session.commit()
+            self._refresh_downstream_queries([q.id for q in query_result.queries])
             return result
 
+    def _refresh_downstream_queries(self, query_ids):
+        if not dependencies.is_enabled():
+            return
+
+        ready = dependencies.release(query_ids)
+        if ready:
+            # Imported here, as the maintenance tasks enqueue queries through this module.
+            from redash.tasks.queries.maintenance import refresh_downstream_queries
+
+            refresh_downstream_queries.delay(ready)
+
+    def _apply_incremental(self, data, options):
+        if "Watermark" not in self.metadata:
+            # A full run: only remember where the next incremental run should start.
+            data["metadata"]["watermark"] = incremental.max_watermark(
+                data.get("rows", []), options["watermark_column"]
+            )
+            return data, self.query_hash
+
+        latest_query_data_id = models.db.session.scalar(
+            select(models.Query.latest_query_data_id).where(models.Query.id == self.query_model.id)
+        )
+        previous = models.db.session.get(models.QueryResult, latest_query_data_id) if latest_query_data_id else None
+        data = incremental.merge(previous.data if previous else None, data, options)
+        logger.info(
+            "job=execute_query query_hash=%s merged %d new rows after watermark %s",
+            self.query_hash,
+            data["metadata"]["incremental_rows"],
+            self.metadata["Watermark"],
+        )
+
+        # The merged result stands for the query with its default parameters, so it's stored under that hash.
+        return data, self.query_model.query_hash
+
+    def _record_runtime_stats(self, run_time, query_result=None, failed=False):
+        row_count = result_bytes = None
+        if query_result is not None:
+            row_count = len(query_result.data.get("rows", []))
+            result_bytes = models.db.session.scalar(
+                select(func.octet_length(models.QueryResult.__table__.c.data)).where(
+                    models.QueryResult.id == query_result.id
+                )
+            )
+
+        models.QueryRuntimeStats.record_run(
+            self.data_source.org_id,
+            self.data_source.id,
+            query_result.query_hash if query_result is not None else self.query_hash,
+            run_time,
+            row_count=row_count,
+            result_bytes=result_bytes,
+            failed=failed,
+        )
+
+    def _queue_wait(self):
+        """
+        Returns the seconds the job was held by fair-share dispatching before it was enqueued (None when it wasn't
+        held), and the seconds it then waited in the queue.
+        """
+        created_at, enqueued_at, started_at = self.job.created_at, self.job.enqueued_at, self.job.started_at
+        if not isinstance(enqueued_at, datetime.datetime):
+            return None, None
+
+        fair_share_hold = None
+        if self.job.meta.get("fair_share") and isinstance(created_at, datetime.datetime):
+            fair_share_hold = (enqueued_at - created_at).total_seconds()
+
+        # RQ stores naive UTC timestamps
+        started_at = started_at if isinstance(started_at, datetime.datetime) else datetime.datetime.utcnow()
+        return fair_share_hold, (started_at - enqueued_at).total_seconds()
+
+    def _save_timings(self, observe=False):
+        self.job.meta["timings"] = self.timer.to_dict()
+        self.job.save_meta()
+
+        if observe:
+            logger.info(
+                "job=execute_query query_hash=%s ds_id=%d timings=%s",
+                self.query_hash,
+                self.data_source.id,
+                self.job.meta["timings"],
+            )
+            self.timer.observe(self.data_source.type, self.metadata.get("Queue", "unknown"))
+
     def _annotate_query(self, query_runner):
         self.metadata["Job ID"] = self.job.id
         self.metadata["Query Hash"] = self.query_hash
@@ -282,3 +422,8 @@ def execute_query(
     except QueryExecutionError as e:
         models.db.session.rollback()
         return e
+    finally:
+        # Free a slot in the queue for the next job in fair-share order:
+        job = get_current_job()
+        if job:
+            fair_share.dispatch(job.origin)
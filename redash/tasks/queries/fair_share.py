@@ -0,0 +1,407 @@
+"""
+Fair-share dispatching for the query queues.
+
+RQ queues are strictly FIFO, so a single user (or org) submitting hundreds of queries at once makes everybody else
+wait behind them. When fair-share dispatching is enabled, `enqueue_query` doesn't push jobs into the RQ queue
+directly. Instead each job is held in a sub-queue of its user within its org, and a dispatcher moves jobs into the RQ
+queue using deficit round robin (DRR) on two levels, keeping no more than `FAIR_SHARE_MAX_QUEUED_JOBS` jobs in the RQ
+queue itself: orgs take turns first, and the turn of an org goes to its users in turn. Every org (and every user
+within its org) receives `FAIR_SHARE_QUANTUM * weight` credits each round and every dispatched job costs one credit,
+so backlogged orgs get worker time in proportion to their weights, however many users they have, and split it among
+their users in proportion to the users' weights.
+
+The slow lanes of the fair-share queues (see `lanes`) are dispatched the same way.
+
+The dispatcher runs whenever a job is submitted, whenever a query job finishes and periodically as a safety net.
+"""
+from collections import defaultdict, deque
+
+from rq.exceptions import NoSuchJobError
+from rq.job import JobStatus
+from sqlalchemy.sql.expression import select
+
+from redash import models, redis_connection, settings
+from redash.tasks.queries import lanes
+from redash.tasks.worker import Job, Queue
+from redash.worker import get_job_logger
+
+logger = get_job_logger(__name__)
+
+KEY_PREFIX = "fair_share"
+JOB_COST = 1.0
+
+
+def _key(queue_name, *parts):
+    return ":".join([KEY_PREFIX, queue_name] + [str(p) for p in parts])
+
+
+def queue_names():
+    """The fair-share queues, along with their slow lanes when runtime-aware routing is enabled for them."""
+    names = []
+    for queue_name in sorted(settings.FAIR_SHARE_QUEUES):
+        names.append(queue_name)
+        if lanes.is_enabled(queue_name):
+            names.append(lanes.lane_queue_name(queue_name, lanes.SLOW))
+
+    return names
+
+
+def is_enabled(queue_name):
+    return settings.FAIR_SHARE_ENABLED and queue_name in queue_names()
+
+
+def tenant_for(org_id, user_id):
+    return "{}:{}".format(org_id, user_id)
+
+
+def org_weight(org_id):
+    return max(float(settings.dynamic_settings.fair_share_org_weight(org_id)), 0.01)
+
+
+def user_weight(org_id, user_id, is_api_key=False):
+    group_ids = None
+    if settings.FAIR_SHARE_GROUP_WEIGHTS and user_id is not None and not is_api_key:
+        group_ids = models.db.session.scalar(select(models.User.group_ids).where(models.User.id == user_id))
+
+    return max(float(settings.dynamic_settings.fair_share_user_weight(org_id, group_ids)), 0.01)
+
+
+def deficit_round_robin(order, backlogs, weights, deficits, limit, quantum=1.0):
+    """
+    Picks up to `limit` tenants to dispatch a job for, in deficit round robin order.
+
+    :param order: tenants in their current round robin order.
+    :param backlogs: number of pending jobs per tenant.
+    :param weights: weight per tenant (defaults to 1).
+    :param deficits: accumulated credit per tenant. Updated in place.
+    :return: a tuple of the tenants picked (a tenant appears once per job) and the new round robin order.
+    """
+    backlogs = dict(backlogs)
+    order = deque(t for t in order if backlogs.get(t, 0) > 0)
+    picked = []
+
+    while order and len(picked) < limit:
+        tenant = order[0]
+
+        # A tenant that still has credit left was interrupted mid-turn by `limit`, so it resumes its turn
+        # instead of receiving another quantum.
+        if deficits.get(tenant, 0) < JOB_COST:
+            deficits[tenant] = deficits.get(tenant, 0) + quantum * weights.get(tenant, 1.0)
+
+        while backlogs[tenant] > 0 and deficits[tenant] >= JOB_COST and len(picked) < limit:
+            picked.append(tenant)
+            backlogs[tenant] -= 1
+            deficits[tenant] -= JOB_COST
+
+        if backlogs[tenant] == 0:
+            order.popleft()
+            deficits.pop(tenant, None)
+        elif deficits[tenant] < JOB_COST:
+            order.rotate(-1)
+
+    return picked, list(order)
+
+
+def hierarchical_round_robin(org_order, user_orders, backlogs, weights, deficits, limit, quantum=1.0):
+    """
+    Picks up to `limit` (org, user) pairs to dispatch a job for: orgs in deficit round robin order, and the users of
+    each org in deficit round robin order within the org's turns.
+
+    :param org_order: orgs in their current round robin order.
+    :param user_orders: users of every org in their current round robin order. Updated in place.
+    :param backlogs: number of pending jobs per user, per org.
+    :param weights: a tuple of the weight per org and the weight per user, per org (both default to 1).
+    :param deficits: a tuple of the accumulated credit per org and per user, per org. Updated in place.
+    :return: a tuple of the (org, user) pairs picked and the new round robin order of the orgs.
+    """
+    org_weights, user_weights = weights
+    org_deficits, user_deficits = deficits
+    org_backlogs = {org: sum(users.values()) for org, users in backlogs.items()}
+
+    picked_orgs, org_order = deficit_round_robin(org_order, org_backlogs, org_weights, org_deficits, limit, quantum)
+
+    backlogs = {org: dict(users) for org, users in backlogs.items()}
+    picked = []
+    for org in picked_orgs:
+        (user,), user_orders[org] = deficit_round_robin(
+            user_orders.get(org, []),
+            backlogs[org],
+            user_weights.get(org, {}),
+            user_deficits.setdefault(org, {}),
+            1,
+            quantum,
+        )
+        backlogs[org][user] -= 1
+        picked.append((org, user))
+
+    return picked, org_order
+
+
+def submit(job, org_id, user_id, is_api_key=False):
+    """
+    Holds a created (but not yet enqueued) job in its user's sub-queue and dispatches whatever fits into the RQ
+    queue right away.
+    """
+    queue_name = job.origin
+    org_weight_ = org_weight(org_id)
+    user_weight_ = user_weight(org_id, user_id, is_api_key)
+    # Jobs without a user (e.g. scheduled ones) share a sub-queue in their org
+    user_id = str(user_id)
+
+    with redis_connection.lock(_key(queue_name, "lock"), timeout=30):
+        pipe = redis_connection.pipeline()
+        pipe.rpush(_key(queue_name, "jobs", org_id, user_id), job.id)
+        pipe.hset(_key(queue_name, "weights"), org_id, org_weight_)
+        pipe.hset(_key(queue_name, "user_weights", org_id), user_id, user_weight_)
+        pipe.sadd(_key(queue_name, "active"), org_id)
+        pipe.sadd(_key(queue_name, "active_users", org_id), user_id)
+        _, _, _, is_new_org, is_new_user = pipe.execute()
+
+        if is_new_org:
+            redis_connection.rpush(_key(queue_name, "orgs"), org_id)
+        if is_new_user:
+            redis_connection.rpush(_key(queue_name, "users", org_id), user_id)
+
+        logger.info(
+            "[%s] Held job %s for tenant %s (org weight=%s, user weight=%s)",
+            queue_name,
+            job.id,
+            tenant_for(org_id, user_id),
+            org_weight_,
+            user_weight_,
+        )
+        return _dispatch(queue_name)
+
+
+def dispatch(queue_name):
+    if not is_enabled(queue_name):
+        return 0
+
+    with redis_connection.lock(_key(queue_name, "lock"), timeout=30):
+        return _dispatch(queue_name)
+
+
+def _floats(mapping):
+    return {k: float(v) for k, v in mapping.items()}
+
+
+def _backlogs(queue_name):
+    """Returns the orgs in their round robin order, the users of every org in theirs and the backlog of every user."""
+    org_order = redis_connection.lrange(_key(queue_name, "orgs"), 0, -1)
+
+    pipe = redis_connection.pipeline()
+    for org in org_order:
+        pipe.lrange(_key(queue_name, "users", org), 0, -1)
+    user_orders = dict(zip(org_order, pipe.execute()))
+
+    pipe = redis_connection.pipeline()
+    for org, users in user_orders.items():
+        for user in users:
+            pipe.llen(_key(queue_name, "jobs", org, user))
+    lengths = iter(pipe.execute())
+    backlogs = {org: {user: next(lengths) for user in users} for org, users in user_orders.items()}
+
+    return org_order, user_orders, backlogs
+
+
+def _save(queue_name, org_order, new_order, user_orders, backlogs, deficits, picked_orgs):
+    """Stores the round robin state after a dispatch, and forgets the orgs and users that have nothing pending."""
+    org_deficits, user_deficits = deficits
+    drained = [org for org in org_order if org not in new_order]
+    pipe = redis_connection.pipeline()
+    pipe.delete(_key(queue_name, "orgs"), _key(queue_name, "deficits"))
+    if new_order:
+        pipe.rpush(_key(queue_name, "orgs"), *new_order)
+    if org_deficits:
+        pipe.hset(_key(queue_name, "deficits"), mapping=org_deficits)
+    if drained:
+        pipe.srem(_key(queue_name, "active"), *drained)
+        pipe.hdel(_key(queue_name, "weights"), *drained)
+
+    for org in drained:
+        pipe.delete(
+            _key(queue_name, "users", org),
+            _key(queue_name, "active_users", org),
+            _key(queue_name, "user_weights", org),
+            _key(queue_name, "user_deficits", org),
+        )
+    for org in picked_orgs - set(drained):
+        users = user_orders[org]
+        drained_users = [user for user in backlogs[org] if user not in users]
+        pipe.delete(_key(queue_name, "users", org), _key(queue_name, "user_deficits", org))
+        if users:
+            pipe.rpush(_key(queue_name, "users", org), *users)
+        if user_deficits.get(org):
+            pipe.hset(_key(queue_name, "user_deficits", org), mapping=user_deficits[org])
+        if drained_users:
+            pipe.srem(_key(queue_name, "active_users", org), *drained_users)
+            pipe.hdel(_key(queue_name, "user_weights", org), *drained_users)
+    pipe.execute()
+
+
+def _dispatch(queue_name):
+    queue = Queue(queue_name)
+    capacity = settings.FAIR_SHARE_MAX_QUEUED_JOBS - len(queue)
+    if capacity <= 0:
+        return 0
+
+    org_order, user_orders, backlogs = _backlogs(queue_name)
+    if not org_order:
+        return 0
+
+    weights = (
+        _floats(redis_connection.hgetall(_key(queue_name, "weights"))),
+        {org: _floats(redis_connection.hgetall(_key(queue_name, "user_weights", org))) for org in org_order},
+    )
+    deficits = (
+        _floats(redis_connection.hgetall(_key(queue_name, "deficits"))),
+        {org: _floats(redis_connection.hgetall(_key(queue_name, "user_deficits", org))) for org in org_order},
+    )
+
+    picked, new_order = hierarchical_round_robin(
+        org_order, user_orders, backlogs, weights, deficits, capacity, quantum=settings.FAIR_SHARE_QUANTUM
+    )
+
+    dispatched = 0
+    for org, user in picked:
+        job_id = redis_connection.lpop(_key(queue_name, "jobs", org, user))
+        if job_id is None:
+            continue
+
+        try:
+            job = Job.fetch(job_id)
+        except NoSuchJobError:
+            logger.info("[%s] Job %s expired before it was dispatched", queue_name, job_id)
+            continue
+
+        if job.get_status() != JobStatus.QUEUED:
+            logger.info("[%s] Skipping job %s (%s)", queue_name, job_id, job.get_status())
+            continue
+
+        queue.enqueue_job(job)
+        dispatched += 1
+
+    _save(queue_name, org_order, new_order, user_orders, backlogs, deficits, {org for org, _ in picked})
+
+    if dispatched:
+        logger.info("[%s] Dispatched %d jobs", queue_name, dispatched)
+
+    return dispatched
+
+
+def dispatch_fair_share_queues():
+    for queue_name in queue_names():
+        dispatch(queue_name)
+
+
+def pending_counts(queue_name):
+    _, _, backlogs = _backlogs(queue_name)
+    return {tenant_for(org, user): count for org, users in backlogs.items() for user, count in users.items()}
+
+
+def pending_job_ids(queue_name=None):
+    job_ids = []
+    for name in [queue_name] if queue_name else queue_names():
+        for org in redis_connection.lrange(_key(name, "orgs"), 0, -1):
+            for user in redis_connection.lrange(_key(name, "users", org), 0, -1):
+                job_ids.extend(redis_connection.lrange(_key(name, "jobs", org, user), 0, -1))
+
+    return job_ids
+
+
+def jain_index(values):
+    values = list(values)
+    if not values or not any(values):
+        return 1.0
+
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+def _org_of(tenant):
+    return tenant.split(":", 1)[0]
+
+
+def simulate(jobs, workers, fair=True, weights=None, quantum=1.0):
+    """
+    Simulates dispatching `jobs` (a list of `(tenant, arrival, duration)` tuples) to `workers` workers, either in
+    plain FIFO order or with deficit round robin, and returns per-tenant wait statistics along with a fairness index.
+    Tenants are "org:user" strings (a tenant without a user is an org of its own) and `weights` are org weights.
+
+    The fairness index is Jain's index over the share of dispatch decisions each tenant received while it had a
+    backlog, relative to its fair share of those decisions (its org's weighted share, split evenly among the org's
+    backlogged users) and capped at 1 (a tenant can't be starved by others receiving more than their share while it
+    has nothing to run). 1.0 is perfectly fair.
+    """
+    weights = weights or {}
+    jobs = sorted(jobs, key=lambda j: j[1])
+    pending = defaultdict(deque)
+    fifo = deque()
+    org_order = []
+    user_orders = defaultdict(list)
+    deficits = ({}, {})
+    free_at = [0.0] * workers
+    waits = defaultdict(list)
+    received = defaultdict(float)
+    deserved = defaultdict(float)
+    next_job = 0
+    remaining = len(jobs)
+    now = 0.0
+
+    while remaining:
+        now = max(now, min(free_at))
+        while next_job < len(jobs) and jobs[next_job][1] <= now:
+            tenant = jobs[next_job][0]
+            org = _org_of(tenant)
+            pending[tenant].append(jobs[next_job])
+            fifo.append(jobs[next_job])
+            if org not in org_order:
+                org_order.append(org)
+            if tenant not in user_orders[org]:
+                user_orders[org].append(tenant)
+            next_job += 1
+
+        if not fifo:
+            now = jobs[next_job][1]
+            continue
+
+        backlogs = defaultdict(dict)
+        for tenant in pending:
+            if pending[tenant]:
+                backlogs[_org_of(tenant)][tenant] = len(pending[tenant])
+        total_weight = sum(weights.get(org, 1.0) for org in backlogs)
+        for org, users in backlogs.items():
+            for tenant in users:
+                deserved[tenant] += weights.get(org, 1.0) / total_weight / len(users)
+
+        if fair:
+            (picked,), org_order = hierarchical_round_robin(
+                org_order, user_orders, backlogs, (weights, {}), deficits, 1, quantum
+            )
+            job = pending[picked[1]].popleft()
+            fifo.remove(job)
+        else:
+            job = fifo.popleft()
+            pending[job[0]].remove(job)
+
+        tenant, arrival, duration = job
+        received[tenant] += 1
+        worker = free_at.index(min(free_at))
+        start = max(now, free_at[worker])
+        free_at[worker] = start + duration
+        waits[tenant].append(start - arrival)
+        remaining -= 1
+
+    stats = {}
+    for tenant, tenant_waits in waits.items():
+        tenant_waits = sorted(tenant_waits)
+        stats[tenant] = {
+            "jobs": len(tenant_waits),
+            "mean_wait": sum(tenant_waits) / len(tenant_waits),
+            "p95_wait": tenant_waits[min(len(tenant_waits) - 1, int(0.95 * len(tenant_waits)))],
+        }
+
+    return {
+        "tenants": stats,
+        "fairness": jain_index([min(1.0, received[t] / deserved[t]) for t in deserved if deserved[t]]),
+        "makespan": max(free_at),
+    }
@@ -0,0 +1,131 @@
+"""
+Incremental (watermark based) refresh of scheduled queries.
+
+A query opts in by setting `options.incremental`:
+
+    {
+        "watermark_column": "created_at",  # required
+        "parameter": "watermark",          # query parameter receiving the last watermark (default: the column name)
+        "mode": "append",                  # "append" or "upsert"
+        "key_columns": ["id"],             # required for "upsert"
+        "window": 7776000,                 # optional: drop rows whose watermark is older than this (seconds or units)
+        "max_rows": 100000,                # optional: keep only the newest rows
+    }
+
+The query text filters on the parameter (e.g. `WHERE created_at > '{{ watermark }}'`), which should be a text
+parameter. The highest watermark of every result is stored in the result's metadata. When a previous result exists,
+the scheduler injects its watermark as the parameter's value and the executor merges the new rows into the previous
+result, storing the merged result under the query's own hash (the hash of the query with its default parameters).
+"""
+import datetime
+
+from dateutil import parser
+
+from redash.utils import json_dumps, json_loads
+from redash.worker import get_job_logger
+
+logger = get_job_logger(__name__)
+
+APPEND = "append"
+UPSERT = "upsert"
+
+
+def get_options(query):
+    options = (query.options or {}).get("incremental")
+    if not options or not options.get("watermark_column"):
+        return None
+
+    mode = options.get("mode", APPEND)
+    if mode not in (APPEND, UPSERT) or (mode == UPSERT and not options.get("key_columns")):
+        logger.warning("Ignoring invalid incremental refresh options of query %s: %s", query.id, options)
+        return None
+
+    return {
+        "watermark_column": options["watermark_column"],
+        "parameter": options.get("parameter", options["watermark_column"]),
+        "mode": mode,
+        "key_columns": options.get("key_columns", []),
+        "window": options.get("window"),
+        "max_rows": options.get("max_rows"),
+    }
+
+
+def last_watermark(query_result):
+    if query_result is None or not query_result.data:
+        return None
+
+    return query_result.data.get("metadata", {}).get("watermark")
+
+
+def _comparable(value):
+    if isinstance(value, str):
+        try:
+            value = parser.parse(value)
+        except (ValueError, OverflowError):
+            return value
+
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return value
+
+
+def max_watermark(rows, column):
+    watermark = None
+    for row in rows:
+        value = row.get(column)
+        if value is not None and (watermark is None or _comparable(value) > _comparable(watermark)):
+            watermark = value
+
+    return watermark
+
+
+def _trim(rows, options, watermark):
+    column = options["watermark_column"]
+
+    if options["window"] and watermark is not None:
+        newest = _comparable(watermark)
+        if isinstance(newest, datetime.datetime):
+            oldest = newest - datetime.timedelta(seconds=options["window"])
+        elif isinstance(newest, (int, float)):
+            oldest = newest - options["window"]
+        else:
+            oldest = None
+
+        if oldest is not None:
+            rows = [r for r in rows if r.get(column) is not None and _comparable(r[column]) >= oldest]
+
+    if options["max_rows"] and len(rows) > options["max_rows"]:
+        # Rows without a watermark are considered the oldest
+        rows = sorted(rows, key=lambda r: (r.get(column) is not None, _comparable(r[column]) if r.get(column) else 0))
+        rows = rows[-options["max_rows"] :]
+
+    return rows
+
+
+def merge(previous_data, new_data, options):
+    """
+    Merges the rows of an incremental run into the previous result. Returns new result data with the new watermark
+    in its metadata.
+    """
+    # New rows come straight from the query runner, while the previous ones went through JSON serialization. Bring the
+    # new ones to the same representation, so keys and watermarks compare equal.
+    new_data = json_loads(json_dumps(new_data))
+    previous_rows = previous_data.get("rows", []) if previous_data else []
+
+    if options["mode"] == UPSERT:
+        key_columns = options["key_columns"]
+        merged = {tuple(row.get(c) for c in key_columns): row for row in previous_rows}
+        for row in new_data.get("rows", []):
+            merged[tuple(row.get(c) for c in key_columns)] = row
+        rows = list(merged.values())
+    else:
+        rows = previous_rows + new_data.get("rows", [])
+
+    watermark = max_watermark(rows, options["watermark_column"])
+    rows = _trim(rows, options, watermark)
+
+    columns = new_data.get("columns") or (previous_data or {}).get("columns", [])
+    metadata = dict(new_data.get("metadata", {}), watermark=watermark, incremental_rows=len(new_data.get("rows", [])))
+
+    return dict(new_data, columns=columns, rows=rows, metadata=metadata)
@@ -0,0 +1,73 @@
+"""
+Runtime-aware routing of query jobs into "fast" and "slow" lanes.
+
+Each lane is a separate RQ queue: the fast lane keeps the original queue name and the slow lane is the same name with
+a "_slow" suffix. A query hash is routed to the slow lane when its p95 runtime (from `QueryRuntimeStats`) exceeds
+`QUERY_LANES_SLOW_THRESHOLD`. Query hashes without enough history get `QUERY_LANES_DEFAULT_LANE`.
+
+Runtime statistics lag behind when a query suddenly becomes slower, so every fast lane run that exceeds the threshold
+is counted as an overrun, and a query hash with `QUERY_LANES_MAX_OVERRUNS` overruns is moved to the slow lane right
+away. The overruns are cleared once the query hash runs within the threshold again.
+"""
+from prometheus_client import Counter
+
+from redash import models, redis_connection, settings
+from redash.worker import get_job_logger
+
+logger = get_job_logger(__name__)
+
+FAST = "fast"
+SLOW = "slow"
+SLOW_LANE_SUFFIX = "_slow"
+OVERRUNS_TTL = 7 * 24 * 60 * 60
+
+queryLaneOverrunsCounter = Counter(
+    "query_lane_overruns",
+    "Fast lane query jobs that ran longer than the slow lane threshold",
+    ["queue"],
+)
+
+
+def _overruns_key(data_source_id, query_hash):
+    return "query_lanes:overruns:{}:{}".format(data_source_id, query_hash)
+
+
+def is_enabled(queue_name):
+    return settings.QUERY_LANES_ENABLED and queue_name in settings.QUERY_LANES_QUEUES
+
+
+def lane_queue_name(queue_name, lane):
+    return queue_name + SLOW_LANE_SUFFIX if lane == SLOW else queue_name
+
+
+def classify(data_source_id, query_hash):
+    overruns = int(redis_connection.get(_overruns_key(data_source_id, query_hash)) or 0)
+    if overruns >= settings.QUERY_LANES_MAX_OVERRUNS:
+        return SLOW
+
+    stats = models.QueryRuntimeStats.get(data_source_id, query_hash)
+    if stats is None or stats.run_count < settings.QUERY_LANES_MIN_RUNS:
+        return settings.QUERY_LANES_DEFAULT_LANE
+
+    return SLOW if stats.p95_runtime > settings.QUERY_LANES_SLOW_THRESHOLD else FAST
+
+
+def route(queue_name, data_source_id, query_hash):
+    """Returns the queue name and the lane to enqueue a query job in."""
+    lane = classify(data_source_id, query_hash)
+    return lane_queue_name(queue_name, lane), lane
+
+
+def record_run(lane, queue_name, data_source_id, query_hash, run_time):
+    key = _overruns_key(data_source_id, query_hash)
+
+    if run_time <= settings.QUERY_LANES_SLOW_THRESHOLD:
+        redis_connection.delete(key)
+    elif lane == FAST:
+        logger.info("[%s] Query hash %s overran the fast lane (%.2fs)", queue_name, query_hash, run_time)
+        queryLaneOverrunsCounter.labels(queue_name).inc()
+
+        pipe = redis_connection.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, OVERRUNS_TTL)
+        pipe.execute()
@@ -1,4 +1,5 @@
 import logging
+import math
 import time
 
 from prometheus_client import Counter
@@ -12,7 +13,14 @@ from redash.models.parameterized_query import (
 )
 from redash.monitor import rq_job_ids
 from redash.tasks.failure_report import track_failure
+from redash.tasks.queries import (
+    backpressure,
+    dependencies,
+    incremental,
+    smoothing,
+)
 from redash.tasks.queries.execution import enqueue_query
+from redash.tasks.queries.fair_share import pending_job_ids
 from redash.utils import json_dumps, sentry
 from redash.worker import get_job_logger, job
 
@@ -58,8 +66,9 @@ def _should_refresh_query(query):
         return True
 
 
-def _apply_default_parameters(query):
+def _apply_default_parameters(query, overrides=None):
     parameters = {p["name"]: p.get("value") for p in query.parameters}
+    parameters.update(overrides or {})
     if any(parameters):
         try:
             return query.parameterized.apply(parameters).query
@@ -87,24 +96,94 @@ def _apply_auto_limit(query_text, query):
     return query.data_source.query_runner.apply_auto_limit(query_text, should_apply_auto_limit)
 
 
-def refresh_queries():
-    started_at = time.time()
-    logger.info("Refreshing queries...")
+def _enqueue_scheduled_query(query):
+    metadata = {"query_id": query.id, "Username": query.user.get_actual_user()}
+    overrides = None
+
+    incremental_options = incremental.get_options(query)
+    watermark = incremental.last_watermark(query.latest_query_data) if incremental_options else None
+    if watermark is not None:
+        # Only fetch rows newer than the previous result; the executor merges them into it.
+        overrides = {incremental_options["parameter"]: watermark}
+        metadata["Watermark"] = watermark
+
+    query_text = _apply_default_parameters(query, overrides)
+    query_text = _apply_auto_limit(query_text, query)
+
+    if dependencies.is_enabled():
+        dependencies.mark_in_flight(query.id)
+
+    try:
+        return enqueue_query(
+            query_text,
+            query.data_source,
+            query.user_id,
+            scheduled_query=query,
+            metadata=metadata,
+        )
+    except Exception:
+        if dependencies.is_enabled():
+            dependencies.release([query.id])
+        raise
+
+
+def _hold_back(query, graph, held_back):
+    """
+    Holds back a query whose upstream queries are being refreshed, until their results land.
+    """
+    if dependencies.is_waiting(query.id):
+        return True
+
+    upstream_ids = dependencies.pending_upstreams(graph.get(query.id, ()), held_back)
+    if upstream_ids:
+        dependencies.wait_for(query.id, upstream_ids)
+        return True
+
+    return False
+
+
+def _refresh(outdated_queries, budget):
+    """
+    Enqueues the due `outdated_queries` in order, no more than `budget` of them (None for no limit), except those
+    held back for their upstream queries or their queue's backlog. Scheduled and downstream refreshes both go through
+    it. Returns the enqueued queries, along with the counts and the queue backlogs reported in the scheduler's status.
+    """
     enqueued = []
-    for query in models.Query.outdated_queries():
+    deferred = 0
+
+    graph = {}
+    held_back = set()
+    backlogs = {}
+    pending = {}
+    backpressured = {backpressure.COALESCED: 0, backpressure.DEFERRED: 0}
+    if dependencies.is_enabled():
+        graph = dependencies.dependency_graph(outdated_queries)
+        outdated_queries = dependencies.topological_order(outdated_queries, graph)
+
+    for index, query in enumerate(outdated_queries):
+        if budget is not None and len(enqueued) >= budget:
+            # The rest stay due and are enqueued on the next runs.
+            deferred = len(outdated_queries) - index
+            break
+
         if not _should_refresh_query(query):
             continue
 
         try:
-            query_text = _apply_default_parameters(query)
-            query_text = _apply_auto_limit(query_text, query)
-            enqueue_query(
-                query_text,
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata={"query_id": query.id, "Username": query.user.get_actual_user()},
-            )
+            if graph and _hold_back(query, graph, held_back):
+                held_back.add(query.id)
+                continue
+
+            if backpressure.is_enabled():
+                reason = backpressure.check(query, backlogs, pending)
+                if reason:
+                    backpressure.hold(query, reason)
+                    backpressured[reason] += 1
+                    continue
+
+            job = _enqueue_scheduled_query(query)
+            if job and backpressure.is_enabled():
+                backpressure.track(query, job, pending)
             enqueued.append(query)
         except Exception as e:
             message = "Could not enqueue query %d due to %s" % (query.id, repr(e))
@@ -112,9 +191,32 @@ def refresh_queries():
             error = RefreshQueriesError(message).with_traceback(e.__traceback__)
             sentry.capture_exception(error)
 
+    counts = {
+        "deferred_queries_count": deferred,
+        "held_back_queries_count": len(held_back),
+        "backpressure_deferred_count": backpressured[backpressure.DEFERRED],
+        "coalesced_queries_count": backpressured[backpressure.COALESCED],
+    }
+    return enqueued, counts, backlogs
+
+
+def refresh_queries():
+    started_at = time.time()
+    logger.info("Refreshing queries...")
+    outdated_queries = models.Query.outdated_queries()
+    models.db.session.commit()
+    budget = smoothing.enqueue_budget(redis_connection.hget("redash:status", "started_at"), started_at)
+
+    enqueued, counts, backlogs = _refresh(outdated_queries, budget)
+    smoothing.save_budget(None if budget is None else budget - len(enqueued))
+
     status = {
         "started_at": started_at,
         "outdated_queries_count": len(enqueued),
+        **counts,
+        "scheduled_backlog": json_dumps(
+            {name: {"size": size, "oldest_job_age": age} for name, (size, age) in backlogs.items()}
+        ),
         "last_refresh_at": time.time(),
         "query_ids": json_dumps([q.id for q in enqueued]),
     }
@@ -123,6 +225,27 @@ def refresh_queries():
     logger.info("Done refreshing queries: %s" % status)
 
 
+@job("default")
+def refresh_downstream_queries(query_ids):
+    """
+    Enqueues held back queries once the upstream queries they waited for are refreshed. They go through the same
+    checks as scheduled refreshes (demand-driven scheduling, backpressure) and take from what's left of the
+    scheduler's enqueue budget; the queries left out stay due for the scheduler's next run.
+    """
+    outdated_queries = models.Query.outdated_queries(query_ids=query_ids)
+    models.db.session.commit()
+    if not outdated_queries:
+        return
+
+    budget = smoothing.take_budget(len(outdated_queries))
+    enqueued, _, _ = _refresh(outdated_queries, budget)
+    if budget is not None:
+        smoothing.return_budget(budget - len(enqueued))
+
+    for query in enqueued:
+        logger.info("Enqueued query %s after its upstream queries were refreshed", query.id)
+
+
 def cleanup_query_results():
     """
     Job to cleanup unused query results -- such that no query links to them anymore, and older than
@@ -154,7 +277,7 @@ def remove_ghost_locks():
     """
     keys = redis_connection.keys("query_hash_job:*")
     locks = {k: redis_connection.get(k) for k in keys}
-    jobs = list(rq_job_ids())
+    jobs = set(rq_job_ids()) | set(pending_job_ids())
 
     count = 0
 
@@ -179,6 +302,8 @@ def refresh_schema(data_source_id):
             time.time() - start_time,
         )
         refreshSchemaCounter.labels("success").inc()
+        if settings.SCHEMA_RUN_TABLE_SIZE_CALCULATIONS:
+            refresh_table_stats.delay(ds.id)
     except JobTimeoutException:
         logger.info(
             "task=refresh_schema state=timeout ds_id=%s runtime=%.2f",
@@ -196,6 +321,34 @@ def refresh_schema(data_source_id):
         )
 
 
+@job(
+    "schemas",
+    timeout=settings.SCHEMA_TABLE_STATS_TIMEOUT
+    * math.ceil(settings.SCHEMA_TABLE_STATS_MAX_COUNTS / max(settings.SCHEMA_TABLE_STATS_CONCURRENCY, 1))
+    + 300,
+)
+def refresh_table_stats(data_source_id):
+    ds = models.DataSource.get_by_id(data_source_id)
+    logger.info("task=refresh_table_stats state=start ds_id=%s", ds.id)
+    start_time = time.time()
+    try:
+        stats = ds.refresh_table_stats()
+        logger.info(
+            "task=refresh_table_stats state=finished ds_id=%s tables=%d runtime=%.2f",
+            ds.id,
+            len(stats),
+            time.time() - start_time,
+        )
+    except JobTimeoutException:
+        logger.info(
+            "task=refresh_table_stats state=timeout ds_id=%s runtime=%.2f",
+            ds.id,
+            time.time() - start_time,
+        )
+    except Exception:
+        logger.warning("Failed refreshing table stats for the data source: %s", ds.name, exc_info=1)
+
+
 def refresh_schemas():
     """
     Refreshes the data sources schemas.
@@ -0,0 +1,265 @@
+"""
+Load smoothing for scheduled queries.
+
+Most schedules are "daily at 00:00" or "every hour", so without smoothing `refresh_queries` enqueues thousands of jobs
+in a single tick and workers and data sources sit idle for the rest of the hour. Three mechanisms spread that load:
+
+* Jitter: schedules with a specific time are delayed by a deterministic per-query offset of up to
+  `SCHEDULE_JITTER_WINDOW` seconds. The offset depends only on the query id, so a query runs at the same time every
+  day.
+* Rate limiting: no more than `SCHEDULE_MAX_ENQUEUE_RATE` scheduled queries are enqueued per minute, most overdue
+  first. The rest stay due and are picked up on the next ticks.
+* Smoothing: interval based schedules are pinned to slots (`offset + k * interval` seconds since the epoch), chosen
+  to flatten the load curve by `manage queries schedule_load --smooth --apply`. Slots are kept in Redis and used when
+  `SCHEDULE_SMOOTHING_ENABLED` is set.
+"""
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from pytz import utc
+from sqlalchemy import func
+from sqlalchemy.sql.expression import select, update
+
+from redash import models, redis_connection, settings, utils
+
+HORIZON = 24 * 60 * 60
+BUDGET_KEY = "sq:enqueue_budget"
+
+SimulatedQuery = namedtuple("SimulatedQuery", ["id", "schedule", "failures", "previous"])
+
+
+def _reschedule(query_ids):
+    # The stored next runs were computed with the previous slots, have the scheduler compute them again.
+    models.db.session.execute(
+        update(models.Query)
+        .where(models.Query.id.in_(query_ids), models.Query.next_run_at.isnot(None))
+        .values(next_run_at=utils.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    models.db.session.commit()
+
+
+def save_phases(phases, query_ids):
+    """
+    Replaces the slots of `query_ids` with `phases` (queries missing from `phases` lose their slot).
+    """
+    query_ids = list(query_ids)
+    if not query_ids:
+        return
+
+    models.scheduled_queries_phases.replace(phases, query_ids)
+    _reschedule(query_ids)
+
+
+def clear_phases():
+    query_ids = list(models.scheduled_queries_phases.get())
+    models.scheduled_queries_phases.clear()
+
+    if query_ids:
+        _reschedule(query_ids)
+
+    return len(query_ids)
+
+
+def enqueue_budget(previous_started_at, now):
+    """
+    Returns how many scheduled queries may be enqueued by a `refresh_queries` run starting at `now`, or None when
+    there's no limit.
+    """
+    rate = settings.SCHEDULE_MAX_ENQUEUE_RATE
+    if rate <= 0:
+        return None
+
+    elapsed = 60.0
+    if previous_started_at:
+        elapsed = min(max(now - float(previous_started_at), 0.0), 60.0)
+
+    return max(1, int(rate * elapsed / 60))
+
+
+def save_budget(remaining):
+    """
+    Leaves what a `refresh_queries` run didn't use of its budget to the refreshes of downstream queries, until the
+    next run (None when there's no limit).
+    """
+    if remaining is None:
+        redis_connection.delete(BUDGET_KEY)
+    else:
+        redis_connection.set(BUDGET_KEY, max(remaining, 0))
+
+
+def take_budget(wanted):
+    """
+    Takes up to `wanted` enqueues from what's left of the current budget, and returns how many were granted, or None
+    when there's no limit.
+    """
+    if settings.SCHEDULE_MAX_ENQUEUE_RATE <= 0:
+        return None
+
+    left = redis_connection.decrby(BUDGET_KEY, wanted)
+    granted = max(0, min(wanted, left + wanted))
+    if granted < wanted:
+        redis_connection.incrby(BUDGET_KEY, wanted - granted)
+
+    return granted
+
+
+def return_budget(unused):
+    if unused > 0 and settings.SCHEDULE_MAX_ENQUEUE_RATE > 0:
+        redis_connection.incrby(BUDGET_KEY, unused)
+
+
+def simulated_queries(org=None):
+    """
+    Returns the active scheduled queries along with their last execution, for simulating the schedule load.
+    """
+    query = (
+        select(
+            models.Query.id,
+            models.Query.schedule,
+            models.Query.schedule_failures,
+            models.QueryResult.retrieved_at,
+        )
+        .outerjoin(models.QueryResult, models.QueryResult.id == models.Query.latest_query_data_id)
+        .where(func.jsonb_typeof(models.Query.schedule) != "null", models.Query.is_archived.is_(False))
+    )
+    if org is not None:
+        query = query.where(models.Query.org_id == org.id)
+
+    rows = models.db.session.execute(query.order_by(models.Query.id)).all()
+    models.scheduled_queries_executions.refresh([row.id for row in rows])
+
+    now = utils.utcnow()
+    queries = []
+    for row in rows:
+        schedule = row.schedule
+        if schedule.get("disabled") or not schedule.get("interval"):
+            continue
+
+        try:
+            if schedule.get("until") and utc.localize(datetime.strptime(schedule["until"], "%Y-%m-%d")) <= now:
+                continue
+        except ValueError:
+            continue
+
+        previous = models.scheduled_queries_executions.get(row.id) or row.retrieved_at
+        queries.append(SimulatedQuery(row.id, schedule, row.schedule_failures, previous))
+
+    return queries
+
+
+def run_times(query, start, end, offset=None):
+    """
+    Yields when `query` would run between `start` and `end`, assuming every run happens as soon as it's due. Overdue
+    queries run at `start`.
+    """
+    schedule = query.schedule
+    previous = query.previous or start
+
+    while True:
+        next_iteration = models.next_scheduled_run(
+            previous,
+            schedule["interval"],
+            schedule.get("time"),
+            schedule.get("day_of_week"),
+            query.failures,
+            offset,
+        )
+        if next_iteration is None or next_iteration >= end or next_iteration <= previous:
+            return
+
+        next_iteration = max(next_iteration, start)
+        yield next_iteration
+        previous = next_iteration
+
+
+def load_curve(queries, start, end, bucket, offsets=None):
+    """
+    Returns the number of scheduled runs in each `bucket` seconds long slice of [start, end).
+    """
+    offsets = offsets or {}
+    curve = [0] * int(math.ceil((end - start).total_seconds() / bucket))
+
+    for query in queries:
+        for run_at in run_times(query, start, end, offsets.get(query.id)):
+            curve[int((run_at - start).total_seconds() // bucket)] += 1
+
+    return curve
+
+
+def _is_smoothable(query, bucket, horizon):
+    if query.schedule.get("time") is not None:
+        return False
+
+    try:
+        return 2 * bucket <= int(query.schedule["interval"]) <= horizon
+    except (TypeError, ValueError):
+        return False
+
+
+def _slot_buckets(phase, interval, start_ts, end_ts, bucket):
+    slot = math.ceil((start_ts - phase) / interval) * interval + phase
+    buckets = []
+    while slot < end_ts:
+        buckets.append(int((slot - start_ts) // bucket))
+        slot += interval
+
+    return buckets
+
+
+def assign_phases(queries, start, end, bucket, window=0):
+    """
+    Greedily assigns every interval based schedule to the slot whose busiest bucket is the least loaded, given the
+    load of the other schedules (with `window` jitter) and of the schedules assigned so far. Shorter intervals, which
+    contribute the most runs, are placed first. Ties keep a query close to its current phase.
+
+    Returns a `{query_id: phase}` dict. Loads are computed for the steady state, where every query runs in its slot.
+    """
+    horizon = (end - start).total_seconds()
+    smoothable = [q for q in queries if _is_smoothable(q, bucket, horizon)]
+    fixed = [q for q in queries if not _is_smoothable(q, bucket, horizon)]
+    curve = load_curve(fixed, start, end, bucket, models.schedule_offsets(fixed, window, phases={}))
+
+    start_ts = start.timestamp()
+    end_ts = end.timestamp()
+    phases = {}
+
+    for query in sorted(smoothable, key=lambda q: (int(q.schedule["interval"]), q.id)):
+        interval = int(query.schedule["interval"])
+        current = int((query.previous or start).timestamp()) % interval
+
+        best = None
+        for phase in range(0, interval, bucket):
+            buckets = _slot_buckets(phase, interval, start_ts, end_ts, bucket)
+            loads = [curve[b] for b in buckets]
+            distance = min(abs(phase - current), interval - abs(phase - current))
+            cost = (max(loads, default=0), sum(loads), distance)
+            if best is None or cost < best[0]:
+                best = (cost, phase, buckets)
+
+        _, phase, buckets = best
+        for b in buckets:
+            curve[b] += 1
+        phases[query.id] = phase
+
+    return phases
+
+
+def simulation_window(bucket, now=None):
+    now = now or utils.utcnow()
+    start = utils.dt_from_timestamp(math.floor(now.timestamp() / bucket) * bucket)
+    return start, start + timedelta(seconds=HORIZON)
+
+
+def curve_stats(curve):
+    if not curve:
+        return {"runs": 0, "peak": 0, "mean": 0.0, "stddev": 0.0}
+
+    mean = sum(curve) / float(len(curve))
+    return {
+        "runs": sum(curve),
+        "peak": max(curve),
+        "mean": mean,
+        "stddev": math.sqrt(sum((value - mean) ** 2 for value in curve) / len(curve)),
+    }
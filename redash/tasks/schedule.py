@@ -7,10 +7,12 @@ from rq.job import Job
 from rq_scheduler import Scheduler
 
 from redash import rq_redis_connection, settings
+from redash.tasks.events import flush_events, maintain_events
 from redash.tasks.failure_report import send_aggregated_errors
 from redash.tasks.general import sync_user_details
 from redash.tasks.queries import (
     cleanup_query_results,
+    dispatch_fair_share_queues,
     empty_schedules,
     refresh_queries,
     refresh_schemas,
@@ -77,8 +79,13 @@ def periodic_job_definitions():
             "func": send_aggregated_errors,
             "interval": timedelta(minutes=settings.SEND_FAILURE_EMAIL_INTERVAL),
         },
+        {"func": flush_events, "timeout": 300, "interval": settings.EVENTS_FLUSH_INTERVAL, "result_ttl": 600},
+        {"func": maintain_events, "timeout": 3600, "interval": timedelta(hours=1)},
     ]
 
+    if settings.FAIR_SHARE_ENABLED:
+        jobs.append({"func": dispatch_fair_share_queues, "interval": 10, "result_ttl": 600})
+
     if settings.QUERY_RESULTS_CLEANUP_ENABLED:
         jobs.append({"func": cleanup_query_results, "interval": timedelta(minutes=5)})
 
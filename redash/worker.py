@@ -9,6 +9,11 @@ from redash.tasks.worker import Queue as RedashQueue
 
 default_operational_queues = ["periodic", "emails", "default"]
 default_query_queues = ["scheduled_queries", "queries", "schemas"]
+if settings.QUERY_LANES_ENABLED:
+    # Slow lanes come last, so workers prefer short queries
+    default_query_queues += [
+        "{}_slow".format(q) for q in ["scheduled_queries", "queries"] if q in settings.QUERY_LANES_QUEUES
+    ]
 default_queues = default_operational_queues + default_query_queues
 
 
@@ -20,7 +20,7 @@ os.environ["REDASH_ENFORCE_CSRF"] = "false"
 
 from redash import limiter, redis_connection  # noqa: E402
 from redash.app import create_app  # noqa: E402
-from redash.models import db  # noqa: E402
+from redash.models import api_key_principals, db  # noqa: E402
 from redash.utils import json_dumps  # noqa: E402
 from tests.factories import Factory, user_factory  # noqa: E402
 
@@ -61,6 +61,7 @@ class BaseTestCase(TestCase):
         db.session.remove()
         db.engine.dispose()
         self.app_ctx.pop()
+        api_key_principals.invalidate()
         redis_connection.flushdb()
 
     def make_request(
@@ -44,6 +44,21 @@ class TestDashboardListGetResource(BaseTestCase):
         assert len(rv.json["results"]) == 2
         assert set([result["id"] for result in rv.json["results"]]) == set([d1.id, d2.id])
 
+    def test_cursor_pagination(self):
+        d1 = self.factory.create_dashboard(name="a")
+        d2 = self.factory.create_dashboard(name="B")
+        d3 = self.factory.create_dashboard(name="c")
+
+        rv = self.make_request("get", "/api/dashboards?per_page=2&order=-name&cursor=")
+        self.assertEqual([d3.id, d2.id], [result["id"] for result in rv.json["results"]])
+        self.assertEqual(3, rv.json["count"])
+
+        rv = self.make_request(
+            "get", "/api/dashboards?per_page=2&order=-name&cursor={}".format(rv.json["next_cursor"])
+        )
+        self.assertEqual([d1.id], [result["id"] for result in rv.json["results"]])
+        self.assertIsNone(rv.json["next_cursor"])
+
 
 class TestDashboardResourceGet(BaseTestCase):
     def test_get_dashboard(self):
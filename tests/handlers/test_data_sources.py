@@ -1,6 +1,7 @@
 from funcy import pairwise
+from mock import patch
 
-from redash.models import DataSource, db
+from redash.models import DataSource, SchemaIndex, db, schema_changes
 from tests import BaseTestCase
 
 
@@ -22,6 +23,71 @@ class TestDataSourceGetSchema(BaseTestCase):
         )
         self.assertEqual(response.status_code, 404)
 
+    def test_returns_changes_since_version(self):
+        data_source = self.factory.data_source
+        schema_changes.record(data_source.id, [], [{"name": "a", "columns": []}], 60)
+        schema_changes.record(data_source.id, [{"name": "a", "columns": []}], [], 60)
+
+        response = self.make_request("get", "/api/data_sources/{}/schema?since=1".format(data_source.id))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, response.json["version"])
+        self.assertEqual([["a"]], [change["removed"] for change in response.json["changes"]])
+
+
+class TestDataSourceSchemaTables(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        schema = [
+            {"name": "orders", "columns": ["id", "customer_id", "created_at"]},
+            {"name": "customers", "columns": ["id", "name"]},
+            {"name": "sales.daily_orders", "columns": [{"name": "day", "type": "date"}]},
+        ]
+        with patch("redash.query_runner.pg.PostgreSQL.get_schema", return_value=schema):
+            self.factory.data_source.get_schema()
+
+        self.path = "/api/data_sources/{}/schema".format(self.factory.data_source.id)
+
+    def test_lists_tables_a_page_at_a_time(self):
+        response = self.make_request("get", self.path + "/tables?per_page=2&page=2")
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, response.json["count"])
+        self.assertEqual(
+            [{"name": "sales.daily_orders", "description": None, "columns_count": 1}], response.json["results"]
+        )
+
+    def test_lists_tables_by_prefix(self):
+        response = self.make_request("get", self.path + "/tables?prefix=cust")
+
+        self.assertEqual(["customers"], [t["name"] for t in response.json["results"]])
+
+    def test_searches_table_and_column_names(self):
+        response = self.make_request("get", self.path + "/tables?q=orders")
+        self.assertEqual(["orders", "sales.daily_orders"], [t["name"] for t in response.json["results"]])
+
+        response = self.make_request("get", self.path + "/tables?q=cust")
+        self.assertEqual(["customers", "orders"], [t["name"] for t in response.json["results"]])
+        self.assertEqual(["customer_id"], response.json["results"][1]["matched_columns"])
+
+        response = self.make_request("get", self.path + "/tables?q=orders created")
+        self.assertEqual(["orders"], [t["name"] for t in response.json["results"]])
+
+    def test_searches_beyond_a_batch_of_tokens(self):
+        with patch.object(SchemaIndex, "BATCH", 1):
+            response = self.make_request("get", self.path + "/tables?q=cust")
+            self.assertEqual(2, response.json["count"])
+            self.assertEqual(["customers", "orders"], [t["name"] for t in response.json["results"]])
+
+            response = self.make_request("get", self.path + "/tables?q=orders created")
+            self.assertEqual(["orders"], [t["name"] for t in response.json["results"]])
+
+    def test_returns_columns_of_a_table(self):
+        response = self.make_request("get", self.path + "/table?name=sales.daily_orders")
+
+        self.assertEqual([{"name": "day", "type": "date"}], response.json["columns"])
+        self.assertEqual(404, self.make_request("get", self.path + "/table?name=missing").status_code)
+
 
 class TestDataSourceListGet(BaseTestCase):
     def test_returns_each_data_source_once(self):
@@ -1,7 +1,10 @@
+import datetime
+
 from redash import models
 from redash.models import db
 from redash.permissions import ACCESS_TYPE_MODIFY
 from redash.serializers import serialize_query
+from redash.utils import utcnow
 from tests import BaseTestCase
 
 
@@ -251,6 +254,66 @@ class TestQueryListResourceGet(BaseTestCase):
         assert len(rv.json["results"]) == 2
         assert set([result["id"] for result in rv.json["results"]]) == {q1.id, q2.id}
 
+    def _page_through(self, path, count):
+        ids = []
+        cursor = ""
+        while cursor is not None:
+            rv = self.make_request("get", "{}&cursor={}".format(path, cursor))
+            self.assertEqual(200, rv.status_code)
+            self.assertEqual(count, rv.json["count"])
+            ids.extend(result["id"] for result in rv.json["results"])
+            cursor = rv.json["next_cursor"]
+        return ids
+
+    def test_cursor_pagination(self):
+        queries = [self.factory.create_query(name="Query {}".format(i)) for i in range(5)]
+
+        ids = self._page_through("/api/queries?per_page=2&order=name", 5)
+
+        self.assertEqual(sorted(query.id for query in queries), sorted(ids))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_cursor_pagination_by_created_at(self):
+        # all within the same millisecond, so the cursor has to keep the microseconds
+        created_at = utcnow()
+        queries = [
+            self.factory.create_query(created_at=created_at + datetime.timedelta(microseconds=100 * i))
+            for i in range(5)
+        ]
+        expected = [query.id for query in queries]
+
+        self.assertEqual(expected, self._page_through("/api/queries?per_page=2&order=created_at", 5))
+        self.assertEqual(expected[::-1], self._page_through("/api/queries?per_page=2&order=-created_at", 5))
+
+    def test_cursor_pagination_with_search_term(self):
+        queries = [
+            self.factory.create_query(name="Sales"),
+            self.factory.create_query(name="Q1 sales"),
+            self.factory.create_query(name="Sales by region", description="Sales per region"),
+            self.factory.create_query(name="Weekly sales report"),
+        ]
+        self.factory.create_query(name="Ops")
+
+        ids = self._page_through("/api/queries?per_page=1&q=sales", 4)
+
+        self.assertEqual(sorted(query.id for query in queries), sorted(ids))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_page_numbers_without_cursor(self):
+        for _ in range(3):
+            self.factory.create_query()
+
+        rv = self.make_request("get", "/api/queries?per_page=2&page=2")
+
+        self.assertEqual(1, len(rv.json["results"]))
+        self.assertEqual(3, rv.json["count"])
+        self.assertNotIn("next_cursor", rv.json)
+
+    def test_rejects_invalid_cursor(self):
+        rv = self.make_request("get", "/api/queries?cursor=invalid")
+
+        self.assertEqual(400, rv.status_code)
+
 
 class TestQueryListResourcePost(BaseTestCase):
     def test_create_query(self):
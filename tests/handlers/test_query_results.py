@@ -1,7 +1,14 @@
+import mock
 from rq.job import JobStatus
 
-from redash.handlers.query_results import error_messages, run_query
+from redash import redis_connection
+from redash.handlers.query_results import (
+    DASHBOARD_RESULTS_STREAMS_KEY,
+    error_messages,
+    run_query,
+)
 from redash.models import db
+from redash.utils import gen_query_hash, json_loads
 from tests import BaseTestCase
 
 
@@ -436,7 +443,6 @@ class TestQueryResultExcelResponse(BaseTestCase):
 
 class TestJobResource(BaseTestCase):
     def test_cancels_queued_queries(self):
-
         query = self.factory.create_query()
         job_id = self.make_request(
             "post",
@@ -453,3 +459,114 @@ class TestJobResource(BaseTestCase):
 
         job = self.make_request("get", f"/api/jobs/{job_id}").json["job"]
         self.assertEqual(job["status"], JobStatus.CANCELED)
+
+
+class TestDashboardQueryResultsAPI(BaseTestCase):
+    def test_returns_cached_results_and_jobs(self):
+        dashboard = self.factory.create_dashboard()
+        cached_query = self.factory.create_query(query_text="SELECT 1")
+        query_result = self.factory.create_query_result()
+        cached = self.factory.create_widget(
+            dashboard=dashboard, visualization=self.factory.create_visualization(query=cached_query)
+        )
+        uncached_query = self.factory.create_query(query_text="SELECT 2")
+        uncached = self.factory.create_widget(
+            dashboard=dashboard, visualization=self.factory.create_visualization(query=uncached_query)
+        )
+        self.factory.create_widget(dashboard=dashboard, visualization=None, text="text")
+
+        rv = self.make_request("post", "/api/dashboards/{}/results".format(dashboard.id), data={})
+
+        self.assertEqual(rv.status_code, 200)
+        results = {r["widget_id"]: r for r in rv.json["results"]}
+        self.assertEqual({cached.id, uncached.id}, set(results))
+        self.assertEqual(query_result.id, results[cached.id]["query_result"]["id"])
+        self.assertIn("job", results[uncached.id])
+
+    def test_applies_parameters_by_widget(self):
+        dashboard = self.factory.create_dashboard()
+        query = self.factory.create_query(
+            query_text="SELECT {{n}}", options={"parameters": [{"name": "n", "type": "number", "value": 1}]}
+        )
+        self.factory.create_query_result(query_text="SELECT 2", query_hash=gen_query_hash("SELECT 2"))
+        visualization = self.factory.create_visualization(query=query)
+        widget = self.factory.create_widget(dashboard=dashboard, visualization=visualization)
+        default_widget = self.factory.create_widget(dashboard=dashboard, visualization=visualization)
+
+        rv = self.make_request(
+            "post",
+            "/api/dashboards/{}/results".format(dashboard.id),
+            data={"parameters": {str(widget.id): {"n": 2}}},
+        )
+
+        results = {r["widget_id"]: r for r in rv.json["results"]}
+        self.assertEqual("SELECT 2", results[widget.id]["query_result"]["query"])
+        self.assertIn("job", results[default_widget.id])
+
+    def test_reports_errors_by_widget(self):
+        dashboard = self.factory.create_dashboard()
+        ds = self.factory.create_data_source(group=self.factory.create_group())
+        restricted = self.factory.create_widget(
+            dashboard=dashboard,
+            visualization=self.factory.create_visualization(query=self.factory.create_query(data_source=ds)),
+        )
+        allowed = self.factory.create_widget(
+            dashboard=dashboard,
+            visualization=self.factory.create_visualization(query=self.factory.create_query(query_text="SELECT 2")),
+        )
+
+        rv = self.make_request("post", "/api/dashboards/{}/results".format(dashboard.id), data={})
+
+        self.assertEqual(rv.status_code, 200)
+        results = {r["widget_id"]: r for r in rv.json["results"]}
+        self.assertEqual(error_messages["no_permission"][0]["job"], results[restricted.id]["job"])
+        self.assertEqual(JobStatus.QUEUED, results[allowed.id]["job"]["status"])
+
+    def test_access_with_dashboard_api_key(self):
+        dashboard = self.factory.create_dashboard()
+        widget = self.factory.create_widget(dashboard=dashboard)
+        api_key = self.factory.create_api_key(object=dashboard)
+
+        rv = self.make_request(
+            "post",
+            "/api/dashboards/{}/results?api_key={}".format(dashboard.id, api_key.api_key),
+            data={},
+            user=False,
+        )
+
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(widget.id, rv.json["results"][0]["widget_id"])
+        self.assertIn("job", rv.json["results"][0])
+
+    def test_streams_results(self):
+        dashboard = self.factory.create_dashboard()
+        query = self.factory.create_query(query_text="SELECT 1")
+        self.factory.create_query_result()
+        widget = self.factory.create_widget(
+            dashboard=dashboard, visualization=self.factory.create_visualization(query=query)
+        )
+
+        rv = self.make_request("post", "/api/dashboards/{}/results?stream".format(dashboard.id), data={})
+
+        self.assertEqual(rv.status_code, 200)
+        lines = [json_loads(line) for line in rv.data.decode().splitlines()]
+        self.assertEqual([widget.id], [line["widget_id"] for line in lines])
+        self.assertIn("query_result", lines[0])
+
+    def test_streams_jobs_without_waiting_when_streams_are_capped(self):
+        dashboard = self.factory.create_dashboard()
+        query = self.factory.create_query(query_text="SELECT 2")
+        widget = self.factory.create_widget(
+            dashboard=dashboard, visualization=self.factory.create_visualization(query=query)
+        )
+
+        with mock.patch("redash.settings.DASHBOARD_RESULTS_MAX_STREAMS", 0), mock.patch(
+            "redash.handlers.query_results.Job.fetch_many"
+        ) as fetch_many:
+            rv = self.make_request("post", "/api/dashboards/{}/results?stream".format(dashboard.id), data={})
+
+        lines = [json_loads(line) for line in rv.data.decode().splitlines()]
+        self.assertEqual([widget.id], [line["widget_id"] for line in lines])
+        self.assertIn("job", lines[0])
+        fetch_many.assert_not_called()
+        self.assertEqual(0, redis_connection.zcard(DASHBOARD_RESULTS_STREAMS_KEY))
@@ -3,7 +3,15 @@ from mock import patch
 from sqlalchemy import func
 from sqlalchemy.sql.expression import select
 
-from redash.models import DataSource, Query, QueryResult, db
+from redash.models import (
+    DataSource,
+    Query,
+    QueryResult,
+    db,
+    schema_changes,
+    schema_index,
+    table_stats,
+)
 from redash.utils.configuration import ConfigurationContainer
 from tests import BaseTestCase
 
@@ -43,6 +51,16 @@ class DataSourceTest(BaseTestCase):
             self.assertEqual(new_return_value, schema)
             self.assertEqual(patched_get_schema.call_count, 2)
 
+    def test_indexes_empty_schema_once(self):
+        with mock.patch("redash.query_runner.pg.PostgreSQL.get_schema", return_value=[]):
+            self.factory.data_source.get_schema()
+
+        with patch.object(schema_index, "update") as update:
+            self.assertIs(schema_index, self.factory.data_source.get_schema_index())
+
+        update.assert_not_called()
+        self.assertEqual((0, []), schema_index.search(self.factory.data_source.id, "orders"))
+
     def test_schema_sorter(self):
         input_data = [
             {"name": "zoo", "columns": ["is_zebra", "is_snake", "is_cow"], "description": None},
@@ -104,6 +122,105 @@ class DataSourceTest(BaseTestCase):
         mock_redis.assert_called_with("data_source:schema:1", "null", ex=expected_ttl)
 
 
+@patch("redash.settings.SCHEMA_INCREMENTAL_REFRESH_ENABLED", True)
+class DataSourceIncrementalSchemaTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tables = {
+            "a": {"name": "a", "columns": ["id"], "description": None},
+            "b": {"name": "b", "columns": ["id"], "description": None},
+            "c": {"name": "c", "columns": ["id"], "description": None},
+        }
+        self.fingerprints = {"a": "1", "b": "1", "c": "1"}
+
+        runner = "redash.query_runner.pg.PostgreSQL"
+        patchers = [
+            patch(runner + ".get_schema", side_effect=lambda: list(self.tables.values())),
+            patch(runner + ".get_table_fingerprints", side_effect=lambda: dict(self.fingerprints)),
+            patch(
+                runner + ".get_tables_schema",
+                side_effect=lambda names: [self.tables[n] for n in names if n in self.tables],
+            ),
+        ]
+        self.get_schema, _, self.get_tables_schema = [p.start() for p in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def test_fetches_only_changed_tables(self):
+        data_source = self.factory.data_source
+        data_source.get_schema(refresh=True)
+        self.assertEqual(1, self.get_schema.call_count)
+
+        self.tables["b"] = {"name": "b", "columns": ["id", "name"], "description": None}
+        self.fingerprints["b"] = "2"
+        del self.fingerprints["c"]
+        schema = data_source.get_schema(refresh=True)
+
+        self.assertEqual(1, self.get_schema.call_count)
+        self.get_tables_schema.assert_called_once_with(["b"])
+        self.assertEqual([self.tables["a"], self.tables["b"]], schema)
+        self.assertEqual(schema, data_source.get_cached_schema())
+
+    def test_records_changes(self):
+        data_source = self.factory.data_source
+        data_source.get_schema(refresh=True)
+        version = schema_changes.version(data_source.id)
+
+        self.tables["b"] = {"name": "b", "columns": ["id", "name"], "description": None}
+        self.fingerprints["b"] = "2"
+        del self.fingerprints["c"]
+        data_source.get_schema(refresh=True)
+
+        changes = schema_changes.since(data_source.id, version)
+        self.assertEqual(1, len(changes))
+        self.assertEqual([], changes[0]["added"])
+        self.assertEqual([self.tables["b"]], changes[0]["updated"])
+        self.assertEqual(["c"], changes[0]["removed"])
+
+        self.assertEqual([], schema_changes.since(data_source.id, version + 1))
+        self.assertIsNone(schema_changes.since(data_source.id, version - 1))
+
+
+@patch("redash.settings.SCHEMA_RUN_TABLE_SIZE_CALCULATIONS", True)
+class DataSourceTableStatsTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        schema = [{"name": name, "columns": ["id"], "description": None} for name in ("a", "b", "c")]
+        with patch("redash.query_runner.pg.PostgreSQL.get_schema", return_value=schema):
+            self.factory.data_source.get_schema(refresh=True)
+
+    def refresh(self, estimates, counts):
+        runner = "redash.query_runner.pg.PostgreSQL"
+        with patch(runner + ".get_table_row_estimates", return_value=estimates), patch(
+            runner + ".count_table_rows", side_effect=lambda names: {n: counts[n] for n in names if n in counts}
+        ) as count_table_rows:
+            self.factory.data_source.refresh_table_stats()
+
+        return count_table_rows
+
+    def test_counts_only_tables_without_estimates(self):
+        count_table_rows = self.refresh({"a": 100, "b": 200}, {"c": 3})
+
+        count_table_rows.assert_called_once_with(["c"])
+        sizes = {table["name"]: table["size"] for table in self.factory.data_source.get_cached_schema()}
+        self.assertEqual({"a": 100, "b": 200, "c": 3}, sizes)
+
+    def test_doesnt_count_tables_again_before_ttl(self):
+        self.refresh({"a": 100, "b": 200}, {"c": 3})
+        count_table_rows = self.refresh({"a": 100, "b": 200}, {"c": 4})
+
+        count_table_rows.assert_called_once_with([])
+        self.assertEqual(3, table_stats.get(self.factory.data_source.id, ["c"])["c"]["rows"])
+
+    @patch("redash.settings.SCHEMA_TABLE_STATS_MAX_COUNTS", 1)
+    def test_limits_counts_per_refresh(self):
+        count_table_rows = self.refresh({}, {"a": 1, "b": 2, "c": 3})
+        count_table_rows.assert_called_once_with(["a"])
+
+        count_table_rows = self.refresh({}, {"a": 1, "b": 2, "c": 3})
+        count_table_rows.assert_called_once_with(["b"])
+
+
 class TestDataSourceCreate(BaseTestCase):
     def test_adds_data_source_to_default_group(self):
         data_source = DataSource.create_with_group(
@@ -8,6 +8,7 @@ from redash.models.parameterized_query import (
     InvalidParameterError,
     ParameterizedQuery,
     QueryDetachedFromDataSourceError,
+    collect_parameter_metadata,
     dropdown_values,
 )
 
@@ -37,6 +38,24 @@ class TestParameterizedQuery(TestCase):
         ).apply({"param": "value", "table": "value"})
         self.assertEqual(set(["test", "nested_param"]), query.missing_params)
 
+    def test_uses_known_parameter_names(self):
+        query = ParameterizedQuery("SELECT {{param}}", parameter_names=["param", "other"]).apply({"param": 1})
+        self.assertEqual(set(["other"]), query.missing_params)
+
+    def test_parameter_metadata(self):
+        schema = [{"name": "param", "type": "number"}, {"name": "table", "type": "text"}]
+        metadata = collect_parameter_metadata("SELECT {{param}} FROM {{table}}", schema)
+
+        self.assertEqual(["param", "table"], metadata["names"])
+        self.assertEqual({"param": "number", "table": "text"}, metadata["types"])
+        self.assertFalse(metadata["is_safe"])
+
+    def test_parameter_metadata_of_unparsable_query(self):
+        metadata = collect_parameter_metadata("SELECT {{#section}} {{/other}}", [])
+
+        self.assertIsNone(metadata["names"])
+        self.assertTrue(metadata["is_safe"])
+
     def test_handles_objects(self):
         query = ParameterizedQuery(
             "SELECT * FROM USERS WHERE created_at between '{{ created_at.start }}' and '{{ created_at.end }}'"
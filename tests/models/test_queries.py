@@ -1,8 +1,9 @@
 import datetime
 
 import pytest
+from sqlalchemy.sql.expression import update
 
-from redash.models import Event, Group, Query, QueryResult, db
+from redash.models import Event, Group, Query, QueryResult, db, recent_queries
 from redash.utils import gen_query_hash, utcnow
 from tests import BaseTestCase
 
@@ -65,6 +66,32 @@ class QueryTest(BaseTestCase):
         self.assertIn(q2, queries)
         self.assertNotIn(q3, queries)
 
+    def test_multi_byte_search_finds_substrings_regardless_of_case(self):
+        q1 = self.factory.create_query(name="Quarterly revenue")
+        q2 = self.factory.create_query(name="Other", description="Revenue by quarter")
+        q3 = self.factory.create_query(name="Monthly revenue")
+
+        queries = db.session.scalars(
+            Query.search("ERLY REV", [self.factory.default_group.id], multi_byte_search=True)
+        ).all()
+
+        self.assertIn(q1, queries)
+        self.assertNotIn(q2, queries)
+        self.assertNotIn(q3, queries)
+
+    def test_multi_byte_search_ranks_name_matches_first(self):
+        # Created after the description matches, so ordering by ID alone would rank it last
+        q1 = self.factory.create_query(name="Other", description="Revenue report")
+        q2 = self.factory.create_query(name="Another", description="Monthly revenue")
+        q3 = self.factory.create_query(name="Revenue report")
+
+        queries = db.session.scalars(
+            Query.search("revenue", [self.factory.default_group.id], multi_byte_search=True)
+        ).all()
+
+        self.assertEqual(q3, queries[0])
+        self.assertCountEqual([q1, q2], queries[1:])
+
     def test_search_by_id_returns_query(self):
         q1 = self.factory.create_query(description="Testing search")
         q2 = self.factory.create_query(description="Testing searching")
@@ -235,6 +262,23 @@ class QueryTest(BaseTestCase):
 
 
 class QueryRecentTest(BaseTestCase):
+    def record_events(self):
+        db.session.flush()
+        recent_queries.backfill()
+
+    def record_edit(self, query, user=None, org=None, created_at=None):
+        event = Event(
+            org=org or self.factory.org,
+            user=user or self.factory.user,
+            action="edit",
+            object_type="query",
+            object_id=query.id,
+            created_at=created_at or utcnow(),
+        )
+        db.session.add(event)
+        db.session.flush()
+        recent_queries.record_events([event])
+
     def test_global_recent(self):
         q1 = self.factory.create_query()
         q2 = self.factory.create_query()
@@ -247,6 +291,7 @@ class QueryRecentTest(BaseTestCase):
             object_id=q1.id,
         )
         db.session.add(e)
+        self.record_events()
         recent = Query.recent([self.factory.default_group.id])
         self.assertIn(q1, recent)
         self.assertNotIn(q2, recent)
@@ -273,6 +318,7 @@ class QueryRecentTest(BaseTestCase):
                 ),
             ]
         )
+        self.record_events()
         recent = Query.recent([self.factory.default_group.id])
 
         self.assertIn(q1, recent)
@@ -290,6 +336,7 @@ class QueryRecentTest(BaseTestCase):
             object_id=q1.id,
         )
         db.session.add(e)
+        self.record_events()
         recent = Query.recent([self.factory.default_group.id], user_id=self.factory.user.id)
 
         self.assertIn(q1, recent)
@@ -321,13 +368,60 @@ class QueryRecentTest(BaseTestCase):
                 ),
             ]
         )
-        db.session.flush()
+        self.record_events()
 
         recent = Query.recent([self.factory.default_group.id])
 
         self.assertIn(q1, recent)
         self.assertNotIn(q2, recent)
 
+    def test_orders_by_number_of_edits_and_skips_old_edits(self):
+        q1 = self.factory.create_query()
+        q2 = self.factory.create_query()
+        q3 = self.factory.create_query()
+        for _ in range(3):
+            self.record_edit(q1, created_at=utcnow() - datetime.timedelta(hours=2))
+        self.record_edit(q2, created_at=utcnow() - datetime.timedelta(hours=1))
+        for _ in range(5):
+            self.record_edit(q3, created_at=utcnow() - datetime.timedelta(days=30))
+
+        self.assertEqual([q1, q2], Query.recent([self.factory.default_group.id]))
+        self.assertEqual([q1], Query.recent([self.factory.default_group.id], limit=1))
+
+    def test_older_edits_count_less(self):
+        q1 = self.factory.create_query()
+        q2 = self.factory.create_query()
+        self.record_edit(q1)
+        self.record_edit(q2, created_at=utcnow() - datetime.timedelta(days=5))
+
+        self.assertEqual([q1, q2], Query.recent([self.factory.default_group.id]))
+
+    def test_recent_by_organization(self):
+        q1 = self.factory.create_query()
+        other_org = self.factory.create_org()
+        self.record_edit(q1, org=other_org, user=self.factory.create_user(org=other_org))
+
+        self.assertEqual([], recent_queries.get(self.factory.org.id))
+        self.assertEqual([q1.id], recent_queries.get(other_org.id))
+
+    def test_backfills_from_events(self):
+        q1 = self.factory.create_query()
+        db.session.add(
+            Event(
+                org=self.factory.org,
+                user=self.factory.user,
+                action="edit",
+                object_type="query",
+                object_id=q1.id,
+                created_at=utcnow(),
+            )
+        )
+        db.session.flush()
+
+        self.assertEqual(1, recent_queries.backfill())
+        self.assertEqual(1, recent_queries.backfill())
+        self.assertEqual([q1], Query.recent([self.factory.default_group.id], user_id=self.factory.user.id))
+
 
 class TestQueryByUser(BaseTestCase):
     def test_returns_only_users_queries(self):
@@ -533,3 +627,38 @@ class TestQueryUpdateLatestResult(BaseTestCase):
         self.assertEqual(query1.latest_query_data, query_result)
         self.assertEqual(query2.latest_query_data, query_result)
         self.assertNotEqual(query3.latest_query_data, query_result)
+
+
+class TestQueryParameterMetadata(BaseTestCase):
+    def test_computed_on_save(self):
+        query = self.factory.create_query(
+            query_text="SELECT {{param}}", options={"parameters": [{"name": "param", "type": "number"}]}
+        )
+
+        self.assertEqual(["param"], query.parameter_metadata["names"])
+        self.assertTrue(query.is_safe)
+
+    def test_updated_when_parameters_change(self):
+        query = self.factory.create_query(query_text="SELECT 1")
+
+        query.query_text = "SELECT {{param}}"
+        query.options = {"parameters": [{"name": "param", "type": "text"}]}
+        self.assertIsNone(query.parameter_metadata)
+        db.session.commit()
+
+        self.assertEqual(["param"], query.parameter_metadata["names"])
+        self.assertFalse(query.is_safe)
+
+    def test_backfill(self):
+        query = self.factory.create_query(
+            query_text="SELECT {{param}}", options={"parameters": [{"name": "param", "type": "text"}]}
+        )
+        db.session.execute(update(Query).values(parameter_metadata=None))
+        db.session.commit()
+        updated_at = query.updated_at
+
+        self.assertEqual(1, Query.backfill_parameter_metadata(batch_size=1))
+
+        db.session.refresh(query)
+        self.assertFalse(query.parameter_metadata["is_safe"])
+        self.assertEqual(updated_at, query.updated_at)
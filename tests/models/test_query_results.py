@@ -1,5 +1,9 @@
 import datetime
 
+from mock import patch
+from sqlalchemy import func
+from sqlalchemy.sql.expression import select
+
 from redash import models
 from redash.utils import utcnow
 from tests import BaseTestCase
@@ -73,3 +77,49 @@ class QueryResultTest(BaseTestCase):
         )
 
         self.assertEqual(original_updated_at, query.updated_at)
+
+
+class QueryRuntimeStatsTest(BaseTestCase):
+    def record(self, runtime, **kwargs):
+        return models.QueryRuntimeStats.record_run(
+            self.factory.org.id, self.factory.data_source.id, "abc", runtime, **kwargs
+        )
+
+    def test_creates_stats_on_first_run(self):
+        stats = self.record(3.0, row_count=10, result_bytes=100)
+
+        self.assertEqual(1, stats.run_count)
+        self.assertEqual(0, stats.failure_count)
+        self.assertEqual(3.0, stats.p50_runtime)
+        self.assertEqual(10, stats.last_row_count)
+        self.assertEqual(100, stats.last_result_bytes)
+
+    def test_updates_stats_incrementally(self):
+        for runtime in range(1, 11):
+            self.record(float(runtime))
+        stats = self.record(30.0, failed=True)
+
+        self.assertEqual(11, stats.run_count)
+        self.assertEqual(1, stats.failure_count)
+        self.assertEqual(85.0, stats.total_runtime)
+        self.assertEqual(6.0, stats.p50_runtime)
+        self.assertEqual(30.0, stats.p95_runtime)
+        self.assertEqual(1, models.db.session.scalar(select(func.count(models.QueryRuntimeStats.id))))
+
+    def test_keeps_last_runs_only(self):
+        with patch("redash.settings.QUERY_RUNTIME_STATS_HISTORY", 3):
+            for runtime in [100.0, 1.0, 2.0, 3.0]:
+                stats = self.record(runtime)
+
+        self.assertEqual([1.0, 2.0, 3.0], [run["runtime"] for run in stats.recent_runs])
+        self.assertEqual(3.0, stats.p95_runtime)
+        self.assertEqual(106.0, stats.total_runtime)
+
+    def test_top_by_total_runtime(self):
+        self.record(1.0)
+        other = models.QueryRuntimeStats.record_run(self.factory.org.id, self.factory.data_source.id, "def", 5.0)
+
+        self.assertEqual(
+            [other.query_hash, "abc"],
+            [s.query_hash for s in models.QueryRuntimeStats.top_by_total_runtime(self.factory.org)],
+        )
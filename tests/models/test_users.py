@@ -101,9 +101,25 @@ class TestUserDetail(BaseTestCase):
             timestamp = dt_from_timestamp(redis_connection.hget(LAST_ACTIVE_KEY, user.id))
             sync_last_active_at()
 
+            db.session.expire_all()
             user_reloaded = db.session.scalar(select(User).where(User.id == user.id))
             self.assertIn("active_at", user_reloaded.details)
-            self.assertEqual(user_reloaded.active_at, timestamp)
+            self.assertEqual(timestamp, db.session.scalar(select(User.active_at).where(User.id == user.id)))
+
+    def test_sync_updates_every_user_at_once(self):
+        users = [self.factory.create_user(details={"test": 1}) for _ in range(3)]
+        db.session.commit()
+        redis_connection.hset(LAST_ACTIVE_KEY, mapping={user.id: 1700000000 + user.id for user in users})
+        redis_connection.hset(LAST_ACTIVE_KEY, -1, 1700000000)
+
+        self.assertEqual(4, sync_last_active_at())
+
+        self.assertFalse(redis_connection.exists(LAST_ACTIVE_KEY))
+        db.session.expire_all()
+        for user in users:
+            active_at = db.session.scalar(select(User.active_at).where(User.id == user.id))
+            self.assertEqual(dt_from_timestamp(1700000000 + user.id), active_at)
+            self.assertEqual(1, user.details["test"])
 
 
 class TestUserGetActualUser(BaseTestCase):
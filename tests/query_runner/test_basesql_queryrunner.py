@@ -1,5 +1,8 @@
+import threading
 import unittest
 
+from mock import patch
+
 from redash.query_runner import BaseQueryRunner, BaseSQLQueryRunner
 from redash.utils import gen_query_hash
 
@@ -130,5 +133,46 @@ class TestBaseSQLQueryRunner(unittest.TestCase):
         self.assertEqual(gen_query_hash(origin_query_text), base_runner.gen_query_hash(origin_query_text, True))
 
 
+class TestCountTableRows(unittest.TestCase):
+    def setUp(self):
+        self.query_runner = BaseSQLQueryRunner({})
+
+    def test_counts_rows_of_tables(self):
+        def count_rows(table_name):
+            if table_name == "broken":
+                raise Exception("permission denied")
+            return len(table_name)
+
+        with patch.object(self.query_runner, "_count_rows", side_effect=count_rows):
+            counts = self.query_runner.count_table_rows(["a", "bb", "broken"])
+
+        self.assertEqual({"a": 1, "bb": 2}, counts)
+
+    def test_skips_counts_while_slots_are_taken(self):
+        slots = threading.BoundedSemaphore(1)
+        # Held by a count that never returned
+        slots.acquire()
+
+        with patch("redash.query_runner._count_slots", slots), patch(
+            "redash.settings.SCHEMA_TABLE_STATS_TIMEOUT", 0
+        ), patch.object(self.query_runner, "_count_rows", return_value=5) as count_rows:
+            counts = self.query_runner.count_table_rows(["a", "b"])
+
+        self.assertEqual({}, counts)
+        count_rows.assert_not_called()
+
+    def test_prefers_estimates(self):
+        tables = {"a": {"name": "a"}, "b": {"name": "b"}}
+
+        with patch("redash.settings.SCHEMA_RUN_TABLE_SIZE_CALCULATIONS", True), patch.object(
+            self.query_runner, "get_table_row_estimates", return_value={"a": 1000}
+        ), patch.object(self.query_runner, "_count_rows", return_value=5) as count_rows:
+            self.query_runner._get_tables_stats(tables)
+
+        count_rows.assert_called_once_with("b")
+        self.assertEqual(1000, tables["a"]["size"])
+        self.assertEqual(5, tables["b"]["size"])
+
+
 if __name__ == "__main__":
     unittest.main()
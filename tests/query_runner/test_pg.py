@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from redash.query_runner.pg import build_schema
+from redash.query_runner.pg import build_schema, table_relations
 
 
 class TestBuildSchema(TestCase):
@@ -25,3 +25,24 @@ class TestBuildSchema(TestCase):
         self.assertListEqual(schema["main.users"]["columns"], ["id", "name"])
         self.assertIn('public."main.users"', schema.keys())
         self.assertListEqual(schema['public."main.users"']["columns"], ["id"])
+
+
+class TestTableRelations(TestCase):
+    def test_includes_conflicting_tables(self):
+        relations = table_relations(["users", "main.users", 'public."main.users"'])
+
+        self.assertIn(("public", "users"), relations)
+        self.assertIn(("main", "users"), relations)
+        self.assertIn(("public", "main.users"), relations)
+
+    def test_tables_are_named_as_in_the_whole_schema(self):
+        rows = [
+            {"table_schema": "public", "table_name": "main.users", "column_name": "id"},
+            {"table_schema": "main", "table_name": "users", "column_name": "id"},
+        ]
+        relations = table_relations(['public."main.users"'])
+
+        schema = {}
+        build_schema({"rows": [r for r in rows if (r["table_schema"], r["table_name"]) in relations]}, schema)
+
+        self.assertIn('public."main.users"', schema.keys())
@@ -1,24 +1,36 @@
 import datetime
 import decimal
+import os
 import sqlite3
+import tempfile
+import threading
+import uuid
 from unittest import TestCase
 
 import mock
 import pytest
 
+from redash.models import db
 from redash.query_runner.query_results import (
     CreateTableError,
     PermissionError,
+    Results,
+    _evict_cached_tables,
     _load_query,
     create_table,
+    create_tables_from_query_ids,
     extract_cached_query_ids,
     extract_query_ids,
     extract_query_params,
     fix_column_name,
     get_query_results,
     prepare_parameterized_query,
+    pushdown_filters,
+    referenced_columns,
+    release_cache_lease,
     replace_query_parameters,
 )
+from redash.utils.configuration import ConfigurationContainer
 from tests import BaseTestCase
 
 
@@ -142,6 +154,211 @@ class TestCreateTable(TestCase):
         create_table(connection, table_name, results)
         self.assertEqual(len(list(connection.execute("SELECT * FROM query_123"))), 2)
 
+    def test_creates_typed_columns(self):
+        connection = sqlite3.connect(":memory:")
+        results = {
+            "columns": [{"name": "test1", "type": "integer"}, {"name": "test2", "type": "string"}, {"name": "test3"}],
+            "rows": [{"test1": "1", "test2": 2, "test3": "3"}],
+        }
+        create_table(connection, "query_123", results)
+        self.assertEqual(
+            [("integer", "text", "text")],
+            list(connection.execute("SELECT typeof(test1), typeof(test2), typeof(test3) FROM query_123")),
+        )
+
+
+class TestCreateCachedTables(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_path = os.path.join(tempfile.mkdtemp(), "cache.db")
+        patcher = mock.patch("redash.settings.QUERY_RESULTS_RUNNER_CACHE_PATH", self.cache_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_query(self, rows):
+        query_result = self.factory.create_query_result(data={"columns": [{"name": "a"}], "rows": rows})
+        return self.factory.create_query(latest_query_data=query_result)
+
+    def load(self, *query_ids, release=True):
+        connection = sqlite3.connect("file::memory:", uri=True)
+        lease = uuid.uuid4().hex
+        with mock.patch("redash.query_runner.query_results.create_table", wraps=create_table) as create_table_mock:
+            create_tables_from_query_ids(self.factory.user, connection, [], [], list(query_ids), lease=lease)
+        if release:
+            release_cache_lease(lease)
+        return connection, create_table_mock.call_count
+
+    def test_loads_table_only_when_result_changes(self):
+        query = self.create_query([{"a": 1}, {"a": 2}])
+
+        connection, loads = self.load(query.id)
+        self.assertEqual(1, loads)
+        self.assertEqual([(2,)], list(connection.execute("SELECT count(*) FROM cached_query_{}".format(query.id))))
+
+        _, loads = self.load(query.id)
+        self.assertEqual(0, loads)
+
+        query.latest_query_data = self.factory.create_query_result(data={"columns": [{"name": "a"}], "rows": []})
+        connection, loads = self.load(query.id)
+        self.assertEqual(1, loads)
+        self.assertEqual([(0,)], list(connection.execute("SELECT count(*) FROM cached_query_{}".format(query.id))))
+
+    def test_copies_tables_without_attaching_cache(self):
+        query = self.create_query([{"a": 1}])
+        connection, _ = self.load(query.id)
+
+        self.assertEqual(["main"], [name for (_, name, _) in connection.execute("PRAGMA database_list")])
+        connection.execute("DROP TABLE cached_query_{}".format(query.id))
+        _, loads = self.load(query.id)
+        self.assertEqual(0, loads)
+
+    def test_queries_only_read_the_tables_the_user_may_access(self):
+        group = self.factory.create_group()
+        allowed = self.factory.create_query(
+            data_source=self.factory.create_data_source(group=group),
+            latest_query_data=self.factory.create_query_result(data={"columns": [{"name": "a"}], "rows": [{"a": 1}]}),
+        )
+        secret = self.create_query([{"a": "secret"}])
+        # Loaded into the cache by a user who may access it
+        self.load(secret.id)
+        user = self.factory.create_user(group_ids=[group.id])
+
+        for query in (
+            "SELECT * FROM cached_query_{} AS a, cached_query_{}",
+            "SELECT * FROM cached_query_{} JOIN cache.cached_query_{}",
+            'SELECT * FROM cached_query_{} JOIN "cached_query_{}"',
+        ):
+            with pytest.raises(sqlite3.OperationalError):
+                Results({}).run_query(query.format(allowed.id, secret.id), user)
+
+        with pytest.raises(sqlite3.DatabaseError):
+            Results({}).run_query("ATTACH DATABASE 'file:{}?mode=ro' AS c".format(self.cache_path), user)
+
+    def test_evicts_least_recently_used_tables(self):
+        queries = [self.create_query([{"a": 1}]) for _ in range(3)]
+
+        with mock.patch("redash.settings.QUERY_RESULTS_RUNNER_CACHE_MAX_TABLES", 2):
+            for query in queries:
+                self.load(query.id)
+
+        cache = sqlite3.connect(self.cache_path)
+        self.assertEqual(
+            {"cached_query_{}".format(q.id) for q in queries[1:]},
+            {name for (name,) in cache.execute("SELECT table_name FROM cache_entries")},
+        )
+
+    def test_keeps_tables_in_use(self):
+        queries = [self.create_query([{"a": 1}]) for _ in range(3)]
+
+        with mock.patch("redash.settings.QUERY_RESULTS_RUNNER_CACHE_MAX_TABLES", 1):
+            connection, _ = self.load(queries[0].id, release=False)
+            for query in queries[1:]:
+                self.load(query.id)
+
+        self.assertEqual(
+            [(1,)], list(connection.execute("SELECT count(*) FROM cached_query_{}".format(queries[0].id)))
+        )
+        cache = sqlite3.connect(self.cache_path)
+        self.assertEqual(
+            {"cached_query_{}".format(queries[0].id), "cached_query_{}".format(queries[2].id)},
+            {name for (name,) in cache.execute("SELECT table_name FROM cache_entries")},
+        )
+
+    def test_eviction_is_best_effort(self):
+        cache = mock.Mock()
+        cache.execute.side_effect = sqlite3.OperationalError("database is locked")
+
+        _evict_cached_tables(cache)
+
+        cache.rollback.assert_called_once_with()
+
+
+class TestReferencedColumns(TestCase):
+    def test_keeps_all_columns_for_select_star(self):
+        self.assertIsNone(referenced_columns("SELECT * FROM query_1"))
+        self.assertIsNone(referenced_columns("SELECT a.* FROM query_1 a"))
+
+    def test_finds_referenced_columns(self):
+        is_referenced = referenced_columns('SELECT count(*), a FROM query_1 GROUP BY "two words"')
+        self.assertTrue(is_referenced("a"))
+        self.assertTrue(is_referenced("two words"))
+        self.assertFalse(is_referenced("other"))
+
+
+class TestPushdownFilters(TestCase):
+    def test_extracts_simple_conjunctions(self):
+        query = "SELECT a FROM query_1 WHERE b = 'x' AND c >= 10 ORDER BY a"
+        self.assertEqual([("b", "=", "x"), ("c", ">=", 10.0)], pushdown_filters(query))
+
+    def test_ignores_complex_queries(self):
+        self.assertEqual([], pushdown_filters("SELECT a FROM query_1 WHERE b = 'x' OR c = 1"))
+        self.assertEqual([], pushdown_filters("SELECT a FROM query_1 JOIN query_2 ON a = d WHERE b = 'x'"))
+        self.assertEqual([], pushdown_filters("SELECT a FROM query_1 WHERE b IN (SELECT b FROM query_1)"))
+        self.assertEqual([], pushdown_filters("SELECT a FROM query_1 WHERE lower(b) = 'x'"))
+
+    def test_loads_only_matching_rows_and_columns(self):
+        connection = sqlite3.connect(":memory:")
+        query = "SELECT a FROM query_1 WHERE b = 'x' AND a > 1"
+        results = {
+            "columns": [{"name": "a", "type": "integer"}, {"name": "b", "type": "string"}, {"name": "c"}],
+            "rows": [{"a": 1, "b": "x", "c": 1}, {"a": 2, "b": "x", "c": 2}, {"a": 3, "b": "y", "c": 3}, {"a": 4}],
+        }
+        create_table(connection, "query_1", results, referenced_columns(query), pushdown_filters(query))
+
+        self.assertEqual([(2, "x")], list(connection.execute("SELECT * FROM query_1")))
+
+
+class TestCreateTablesFromQueryIds(BaseTestCase):
+    def test_fetches_upstream_queries_concurrently(self):
+        queries = [self.factory.create_query(query_text="SELECT {}".format(i)) for i in range(3)]
+        barrier = threading.Barrier(3, timeout=5)
+
+        def run_query(query_text, user):
+            # Only passes if all three queries run at the same time
+            barrier.wait()
+            return {"columns": [{"name": "a"}, {"name": "b"}], "rows": [{"a": query_text, "b": 1}]}, None
+
+        from redash.query_runner.pg import PostgreSQL
+
+        connection = sqlite3.connect(":memory:")
+        query = " UNION ALL ".join("SELECT a FROM query_{}".format(q.id) for q in queries)
+        with mock.patch.object(PostgreSQL, "run_query", side_effect=run_query):
+            create_tables_from_query_ids(self.factory.user, connection, [q.id for q in queries], [], [], query)
+
+        self.assertEqual(["SELECT 0", "SELECT 1", "SELECT 2"], sorted(row[0] for row in connection.execute(query)))
+        with pytest.raises(sqlite3.OperationalError):
+            connection.execute("SELECT b FROM query_{}".format(queries[0].id))
+
+    def test_runs_upstream_queries_that_use_the_database(self):
+        from redash.query_runner.python import Python
+
+        source = self.factory.create_query(
+            latest_query_data=self.factory.create_query_result(data={"columns": [{"name": "a"}], "rows": [{"a": 1}]})
+        )
+        data_source = self.factory.create_data_source(
+            type="python", options=ConfigurationContainer.from_json("{}"), group=self.factory.default_group
+        )
+        query = self.factory.create_query(
+            data_source=data_source,
+            query_text="\n".join(
+                [
+                    "rows = get_query_result({})['rows']".format(source.id),
+                    "user = get_current_user()",
+                    "result = {'columns': [{'name': 'a'}], 'rows': rows + [{'a': user['id']}]}",
+                ]
+            ),
+        )
+        # The upstream query runs on another thread, with its own session
+        db.session.commit()
+
+        connection = sqlite3.connect(":memory:")
+        with mock.patch.dict("redash.query_runner.query_runners", {"python": Python}):
+            create_tables_from_query_ids(self.factory.user, connection, [query.id], [], [])
+
+        self.assertEqual(
+            [(1,), (self.factory.user.id,)], list(connection.execute("SELECT a FROM query_{}".format(query.id)))
+        )
+
 
 class TestGetQuery(BaseTestCase):
     # test query from different account
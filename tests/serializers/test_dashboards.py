@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from redash.models import Dashboard, User, db
+from redash.serializers import serialize_dashboard
+from tests import BaseTestCase
+
+# Statements serializing a dashboard with its widgets may issue, whatever the number of widgets
+STATEMENTS_BUDGET = 10
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+class DashboardSerializationTest(BaseTestCase):
+    def create_dashboard(self, widgets_count):
+        dashboard = self.factory.create_dashboard()
+        restricted_ds = self.factory.create_data_source(group=self.factory.create_group())
+        for i in range(widgets_count):
+            query = self.factory.create_query(
+                user=self.factory.create_user(email="user{}@example.com".format(i)),
+                data_source=restricted_ds if i % 3 == 0 else self.factory.create_data_source(),
+            )
+            self.factory.create_widget(
+                dashboard=dashboard, visualization=self.factory.create_visualization(query=query)
+            )
+        self.factory.create_widget(dashboard=dashboard, visualization=None, text="text")
+        db.session.commit()
+
+        return dashboard.id
+
+    def serialize(self, dashboard_id):
+        user_id = self.factory.user.id
+        db.session.expunge_all()
+        dashboard = db.session.get(Dashboard, dashboard_id)
+        user = db.session.get(User, user_id)
+
+        with count_statements() as statements:
+            serialized = serialize_dashboard(dashboard, with_widgets=True, user=user)
+
+        return serialized, statements
+
+    def test_issues_a_fixed_number_of_statements(self):
+        serialized, statements = self.serialize(self.create_dashboard(30))
+
+        self.assertEqual(31, len(serialized["widgets"]))
+        self.assertLessEqual(len(statements), STATEMENTS_BUDGET, "\n".join(statements))
+
+    def test_restricts_widgets_of_inaccessible_data_sources(self):
+        serialized, _ = self.serialize(self.create_dashboard(3))
+
+        restricted, allowed, _, text = serialized["widgets"]
+        self.assertTrue(restricted["restricted"])
+        self.assertNotIn("visualization", restricted)
+        self.assertEqual("user1@example.com", allowed["visualization"]["query"]["user"]["email"])
+        self.assertEqual("text", text["text"])
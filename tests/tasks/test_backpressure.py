@@ -0,0 +1,81 @@
+from mock import Mock, patch
+from rq.job import JobStatus
+
+from redash import redis_connection
+from redash.models import Query
+from redash.tasks.queries import backpressure
+from redash.tasks.queries.maintenance import refresh_queries
+from tests import BaseTestCase
+
+ENQUEUE_QUERY = "redash.tasks.queries.maintenance.enqueue_query"
+PENDING_JOBS = "redash.tasks.queries.backpressure.pending_jobs"
+QUEUE_BACKLOG = "redash.tasks.queries.backpressure.queue_backlog"
+
+
+def pending_job(status=JobStatus.QUEUED):
+    return Mock(get_status=Mock(return_value=status))
+
+
+@patch("redash.settings.SCHEDULED_QUEUE_BACKPRESSURE_ENABLED", True)
+class TestBackpressure(BaseTestCase):
+    def refresh(self, queries, pending=None, backlog=(0, None)):
+        pending = pending or {}
+        oq = staticmethod(lambda: queries)
+        with patch(ENQUEUE_QUERY) as enqueue_query, patch.object(Query, "outdated_queries", oq), patch(
+            PENDING_JOBS, side_effect=lambda data_source_id: dict(pending.get(data_source_id, {}))
+        ), patch(QUEUE_BACKLOG, return_value=backlog):
+            enqueue_query.return_value = Mock(id="job-1")
+            refresh_queries()
+
+        return [c.kwargs["scheduled_query"] for c in enqueue_query.call_args_list]
+
+    def test_coalesces_refreshes_of_queries_with_pending_jobs(self):
+        query = self.factory.create_query()
+
+        enqueued = self.refresh([query], pending={query.data_source_id: {query.id: pending_job(JobStatus.STARTED)}})
+
+        self.assertEqual([], enqueued)
+        self.assertEqual("1", redis_connection.hget("redash:status", "coalesced_queries_count"))
+
+    def test_defers_data_sources_with_jobs_in_congested_queues(self):
+        query = self.factory.create_query()
+        other_query = self.factory.create_query(data_source=self.factory.create_data_source())
+        pending = {query.data_source_id: {self.factory.create_query().id: pending_job()}}
+
+        enqueued = self.refresh([query, other_query], pending=pending, backlog=(10000, 60))
+
+        self.assertEqual([other_query], enqueued)
+        self.assertEqual("1", redis_connection.hget("redash:status", "backpressure_deferred_count"))
+
+    def test_defers_data_sources_with_old_jobs(self):
+        query = self.factory.create_query()
+        pending = {query.data_source_id: {self.factory.create_query().id: pending_job()}}
+
+        self.assertEqual([], self.refresh([query], pending=pending, backlog=(1, 3600)))
+        self.assertEqual([query], self.refresh([query], pending=pending, backlog=(1, 60)))
+
+    @patch("redash.settings.SCHEDULED_QUEUE_MAX_DEPTH", 1)
+    def test_defers_data_sources_with_too_many_waiting_jobs(self):
+        query = self.factory.create_query()
+        pending = {query.data_source_id: {1000: pending_job(), 1001: pending_job()}}
+
+        self.assertEqual([], self.refresh([query], pending=pending))
+
+    def test_doesnt_defer_running_jobs(self):
+        query = self.factory.create_query()
+        pending = {query.data_source_id: {1000: pending_job(JobStatus.STARTED)}}
+
+        self.assertEqual([query], self.refresh([query], pending=pending, backlog=(10000, 3600)))
+
+    def test_tracks_enqueued_jobs(self):
+        query = self.factory.create_query()
+
+        self.refresh([query])
+
+        self.assertEqual("job-1", redis_connection.hget("sq:pending:{}".format(query.data_source_id), query.id))
+
+    def test_forgets_finished_jobs(self):
+        redis_connection.hset("sq:pending:1", 1, "missing-job")
+
+        self.assertEqual({}, backpressure.pending_jobs(1))
+        self.assertFalse(redis_connection.exists("sq:pending:1"))
@@ -0,0 +1,55 @@
+import datetime
+
+from mock import patch
+
+from redash import models
+from redash.tasks.queries import demand
+from redash.utils import utcnow
+from tests import BaseTestCase
+
+
+@patch("redash.settings.DEMAND_SCHEDULING_ENABLED", True)
+class TestTrackAccess(BaseTestCase):
+    def test_maps_accesses_to_queries(self):
+        widget = self.factory.create_widget()
+        dashboard_query = widget.visualization.query
+        query = self.factory.create_query()
+        embedded = self.factory.create_visualization()
+        result = self.factory.create_query_result()
+        result_query = self.factory.create_query(latest_query_data=result)
+        now = utcnow()
+
+        accessed = demand.accessed_queries(
+            [
+                ("query", str(query.id), {}, now),
+                ("dashboard", str(widget.dashboard_id), {}, now),
+                ("visualization", str(embedded.id), {"query_id": str(embedded.query_rel.id)}, now),
+                ("query_result", str(result.id), {}, now),
+                ("data_source", "1", {"query_id": "1"}, now),
+            ]
+        )
+
+        self.assertEqual(
+            {query.id: now, dashboard_query.id: now, embedded.query_rel.id: now, result_query.id: now}, accessed
+        )
+
+    def test_resumes_idle_queries(self):
+        query = self.factory.create_query(
+            schedule={"interval": "3600", "time": None, "until": None, "day_of_week": None}
+        )
+        models.db.session.flush()
+        query.next_run_at = None
+        models.db.session.commit()
+
+        demand.track_access(models.Event(action="view", object_type="query", object_id=str(query.id)))
+
+        self.assertLessEqual(models.Query.get_by_id(query.id).next_run_at, utcnow())
+        self.assertIn(query.id, models.query_accesses.get([query.id]))
+
+    def test_doesnt_reschedule_active_queries(self):
+        query = self.factory.create_query(
+            schedule={"interval": "3600", "time": None, "until": None, "day_of_week": None}
+        )
+        models.query_accesses.update({query.id: utcnow() - datetime.timedelta(days=1)})
+
+        self.assertEqual([], demand.record_accesses({query.id: utcnow()}))
@@ -0,0 +1,113 @@
+from types import SimpleNamespace
+from unittest import TestCase
+
+from mock import patch
+
+from redash import models
+from redash.tasks.queries import backpressure, dependencies, smoothing
+from redash.tasks.queries.maintenance import refresh_downstream_queries, refresh_queries
+from tests import BaseTestCase
+
+ENQUEUE_QUERY = "redash.tasks.queries.maintenance.enqueue_query"
+
+
+class TestCyclicQueryIds(TestCase):
+    def test_finds_cycles(self):
+        graph = {1: {2}, 2: {3}, 3: {1}, 4: {1}, 5: {5}, 6: set()}
+        self.assertEqual({1, 2, 3, 5}, dependencies.cyclic_query_ids(graph))
+
+    def test_handles_long_chains(self):
+        graph = {i: {i + 1} for i in range(5000)}
+        self.assertEqual(set(), dependencies.cyclic_query_ids(graph))
+
+
+class TestTopologicalOrder(TestCase):
+    def test_orders_upstream_queries_first(self):
+        queries = [SimpleNamespace(id=i) for i in (3, 1, 2, 4)]
+        graph = {3: {2}, 2: {1}}
+
+        ordered = dependencies.topological_order(queries, graph)
+
+        self.assertEqual([1, 2, 3, 4], [q.id for q in ordered])
+
+
+@patch("redash.settings.SCHEDULED_QUERY_DEPENDENCIES_ENABLED", True)
+class TestDependencyAwareRefresh(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.results_data_source = self.factory.create_data_source(type="results")
+
+    def create_downstream_query(self, *upstream_queries):
+        query_text = " UNION ALL ".join("SELECT * FROM query_{}".format(q.id) for q in upstream_queries)
+        return self.factory.create_query(data_source=self.results_data_source, query_text=query_text)
+
+    def test_dependency_graph(self):
+        upstream = self.factory.create_query()
+        middle = self.create_downstream_query(upstream)
+        downstream = self.create_downstream_query(middle)
+        cyclic = self.factory.create_query(data_source=self.results_data_source, query_text="SELECT 1")
+        cyclic.query_text = "SELECT * FROM query_{}".format(cyclic.id)
+
+        graph = dependencies.dependency_graph([downstream, upstream, cyclic])
+
+        self.assertEqual({downstream.id: {middle.id}, middle.id: {upstream.id}, cyclic.id: set()}, graph)
+
+    def test_holds_back_downstream_queries_until_upstream_queries_land(self):
+        upstream = self.factory.create_query()
+        upstream2 = self.factory.create_query(query_text="SELECT 2")
+        downstream = self.create_downstream_query(upstream, upstream2)
+
+        oq = staticmethod(lambda: [downstream, upstream, upstream2])
+        with patch(ENQUEUE_QUERY) as enqueue_mock, patch.object(models.Query, "outdated_queries", oq):
+            refresh_queries()
+            self.assertEqual([upstream, upstream2], [c[1]["scheduled_query"] for c in enqueue_mock.call_args_list])
+
+            # Due again on the next run, but still waiting.
+            enqueue_mock.reset_mock()
+            refresh_queries()
+            self.assertNotIn(downstream, [c[1]["scheduled_query"] for c in enqueue_mock.call_args_list])
+
+        self.assertEqual([], dependencies.release([upstream.id]))
+        self.assertEqual([downstream.id], dependencies.release([upstream2.id]))
+        self.assertFalse(dependencies.is_waiting(downstream.id))
+
+    def test_runs_downstream_queries_when_upstream_queries_are_idle(self):
+        upstream = self.factory.create_query()
+        downstream = self.create_downstream_query(upstream)
+
+        oq = staticmethod(lambda: [downstream])
+        with patch(ENQUEUE_QUERY) as enqueue_mock, patch.object(models.Query, "outdated_queries", oq):
+            refresh_queries()
+
+        self.assertEqual(downstream, enqueue_mock.call_args[1]["scheduled_query"])
+
+    @patch("redash.settings.SCHEDULE_MAX_ENQUEUE_RATE", 1)
+    def test_refreshes_downstream_queries_within_the_enqueue_budget(self):
+        upstream = self.factory.create_query()
+        downstream = self.create_downstream_query(upstream)
+
+        oq = staticmethod(lambda query_ids=None: [downstream])
+        with patch(ENQUEUE_QUERY) as enqueue_mock, patch.object(models.Query, "outdated_queries", oq):
+            smoothing.save_budget(0)
+            refresh_downstream_queries([downstream.id])
+            enqueue_mock.assert_not_called()
+
+            smoothing.save_budget(1)
+            refresh_downstream_queries([downstream.id])
+
+        self.assertEqual(downstream, enqueue_mock.call_args[1]["scheduled_query"])
+        self.assertEqual(0, smoothing.take_budget(1))
+
+    @patch("redash.settings.SCHEDULED_QUEUE_BACKPRESSURE_ENABLED", True)
+    def test_holds_back_downstream_queries_under_backpressure(self):
+        upstream = self.factory.create_query()
+        downstream = self.create_downstream_query(upstream)
+
+        oq = staticmethod(lambda query_ids=None: [downstream])
+        with patch(ENQUEUE_QUERY) as enqueue_mock, patch.object(models.Query, "outdated_queries", oq), patch.object(
+            backpressure, "check", return_value=backpressure.DEFERRED
+        ), patch.object(backpressure, "hold") as hold:
+            refresh_downstream_queries([downstream.id])
+
+        enqueue_mock.assert_not_called()
+        hold.assert_called_once_with(downstream, backpressure.DEFERRED)
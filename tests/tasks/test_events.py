@@ -0,0 +1,204 @@
+import time
+from datetime import timedelta
+
+from mock import Mock, patch
+from sqlalchemy import func, select, text
+
+from redash import redis_connection
+from redash.models import Event, EventDailyCount, db
+from redash.tasks import events
+from redash.utils import utcnow
+from tests import BaseTestCase
+
+
+class TestBufferedEvents(BaseTestCase):
+    def raw_event(self, **kwargs):
+        raw_event = {
+            "org_id": self.factory.org.id,
+            "user_id": self.factory.user.id,
+            "action": "view",
+            "object_type": "query",
+            "object_id": "1",
+            "timestamp": int(time.time()),
+        }
+        raw_event.update(kwargs)
+        return raw_event
+
+    def events_count(self):
+        return db.session.scalar(select(func.count(Event.id)))
+
+    def test_inserts_buffered_events_when_flushed(self):
+        events.record_event(self.raw_event())
+        events.record_event(self.raw_event(action="edit", ip="127.0.0.1"))
+        self.assertEqual(0, self.events_count())
+
+        self.assertEqual(2, events.flush_events())
+
+        self.assertEqual(2, self.events_count())
+        self.assertEqual(0, redis_connection.llen(events.BUFFER_KEY))
+        event = db.session.scalars(select(Event).where(Event.action == "edit")).one()
+        self.assertEqual({"ip": "127.0.0.1"}, event.additional_properties)
+
+    @patch("redash.settings.EVENTS_FLUSH_SIZE", 2)
+    def test_enqueues_a_flush_every_flush_size_events(self):
+        with patch.object(events.flush_events, "delay") as delay:
+            for _ in range(5):
+                events.record_event(self.raw_event())
+
+        self.assertEqual(2, delay.call_count)
+
+    def test_drops_malformed_events(self):
+        malformed = self.raw_event()
+        del malformed["action"]
+        events.record_event(malformed)
+        events.record_event(self.raw_event())
+
+        self.assertEqual(1, events.flush_events())
+        self.assertEqual(0, redis_connection.llen(events.BUFFER_KEY))
+
+    def test_drops_events_that_cant_be_inserted(self):
+        events.record_event(self.raw_event(org_id=-1))
+        events.record_event(self.raw_event())
+        db.session.commit()
+
+        self.assertEqual(1, events.flush_events())
+        self.assertEqual(1, self.events_count())
+
+    def test_skips_events_a_dead_flush_inserted(self):
+        events.record_event(self.raw_event())
+        # A flush that died between committing its batch and emptying the processing list
+        raw_events, _ = events._take_batch()
+        events.insert_events(raw_events)
+        events.record_event(self.raw_event(action="edit"))
+
+        self.assertEqual(1, events.flush_events())
+
+        self.assertEqual(2, self.events_count())
+        self.assertEqual(0, redis_connection.llen(events.PROCESSING_KEY))
+
+    def test_retries_batches_of_dead_flushes(self):
+        events.record_event(self.raw_event())
+        # A flush that died before inserting its batch
+        events._take_batch()
+
+        self.assertEqual(1, events.flush_events())
+        self.assertEqual(1, self.events_count())
+
+    def test_delivers_events_after_releasing_the_lock(self):
+        events.record_event(self.raw_event())
+
+        def deliver_events(inserted):
+            self.assertEqual(1, len(inserted))
+            self.assertFalse(redis_connection.exists(events.FLUSH_LOCK_KEY))
+
+        with patch.object(events, "deliver_events", side_effect=deliver_events) as deliver:
+            events.flush_events()
+
+        deliver.assert_called_once()
+
+    @patch("redash.settings.EVENT_REPORTING_WEBHOOKS", ["https://example.com/events"])
+    @patch("redash.settings.EVENT_REPORTING_WEBHOOKS_BATCH_SIZE", 2)
+    def test_posts_events_to_webhooks_in_batches(self):
+        for _ in range(3):
+            events.record_event(self.raw_event())
+
+        session = Mock()
+        session.post.return_value = Mock(status_code=200)
+        with patch.object(events, "webhooks_session", return_value=session):
+            events.flush_events()
+
+        payloads = sorted((c.kwargs["json"] for c in session.post.call_args_list), key=lambda p: p["schema"])
+        self.assertEqual(events.EVENT_SCHEMA, payloads[0]["schema"])
+        self.assertEqual("view", payloads[0]["data"]["action"])
+        self.assertEqual(events.EVENTS_SCHEMA, payloads[1]["schema"])
+        self.assertEqual(2, len(payloads[1]["data"]))
+
+
+class TestMaintainEvents(BaseTestCase):
+    def create_event(self, created_at, action="view"):
+        event = Event(org=self.factory.org, action=action, object_type="query", object_id="1", created_at=created_at)
+        db.session.add(event)
+        db.session.commit()
+        return event
+
+    def test_creates_partitions_ahead(self):
+        events.maintain_events()
+
+        partitions = Event.partitions(db.session.connection())
+        month = utcnow()
+        for _ in range(4):
+            self.assertIn(Event.partition_name(month), partitions)
+            month = (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+    def test_leaves_months_the_default_partition_holds_events_of(self):
+        later = utcnow() + timedelta(days=365 * 2)
+        self.create_event(later)
+        month_after = (later.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+        skipped = Event.create_partitions(db.session.connection(), later, 1)
+
+        self.assertEqual([Event.partition_name(later)], skipped)
+        partitions = Event.partitions(db.session.connection())
+        self.assertNotIn(Event.partition_name(later), partitions)
+        self.assertIn(Event.partition_name(month_after), partitions)
+
+    @patch("redash.settings.EVENTS_RETENTION_DAYS", 30)
+    def test_drops_partitions_past_retention(self):
+        old = utcnow() - timedelta(days=100)
+        Event.create_partitions(db.session.connection(), old, 0)
+        self.create_event(old)
+        recent = self.create_event(utcnow())
+
+        events.maintain_events()
+
+        self.assertNotIn(Event.partition_name(old), Event.partitions(db.session.connection()))
+        self.assertEqual([recent.id], db.session.scalars(select(Event.id)).all())
+
+    def default_partition_ids(self):
+        return db.session.scalars(text("SELECT id FROM {} ORDER BY id".format(Event.DEFAULT_PARTITION))).all()
+
+    @patch("redash.settings.EVENTS_RETENTION_DAYS", 30)
+    def test_replaces_default_partition_past_retention(self):
+        # no monthly partition for these, like the events migrated into the default partition
+        self.create_event(utcnow() - timedelta(days=100))
+        self.create_event(utcnow() - timedelta(days=90))
+        recent = self.create_event(utcnow())
+
+        dropped = Event.drop_partitions(db.session.connection(), utcnow() - timedelta(days=30))
+        db.session.commit()
+
+        self.assertIn(Event.DEFAULT_PARTITION, dropped)
+        self.assertEqual([], self.default_partition_ids())
+        self.assertEqual([recent.id], db.session.scalars(select(Event.id)).all())
+        later = self.create_event(utcnow() + timedelta(days=365 * 2))
+        self.assertEqual([later.id], self.default_partition_ids())
+
+    @patch("redash.settings.EVENTS_RETENTION_DAYS", 30)
+    @patch("redash.settings.EVENTS_DELETE_BATCH_SIZE", 2)
+    def test_deletes_default_partition_events_past_retention_in_batches(self):
+        for days in range(100, 95, -1):
+            self.create_event(utcnow() - timedelta(days=days))
+        later = self.create_event(utcnow() + timedelta(days=365 * 2))
+
+        with patch.object(Event, "delete_expired", wraps=Event.delete_expired) as delete_expired:
+            events.maintain_events()
+
+        self.assertEqual(3, delete_expired.call_count)
+        self.assertEqual([later.id], self.default_partition_ids())
+
+    @patch("redash.settings.EVENTS_ROLLUP_ENABLED", True)
+    def test_counts_events_of_past_days(self):
+        yesterday = utcnow() - timedelta(days=1)
+        self.create_event(yesterday)
+        self.create_event(yesterday)
+        self.create_event(yesterday, action="edit")
+        self.create_event(utcnow())
+
+        events.maintain_events()
+        events.maintain_events()
+
+        counts = db.session.execute(select(EventDailyCount.day, EventDailyCount.action, EventDailyCount.count)).all()
+        self.assertEqual(
+            sorted([(yesterday.date(), "edit", 1), (yesterday.date(), "view", 2)]),
+            sorted(tuple(count) for count in counts),
+        )
@@ -0,0 +1,175 @@
+from unittest import TestCase
+
+from mock import patch
+from rq import Connection
+
+from redash import rq_redis_connection
+from redash.tasks import Queue
+from redash.tasks.queries import fair_share
+from redash.tasks.queries.execution import enqueue_query
+from tests import BaseTestCase
+
+
+class TestDeficitRoundRobin(TestCase):
+    def test_alternates_between_backlogged_tenants(self):
+        picked, order = fair_share.deficit_round_robin(["a", "b"], {"a": 10, "b": 10}, {}, {}, 4)
+        self.assertEqual(["a", "b", "a", "b"], picked)
+        self.assertEqual(["a", "b"], order)
+
+    def test_respects_weights(self):
+        picked, _ = fair_share.deficit_round_robin(["a", "b"], {"a": 30, "b": 30}, {"a": 2, "b": 0.5}, {}, 25)
+        self.assertEqual(20, picked.count("a"))
+        self.assertEqual(5, picked.count("b"))
+
+    def test_drops_drained_tenants(self):
+        deficits = {}
+        picked, order = fair_share.deficit_round_robin(["a", "b"], {"a": 1, "b": 5}, {}, deficits, 10)
+        self.assertEqual(["a", "b", "b", "b", "b", "b"], picked)
+        self.assertEqual([], order)
+        self.assertEqual({}, deficits)
+
+    def test_resumes_interrupted_turn(self):
+        deficits = {}
+        picked, order = fair_share.deficit_round_robin(["a", "b"], {"a": 5, "b": 5}, {"a": 3}, deficits, 2)
+        self.assertEqual(["a", "a"], picked)
+
+        picked, order = fair_share.deficit_round_robin(order, {"a": 3, "b": 5}, {"a": 3}, deficits, 2)
+        self.assertEqual(["a", "b"], picked)
+
+
+class TestHierarchicalRoundRobin(TestCase):
+    def test_shares_between_orgs_regardless_of_their_users(self):
+        user_orders = {"big": ["u{}".format(i) for i in range(10)], "small": ["s"]}
+        backlogs = {"big": {user: 5 for user in user_orders["big"]}, "small": {"s": 5}}
+
+        picked, order = fair_share.hierarchical_round_robin(
+            ["big", "small"], user_orders, backlogs, ({}, {}), ({}, {}), 10
+        )
+
+        self.assertEqual(5, [org for org, _ in picked].count("small"))
+        self.assertEqual(["u0", "u1", "u2", "u3", "u4"], [user for org, user in picked if org == "big"])
+        self.assertEqual(["big"], order)
+        self.assertEqual([], user_orders["small"])
+
+    def test_respects_org_and_user_weights(self):
+        user_orders = {"a": ["x", "y"], "b": ["z"]}
+        backlogs = {"a": {"x": 30, "y": 30}, "b": {"z": 30}}
+
+        picked, _ = fair_share.hierarchical_round_robin(
+            ["a", "b"], user_orders, backlogs, ({"a": 2}, {"a": {"x": 3}}), ({}, {}), 24
+        )
+
+        self.assertEqual(8, picked.count(("b", "z")))
+        self.assertEqual(12, picked.count(("a", "x")))
+        self.assertEqual(4, picked.count(("a", "y")))
+
+
+class TestSimulate(TestCase):
+    def test_fair_share_protects_light_users_from_a_burst(self):
+        jobs = [("heavy", 0.0, 10.0) for _ in range(200)]
+        jobs += [("light-{}".format(i), 1.0 + i, 10.0) for i in range(3)]
+
+        fifo = fair_share.simulate(jobs, workers=4, fair=False)
+        drr = fair_share.simulate(jobs, workers=4, fair=True)
+
+        for tenant in ["light-0", "light-1", "light-2"]:
+            self.assertLess(drr["tenants"][tenant]["mean_wait"], 20)
+            self.assertGreater(fifo["tenants"][tenant]["mean_wait"], 400)
+
+        self.assertGreater(drr["fairness"], fifo["fairness"])
+        self.assertEqual(fifo["makespan"], drr["makespan"])
+
+    def test_fair_share_is_per_org(self):
+        jobs = [("big:{}".format(user), 0.0, 10.0) for user in range(10) for _ in range(20)]
+        jobs += [("small:user", 0.0, 10.0) for _ in range(20)]
+
+        fifo = fair_share.simulate(jobs, workers=4, fair=False)
+        drr = fair_share.simulate(jobs, workers=4, fair=True)
+
+        self.assertLess(drr["tenants"]["small:user"]["mean_wait"], 50)
+        self.assertGreater(fifo["tenants"]["small:user"]["mean_wait"], 500)
+        self.assertGreater(drr["fairness"], 0.99)
+
+
+@patch("redash.settings.FAIR_SHARE_ENABLED", True)
+@patch("redash.settings.FAIR_SHARE_MAX_QUEUED_JOBS", 2)
+class TestFairShareDispatch(BaseTestCase):
+    def tearDown(self):
+        with Connection(rq_redis_connection):
+            Queue("queries").empty()
+            Queue("queries_slow").empty()
+        super().tearDown()
+
+    def enqueue(self, query_text, user):
+        return enqueue_query(query_text, self.factory.data_source, user.id, False, None, {"Username": user.email})
+
+    def test_holds_jobs_beyond_queue_capacity(self):
+        user = self.factory.user
+
+        with Connection(rq_redis_connection):
+            jobs = [self.enqueue("SELECT {}".format(i), user) for i in range(5)]
+            queue = Queue("queries")
+
+            self.assertEqual(2, len(queue))
+            self.assertEqual(3, len(fair_share.pending_job_ids("queries")))
+            self.assertEqual([j.id for j in jobs[:2]], queue.job_ids)
+
+    def test_interleaves_users(self):
+        heavy = self.factory.user
+        light = self.factory.create_user()
+
+        with Connection(rq_redis_connection):
+            heavy_jobs = [self.enqueue("SELECT {}".format(i), heavy) for i in range(5)]
+            light_job = self.enqueue("SELECT 42", light)
+
+            queue = Queue("queries")
+            queue.empty()
+            fair_share.dispatch("queries")
+
+            self.assertEqual([heavy_jobs[2].id, light_job.id], queue.job_ids)
+
+    def test_interleaves_orgs(self):
+        other_org = self.factory.create_org()
+        data_source = self.factory.create_data_source(org=other_org)
+        users = [self.factory.create_user() for _ in range(3)]
+        other_user = self.factory.create_user(org=other_org)
+
+        with Connection(rq_redis_connection):
+            for i in range(6):
+                self.enqueue("SELECT {}".format(i), users[i % 3])
+            other_job = enqueue_query(
+                "SELECT 42", data_source, other_user.id, False, None, {"Username": other_user.email}
+            )
+
+            queue = Queue("queries")
+            queue.empty()
+            fair_share.dispatch("queries")
+
+            self.assertIn(other_job.id, queue.job_ids)
+
+    @patch("redash.settings.QUERY_LANES_ENABLED", True)
+    @patch("redash.settings.QUERY_LANES_DEFAULT_LANE", "slow")
+    def test_holds_jobs_of_slow_lanes(self):
+        user = self.factory.user
+
+        with Connection(rq_redis_connection):
+            for i in range(3):
+                self.enqueue("SELECT {}".format(i), user)
+
+            self.assertEqual(2, len(Queue("queries_slow")))
+            self.assertEqual(1, len(fair_share.pending_job_ids("queries_slow")))
+            self.assertIn("queries_slow", fair_share.queue_names())
+
+    def test_skips_cancelled_jobs(self):
+        user = self.factory.user
+
+        with Connection(rq_redis_connection):
+            jobs = [self.enqueue("SELECT {}".format(i), user) for i in range(3)]
+            jobs[2].cancel()
+
+            queue = Queue("queries")
+            queue.empty()
+            fair_share.dispatch("queries")
+
+            self.assertEqual([], queue.job_ids)
+            self.assertEqual([], fair_share.pending_job_ids("queries"))
@@ -0,0 +1,118 @@
+from unittest import TestCase
+
+from mock import ANY, patch
+
+from redash import models
+from redash.query_runner.pg import PostgreSQL
+from redash.tasks.queries import incremental
+from redash.tasks.queries.execution import execute_query
+from redash.tasks.queries.maintenance import refresh_queries
+from tests import BaseTestCase
+from tests.tasks.test_queries import fetch_job
+
+COLUMNS = [{"name": "id", "type": "integer"}, {"name": "ts", "type": "datetime"}, {"name": "v", "type": "integer"}]
+
+
+def options(**kwargs):
+    defaults = {
+        "watermark_column": "ts",
+        "parameter": "ts",
+        "mode": "append",
+        "key_columns": [],
+        "window": None,
+        "max_rows": None,
+    }
+    return dict(defaults, **kwargs)
+
+
+class TestMerge(TestCase):
+    previous = {
+        "columns": COLUMNS,
+        "rows": [
+            {"id": 1, "ts": "2024-01-01T10:00:00", "v": 1},
+            {"id": 2, "ts": "2024-01-02T10:00:00", "v": 2},
+        ],
+    }
+
+    def test_appends_new_rows(self):
+        new = {"columns": COLUMNS, "rows": [{"id": 3, "ts": "2024-01-03T10:00:00", "v": 3}]}
+        merged = incremental.merge(self.previous, new, options())
+
+        self.assertEqual([1, 2, 3], [r["id"] for r in merged["rows"]])
+        self.assertEqual("2024-01-03T10:00:00", merged["metadata"]["watermark"])
+        self.assertEqual(1, merged["metadata"]["incremental_rows"])
+
+    def test_upserts_by_key(self):
+        new = {"columns": COLUMNS, "rows": [{"id": 2, "ts": "2024-01-03T10:00:00", "v": 20}]}
+        merged = incremental.merge(self.previous, new, options(mode="upsert", key_columns=["id"]))
+
+        self.assertEqual([(1, 1), (2, 20)], [(r["id"], r["v"]) for r in merged["rows"]])
+
+    def test_trims_rows_outside_window(self):
+        new = {"columns": COLUMNS, "rows": [{"id": 3, "ts": "2024-01-03T10:00:00", "v": 3}]}
+        merged = incremental.merge(self.previous, new, options(window=36 * 3600))
+
+        self.assertEqual([2, 3], [r["id"] for r in merged["rows"]])
+
+    def test_keeps_previous_watermark_when_nothing_is_new(self):
+        merged = incremental.merge(self.previous, {"columns": [], "rows": []}, options(max_rows=1))
+
+        self.assertEqual(COLUMNS, merged["columns"])
+        self.assertEqual([2], [r["id"] for r in merged["rows"]])
+        self.assertEqual("2024-01-02T10:00:00", merged["metadata"]["watermark"])
+
+
+class TestIncrementalRefresh(BaseTestCase):
+    def create_query(self):
+        return self.factory.create_query(
+            query_text="select * from events where ts > '{{ts}}'",
+            schedule={"interval": "600"},
+            options={
+                "parameters": [{"type": "text", "name": "ts", "value": "1970-01-01", "title": "ts"}],
+                "incremental": {"watermark_column": "ts"},
+            },
+        )
+
+    def test_injects_last_watermark(self):
+        query = self.create_query()
+        query.latest_query_data = self.factory.create_query_result(
+            data={"columns": COLUMNS, "rows": [], "metadata": {"watermark": "2024-01-02T10:00:00"}}
+        )
+
+        with patch("redash.tasks.queries.maintenance.enqueue_query") as add_job_mock, patch.object(
+            models.Query, "outdated_queries", staticmethod(lambda: [query])
+        ):
+            refresh_queries()
+
+        add_job_mock.assert_called_with(
+            "select * from events where ts > '2024-01-02T10:00:00'",
+            query.data_source,
+            query.user_id,
+            scheduled_query=query,
+            metadata=ANY,
+        )
+        self.assertEqual("2024-01-02T10:00:00", add_job_mock.call_args[1]["metadata"]["Watermark"])
+
+    @patch("redash.tasks.queries.execution.get_current_job", side_effect=fetch_job)
+    def test_merges_new_rows_into_previous_result(self, _):
+        query = self.create_query()
+        query.latest_query_data = self.factory.create_query_result(
+            query_hash=query.query_hash,
+            data={"columns": COLUMNS, "rows": [{"id": 1, "ts": "2024-01-02T10:00:00", "v": 1}]},
+        )
+        models.db.session.commit()
+
+        with patch.object(PostgreSQL, "run_query") as qr:
+            qr.return_value = ({"columns": COLUMNS, "rows": [{"id": 2, "ts": "2024-01-03T10:00:00", "v": 2}]}, None)
+            result_id = execute_query(
+                "select * from events where ts > '2024-01-02T10:00:00'",
+                query.data_source.id,
+                {"query_id": query.id, "Watermark": "2024-01-02T10:00:00"},
+                scheduled_query_id=query.id,
+            )
+
+        result = models.db.session.get(models.QueryResult, result_id)
+        self.assertEqual(query.query_hash, result.query_hash)
+        self.assertEqual([1, 2], [r["id"] for r in result.data["rows"]])
+        self.assertEqual("2024-01-03T10:00:00", result.data["metadata"]["watermark"])
+        self.assertEqual(result_id, models.Query.get_by_id(query.id).latest_query_data_id)
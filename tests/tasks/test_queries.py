@@ -1,3 +1,5 @@
+import datetime
+
 from mock import Mock, patch
 from rq import Connection
 from rq.exceptions import NoSuchJobError
@@ -11,6 +13,7 @@ from redash.tasks.queries.execution import (
     enqueue_query,
     execute_query,
 )
+from redash.utils import gen_query_hash
 from tests import BaseTestCase
 
 
@@ -22,6 +25,7 @@ def fetch_job(*args, **kwargs):
 
     result = Mock()
     result.id = job_id
+    result.meta = {}
     result.get_status = lambda: JobStatus.STARTED
 
     return result
@@ -187,6 +191,54 @@ class QueryExecutorTests(BaseTestCase):
             result = models.db.session.get(models.QueryResult, result_id)
             self.assertEqual(result.data, query_result_data)
 
+    def test_records_phase_timings(self, _):
+        job = fetch_job()
+        job.enqueued_at = datetime.datetime(2020, 1, 1, 10, 0, 0)
+        job.started_at = datetime.datetime(2020, 1, 1, 10, 0, 5)
+
+        with patch("redash.tasks.queries.execution.get_current_job", return_value=job), patch.object(
+            PostgreSQL, "run_query"
+        ) as qr:
+            qr.return_value = ({"columns": [], "rows": []}, None)
+            result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+
+        result = models.db.session.get(models.QueryResult, result_id)
+        self.assertEqual(5, result.data["metadata"]["timings"]["queue_wait"])
+        self.assertIn("run_query", result.data["metadata"]["timings"])
+        self.assertEqual(
+            {"queue_wait", "run_query", "store", "alerts"},
+            set(job.meta["timings"].keys()),
+        )
+
+    def test_records_fair_share_hold_apart_from_queue_wait(self, _):
+        job = fetch_job()
+        job.meta["fair_share"] = True
+        job.created_at = datetime.datetime(2020, 1, 1, 10, 0, 0)
+        job.enqueued_at = datetime.datetime(2020, 1, 1, 10, 0, 30)
+        job.started_at = datetime.datetime(2020, 1, 1, 10, 0, 35)
+
+        with patch("redash.tasks.queries.execution.get_current_job", return_value=job), patch.object(
+            PostgreSQL, "run_query"
+        ) as qr:
+            qr.return_value = ({"columns": [], "rows": []}, None)
+            execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+
+        self.assertEqual(30, job.meta["timings"]["fair_share_hold"])
+        self.assertEqual(5, job.meta["timings"]["queue_wait"])
+
+    def test_records_runtime_stats(self, _):
+        with patch.object(PostgreSQL, "run_query") as qr:
+            qr.return_value = ({"columns": [], "rows": [{"a": 1}, {"a": 2}]}, None)
+            execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+            qr.return_value = (None, "Oops")
+            execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+
+        stats = models.QueryRuntimeStats.get(self.factory.data_source.id, gen_query_hash("SELECT 1, 2"))
+        self.assertEqual(2, stats.run_count)
+        self.assertEqual(1, stats.failure_count)
+        self.assertEqual(2, stats.last_row_count)
+        self.assertGreater(stats.last_result_bytes, 0)
+
     def test_success_scheduled(self, _):
         """
         Scheduled queries remember their latest results.
@@ -0,0 +1,71 @@
+from mock import patch
+
+from redash import models, redis_connection
+from redash.tasks.queries import lanes
+from redash.tasks.queries.execution import enqueue_query
+from redash.utils import gen_query_hash
+from tests import BaseTestCase
+from tests.tasks.test_queries import create_job, fetch_job
+
+
+@patch("redash.settings.QUERY_LANES_SLOW_THRESHOLD", 60)
+@patch("redash.settings.QUERY_LANES_MIN_RUNS", 2)
+@patch("redash.settings.QUERY_LANES_MAX_OVERRUNS", 2)
+class TestClassify(BaseTestCase):
+    def record_runs(self, *runtimes):
+        for runtime in runtimes:
+            models.QueryRuntimeStats.record_run(self.factory.org.id, self.factory.data_source.id, "abc", runtime)
+
+    def test_uses_default_lane_without_history(self):
+        self.record_runs(120)
+
+        self.assertEqual(lanes.FAST, lanes.classify(self.factory.data_source.id, "abc"))
+        with patch("redash.settings.QUERY_LANES_DEFAULT_LANE", lanes.SLOW):
+            self.assertEqual(lanes.SLOW, lanes.classify(self.factory.data_source.id, "abc"))
+
+    def test_routes_by_p95_runtime(self):
+        self.record_runs(1, 2)
+        self.assertEqual(lanes.FAST, lanes.classify(self.factory.data_source.id, "abc"))
+
+        self.record_runs(120)
+        self.assertEqual(lanes.SLOW, lanes.classify(self.factory.data_source.id, "abc"))
+
+    def test_moves_overrunning_queries_to_slow_lane(self):
+        self.record_runs(1, 2)
+
+        lanes.record_run(lanes.FAST, "queries", self.factory.data_source.id, "abc", 100)
+        self.assertEqual(lanes.FAST, lanes.classify(self.factory.data_source.id, "abc"))
+
+        lanes.record_run(lanes.FAST, "queries", self.factory.data_source.id, "abc", 100)
+        self.assertEqual(lanes.SLOW, lanes.classify(self.factory.data_source.id, "abc"))
+
+        lanes.record_run(lanes.SLOW, "queries_slow", self.factory.data_source.id, "abc", 5)
+        self.assertEqual(lanes.FAST, lanes.classify(self.factory.data_source.id, "abc"))
+        self.assertIsNone(redis_connection.get(lanes._overruns_key(self.factory.data_source.id, "abc")))
+
+
+@patch("redash.settings.QUERY_LANES_ENABLED", True)
+@patch("redash.settings.QUERY_LANES_MIN_RUNS", 1)
+@patch("redash.tasks.queries.execution.Job.fetch", side_effect=fetch_job)
+@patch("redash.tasks.queries.execution.Queue.enqueue", side_effect=create_job)
+class TestEnqueueLanes(BaseTestCase):
+    def test_enqueues_slow_queries_in_slow_lane(self, enqueue, _):
+        query = self.factory.create_query(query_text="SELECT pg_sleep(120)")
+        models.QueryRuntimeStats.record_run(
+            self.factory.org.id, query.data_source.id, gen_query_hash(query.query_text), 120
+        )
+
+        enqueue_query(query.query_text, query.data_source, query.user_id, False, query, {"query_id": query.id})
+
+        _, kwargs = enqueue.call_args
+        self.assertEqual("scheduled_queries_slow", enqueue.call_args[0][3]["Queue"])
+        self.assertEqual(lanes.SLOW, kwargs["meta"]["lane"])
+
+    def test_enqueues_new_queries_in_default_lane(self, enqueue, _):
+        query = self.factory.create_query(query_text="SELECT 1")
+
+        enqueue_query(query.query_text, query.data_source, query.user_id, False, None, {"query_id": query.id})
+
+        _, kwargs = enqueue.call_args
+        self.assertEqual("queries", enqueue.call_args[0][3]["Queue"])
+        self.assertEqual(lanes.FAST, kwargs["meta"]["lane"])
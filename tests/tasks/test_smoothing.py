@@ -0,0 +1,78 @@
+import datetime
+from unittest import TestCase
+
+from mock import patch
+
+from redash import models
+from redash.tasks.queries import smoothing
+from redash.tasks.queries.maintenance import refresh_queries
+from redash.utils import utcnow
+from tests import BaseTestCase
+
+ENQUEUE_QUERY = "redash.tasks.queries.maintenance.enqueue_query"
+
+
+def hourly(query_id, previous):
+    return smoothing.SimulatedQuery(query_id, {"interval": "3600", "time": None, "day_of_week": None}, 0, previous)
+
+
+class TestAssignPhases(TestCase):
+    def test_spreads_queries_that_run_in_phase(self):
+        start, end = smoothing.simulation_window(60, now=utcnow().replace(minute=0, second=0, microsecond=0))
+        queries = [hourly(i, start - datetime.timedelta(minutes=30)) for i in range(120)]
+
+        before = smoothing.load_curve(queries, start, end, 60)
+        phases = smoothing.assign_phases(queries, start, end, 60)
+        after = smoothing.load_curve(queries, start, end, 60, phases)
+
+        self.assertEqual(120, max(before))
+        self.assertEqual(2, max(after[60:]))
+        self.assertEqual(set(range(0, 3600, 60)), set(phases.values()))
+
+    def test_keeps_queries_in_place_when_load_is_even(self):
+        start, end = smoothing.simulation_window(60, now=utcnow().replace(minute=0, second=0, microsecond=0))
+        queries = [hourly(i, start - datetime.timedelta(minutes=i * 10)) for i in range(6)]
+
+        phases = smoothing.assign_phases(queries, start, end, 60)
+
+        self.assertEqual(sorted(phases.values()), [0, 600, 1200, 1800, 2400, 3000])
+
+
+class TestEnqueueBudget(TestCase):
+    @patch("redash.settings.SCHEDULE_MAX_ENQUEUE_RATE", 0)
+    def test_unlimited_by_default(self):
+        self.assertIsNone(smoothing.enqueue_budget(None, 100))
+
+    @patch("redash.settings.SCHEDULE_MAX_ENQUEUE_RATE", 120)
+    def test_scales_with_time_since_previous_run(self):
+        self.assertEqual(120, smoothing.enqueue_budget(None, 100))
+        self.assertEqual(60, smoothing.enqueue_budget("70", 100))
+        self.assertEqual(120, smoothing.enqueue_budget("0", 1000))
+
+
+class TestSmoothing(BaseTestCase):
+    def test_save_phases_reschedules_queries(self):
+        query = self.factory.create_query(
+            schedule={"interval": "3600", "time": None, "until": None, "day_of_week": None}
+        )
+        models.Query.outdated_queries()
+        query.next_run_at = utcnow() + datetime.timedelta(hours=1)
+        models.db.session.commit()
+
+        smoothing.save_phases({query.id: 120}, [query.id])
+
+        self.assertEqual({query.id: 120}, models.scheduled_queries_phases.get([query.id]))
+        self.assertLess(models.Query.get_by_id(query.id).next_run_at, utcnow())
+
+    @patch("redash.settings.SCHEDULE_MAX_ENQUEUE_RATE", 1)
+    def test_refresh_queries_defers_queries_beyond_the_rate(self):
+        query = self.factory.create_query()
+        query2 = self.factory.create_query(query_text="select 42;")
+
+        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(
+            models.Query, "outdated_queries", staticmethod(lambda: [query, query2])
+        ):
+            refresh_queries()
+
+        self.assertEqual(1, add_job_mock.call_count)
+        self.assertEqual(query, add_job_mock.call_args[1]["scheduled_query"])
@@ -9,11 +9,12 @@ import jwt
 import requests
 from flask import request
 from mock import Mock, patch
+from sqlalchemy import event
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql.expression import select
 
 import redash.authentication as auth
-from redash import models, settings
+from redash import models, redis_connection, settings
 from redash.authentication.google_oauth import (
     create_and_login_user,
     verify_profile,
@@ -89,6 +90,109 @@ class TestApiKeyAuthentication(BaseTestCase):
             self.assertEqual(404, rv.status_code)
 
 
+class TestCachedApiKeyAuthentication(BaseTestCase):
+    def setUp(self):
+        super(TestCachedApiKeyAuthentication, self).setUp()
+        self.user = self.factory.create_user(api_key="user_key")
+        models.db.session.commit()
+        self.queries_url = "/{}/api/queries".format(self.factory.org.slug)
+
+    def load_user(self, api_key):
+        with self.app.test_client() as c:
+            c.get(self.queries_url, query_string={"api_key": api_key})
+            return auth.api_key_load_user_from_request(request)
+
+    def test_resolves_cached_api_keys_without_looking_them_up(self):
+        self.assertEqual(self.user.id, self.load_user("user_key").id)
+
+        with patch.object(models.User, "get_by_api_key_and_org") as get_by_api_key_and_org:
+            self.assertEqual(self.user.id, self.load_user("user_key").id)
+
+        get_by_api_key_and_org.assert_not_called()
+
+    def load_user_without_statements(self, api_key):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.test_client() as c:
+            c.get(self.queries_url, query_string={"api_key": api_key})
+            event.listen(models.db.engine, "before_cursor_execute", before_cursor_execute)
+            try:
+                user = auth.api_key_load_user_from_request(request)
+            finally:
+                event.remove(models.db.engine, "before_cursor_execute", before_cursor_execute)
+
+        self.assertEqual([], statements)
+        return user
+
+    def test_cache_hit_issues_no_statements(self):
+        self.load_user("user_key")
+
+        user = self.load_user_without_statements("user_key")
+
+        self.assertEqual(self.user.id, user.id)
+        self.assertEqual(self.factory.org.id, user.org_id)
+        self.assertEqual(self.user.group_ids, user.group_ids)
+        self.assertFalse(user.is_disabled)
+        self.assertEqual(self.user.name, user.name)
+
+    def test_cache_hit_of_api_key_issues_no_statements(self):
+        api_key = self.factory.create_api_key()
+        models.db.session.commit()
+        self.load_user(api_key.api_key)
+
+        user = self.load_user_without_statements(api_key.api_key)
+
+        self.assertEqual(api_key.api_key, user.id)
+        self.assertEqual(self.factory.org.id, user.org_id)
+        self.assertEqual(api_key.object_id, user.object.id)
+
+    def test_sees_versions_bumped_by_other_processes(self):
+        self.load_user("user_key")
+        redis_connection.set(models.api_key_principals.VERSION_KEY, "bumped by another process")
+
+        with patch.object(auth, "user_from_principal") as user_from_principal:
+            self.load_user("user_key")
+            user_from_principal.assert_called_once()
+            user_from_principal.reset_mock()
+
+            later = time.time() + models.api_key_principals.VERSION_INTERVAL
+            with patch("time.time", return_value=later):
+                self.assertEqual(self.user.id, self.load_user("user_key").id)
+            user_from_principal.assert_not_called()
+
+    def test_regenerating_api_key_invalidates_cache(self):
+        self.load_user("user_key")
+
+        self.user.regenerate_api_key()
+        models.db.session.commit()
+
+        self.assertIsNone(self.load_user("user_key"))
+        self.assertEqual(self.user.id, self.load_user(self.user.api_key).id)
+
+    def test_disabling_user_invalidates_cache(self):
+        self.load_user("user_key")
+
+        self.user.disable()
+        models.db.session.commit()
+
+        with patch.object(auth, "user_from_principal") as user_from_principal:
+            self.assertIsNone(self.load_user("user_key"))
+
+        user_from_principal.assert_not_called()
+
+    @patch("redash.settings.API_KEY_CACHE_TTL", 0)
+    def test_disabled_cache(self):
+        self.load_user("user_key")
+
+        with patch.object(models.api_key_principals, "get") as get:
+            self.assertEqual(self.user.id, self.load_user("user_key").id)
+
+        get.assert_not_called()
+
+
 class TestHMACAuthentication(BaseTestCase):
     #
     # This is a bad way to write these tests, but the way Flask works doesn't make it easy to write them properly...
@@ -3,6 +3,7 @@ import datetime
 from unittest import TestCase
 
 from dateutil.parser import parse as date_parse
+from mock import patch
 from sqlalchemy.sql.expression import select
 
 from redash import models
@@ -135,6 +136,19 @@ class ShouldScheduleNextTest(TestCase):
         two_hours_ago = now - datetime.timedelta(hours=2)
         self.assertFalse(models.should_schedule_next(two_hours_ago, now, "3600", failures=32))
 
+    def test_exact_time_with_offset(self):
+        previous = date_parse("2015-10-15 23:00")
+        self.assertEqual(
+            models.next_scheduled_run(previous, "86400", "23:00", offset=300), date_parse("2015-10-16 23:05")
+        )
+
+    def test_interval_with_offset_keeps_to_slot(self):
+        previous = date_parse("2015-10-16 20:00:07+00:00")
+        self.assertEqual(models.next_scheduled_run(previous, "3600", offset=900), date_parse("2015-10-16 21:15+00:00"))
+
+        previous = date_parse("2015-10-16 21:15:04+00:00")
+        self.assertEqual(models.next_scheduled_run(previous, "3600", offset=900), date_parse("2015-10-16 22:15+00:00"))
+
 
 class QueryOutdatedQueriesTest(BaseTestCase):
     def schedule(self, **kwargs):
@@ -172,6 +186,16 @@ class QueryOutdatedQueriesTest(BaseTestCase):
 
         self.assertIn(query, queries)
 
+    def test_outdated_queries_of_given_queries(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, hours=2)
+        other_query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(other_query, hours=2)
+
+        queries = models.Query.outdated_queries(query_ids=[query.id])
+
+        self.assertEqual([query], queries)
+
     def test_outdated_queries_works_scheduled_queries_tracker(self):
         query = self.create_scheduled_query(interval="3600")
         self.fake_previous_execution(query, hours=2)
@@ -312,6 +336,97 @@ class QueryOutdatedQueriesTest(BaseTestCase):
         queries = models.Query.outdated_queries()
         self.assertNotIn(query, queries)
 
+    def test_pushes_next_run_at_of_fresh_queries(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+        retrieved_at = query.latest_query_data.retrieved_at
+        db.session.flush()
+        updated_at = query.updated_at
+
+        self.assertNotIn(query, models.Query.outdated_queries())
+        db.session.flush()
+        self.assertEqual(query.next_run_at, retrieved_at + datetime.timedelta(hours=1))
+        self.assertEqual(query.updated_at, updated_at)
+
+    def test_skips_queries_not_due_by_next_run_at(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, hours=2)
+        db.session.flush()
+        query.next_run_at = utcnow() + datetime.timedelta(minutes=5)
+
+        self.assertNotIn(query, models.Query.outdated_queries())
+
+    def test_schedule_change_resets_next_run_at(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+        self.assertNotIn(query, models.Query.outdated_queries())
+
+        query.schedule = self.schedule(interval="60")
+
+        self.assertIn(query, models.Query.outdated_queries())
+
+    @patch("redash.settings.SCHEDULE_JITTER_WINDOW", 600)
+    def test_jitter_delays_exact_time_schedules(self):
+        five_minutes_ago = utcnow() - datetime.timedelta(minutes=5)
+        query = self.create_scheduled_query(interval="86400", time=five_minutes_ago.strftime("%H:%M"))
+        self.fake_previous_execution(query, days=1, minutes=5)
+
+        with patch("redash.models.schedule_jitter", return_value=599):
+            self.assertNotIn(query, models.Query.outdated_queries())
+
+        self.assertGreater(query.next_run_at, utcnow())
+
+    @patch("redash.settings.DEMAND_SCHEDULING_ENABLED", True)
+    def test_demand_driven_scheduling(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, hours=2)
+        query.latest_query_data.runtime = 1800
+        query.created_at = utcnow() - datetime.timedelta(days=100)
+        db.session.flush()
+
+        # Not accessed for 45 days: runs every 4 hours instead of every hour.
+        models.query_accesses.update({query.id: utcnow() - datetime.timedelta(days=45)})
+        self.assertNotIn(query, models.Query.outdated_queries())
+        self.assertEqual(models.query_accesses.skipped(), {"runs": 1, "seconds": 1800})
+
+        self.fake_previous_execution(query, hours=5)
+        self.assertIn(query, models.Query.outdated_queries())
+
+        # Accessed again: back to every hour.
+        self.fake_previous_execution(query, hours=2)
+        models.query_accesses.update({query.id: utcnow()})
+        self.assertIn(query, models.Query.outdated_queries())
+
+    @patch("redash.settings.DEMAND_SCHEDULING_ENABLED", True)
+    def test_demand_driven_scheduling_suspends_idle_queries(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, days=10)
+        query.created_at = utcnow() - datetime.timedelta(days=100)
+
+        self.assertNotIn(query, models.Query.outdated_queries())
+        self.assertGreater(query.next_run_at, utcnow())
+
+        self.factory.create_alert(query=query)
+        query.next_run_at = utcnow()
+        self.assertIn(query, models.Query.outdated_queries())
+
+    def test_returns_most_overdue_queries_first(self):
+        query = self.create_scheduled_query(interval="3600")
+        query2 = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, hours=2)
+        self.fake_previous_execution(query2, hours=3)
+
+        self.assertEqual(models.Query.outdated_queries(), [query2, query])
+
+    def test_clears_next_run_at_of_disabled_schedules(self):
+        query = self.create_scheduled_query(disabled=True)
+        models.Query.outdated_queries()
+        self.assertIsNone(query.next_run_at)
+
+        query.schedule = None
+        db.session.flush()
+        self.assertIsNone(query.next_run_at)
+
 
 class QueryArchiveTest(BaseTestCase):
     def test_archive_query_sets_flag(self):